@@ -1,5 +1,5 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.template.loader import render_to_string
 from django.utils.translation import gettext as _
 
@@ -142,36 +142,43 @@ class AdminTask(models.Model):
             send_email_new_assigned_admin(self)
 
     def mark_completed(self):
+        from admin.sequences.models import ConditionTriggerCounter
         from admin.sequences.tasks import process_condition
 
-        self.completed = True
-        self.save()
-
         # Get conditions with this to do item as (part of the) condition
         conditions = self.new_hire.conditions.filter(
             condition_admin_tasks=self.based_on
         )
 
-        for condition in conditions:
-            condition_admin_tasks_id = condition.condition_admin_tasks.values_list(
-                "id", flat=True
+        with transaction.atomic():
+            # Lock the task and the other tasks of the new hire that are based on the
+            # same admin task, so two requests can't both count as the first one
+            tasks = AdminTask.objects.filter(id=self.id)
+            if self.based_on is not None:
+                tasks = AdminTask.objects.filter(
+                    new_hire=self.new_hire, based_on=self.based_on
+                )
+            completed = dict(
+                tasks.select_for_update().order_by("id").values_list("id", "completed")
             )
+            self.completed = True
+            self.save()
+
+            # Only the first completed task per admin task of the sequence counts
+            triggered_condition_ids = []
+            if self.based_on is not None and not any(completed.values()):
+                triggered_condition_ids = (
+                    ConditionTriggerCounter.objects.complete_trigger(
+                        self.new_hire, conditions
+                    )
+                )
 
-            # Check if all admin to do items have been added to new hire and are
-            # completed. If not, then we know it should not be triggered yet
-            completed_tasks = AdminTask.objects.filter(
-                based_on_id__in=condition_admin_tasks_id,
-                new_hire=self.new_hire,
-                completed=True,
+        for condition_id in triggered_condition_ids:
+            # Send notification only if user has a slack account
+            process_condition(
+                condition_id, self.new_hire.id, self.new_hire.has_slack_account
             )
 
-            # If the amount matches, then we should process it
-            if completed_tasks.count() == len(condition_admin_tasks_id):
-                # Send notification only if user has a slack account
-                process_condition(
-                    condition.id, self.new_hire.id, self.new_hire.has_slack_account
-                )
-
     class Meta:
         ordering = ["completed", "date"]
 
@@ -1,8 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+from unittest.mock import patch
+
 import pytest
 from django.core.cache import cache
+from django.db import connections
 from django.urls import reverse
 
 from admin.admin_tasks.models import AdminTask
+from admin.sequences.models import ConditionTriggerCounter
 
 
 @pytest.mark.django_db
@@ -459,3 +466,61 @@ def test_complete_admin_task_trigger_condition(
 
     # we now have 3 tasks
     assert AdminTask.objects.filter(new_hire=new_hire).count() == 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_complete_admin_tasks_with_same_based_on(
+    sequence_factory,
+    condition_admin_task_factory,
+    pending_admin_task_factory,
+    admin_task_factory,
+    new_hire_factory,
+):
+    task_to_complete1 = pending_admin_task_factory()
+    task_to_complete2 = pending_admin_task_factory()
+    task_to_be_created = pending_admin_task_factory()
+    sequence = sequence_factory()
+    admin_task_condition = condition_admin_task_factory()
+    admin_task_condition.condition_admin_tasks.set(
+        [task_to_complete1, task_to_complete2]
+    )
+    admin_task_condition.admin_tasks.add(task_to_be_created)
+    sequence.conditions.add(admin_task_condition)
+
+    new_hire = new_hire_factory()
+    new_hire.add_sequences([sequence])
+    # the same admin task got assigned twice
+    duplicate1 = admin_task_factory(new_hire=new_hire, based_on=task_to_complete1)
+    duplicate2 = admin_task_factory(new_hire=new_hire, based_on=task_to_complete1)
+
+    # Both get completed at the same time, the first one is still busy counting when
+    # the second one starts
+    first_counting = Event()
+    complete_trigger = ConditionTriggerCounter.objects.complete_trigger
+
+    def slow_complete_trigger(*args, **kwargs):
+        triggered = complete_trigger(*args, **kwargs)
+        if not first_counting.is_set():
+            first_counting.set()
+            sleep(0.5)
+        return triggered
+
+    def complete(task):
+        try:
+            if task.id == duplicate2.id:
+                first_counting.wait(5)
+            task.mark_completed()
+        finally:
+            connections.close_all()
+
+    with patch.object(
+        ConditionTriggerCounter.objects, "complete_trigger", slow_complete_trigger
+    ):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(complete, [duplicate1, duplicate2]))
+
+    # only one of them counts for the condition
+    assert not AdminTask.objects.filter(based_on=task_to_be_created).exists()
+
+    admin_task_factory(new_hire=new_hire, based_on=task_to_complete2).mark_completed()
+    assert AdminTask.objects.filter(based_on=task_to_be_created).count() == 1
@@ -4,9 +4,12 @@ from admin.integrations.exceptions import (
 )
 
 from admin.integrations.utils import get_value_from_notation
+from django.conf import settings
+from django.db import connections
 from django.utils.translation import gettext_lazy as _
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -92,42 +95,98 @@ class PaginatedResponse:
         self.integration.params["NEXT_PAGE_TOKEN"] = token
         return self.integration._replace_vars(next_page)
 
-    def get_data_from_paginated_response(self):
+    def _get_next_response(self, next_page_url):
+        success, response = self.integration.run_request(
+            {"method": "GET", "url": next_page_url}
+        )
+        if not success:
+            raise FailedPaginatedResponseError(
+                _("Paginated URL fetch: %(response)s")
+                % {"response": self.integration.clean_response(response)}
+            )
+
+        # Check if there are any new results. Google could send no users back
+        try:
+            data_from = self.integration.manifest["data_from"]
+            get_value_from_notation(data_from, response.json())
+        except KeyError:
+            return None
+        return response
+
+    def _prefetch_next_response(self, next_page_url):
+        try:
+            return self._get_next_response(next_page_url)
+        finally:
+            # the thread gets its own database connection, don't leave it open
+            connections.close_all()
+
+    def iter_pages(self, max_pages=None, prefetch=False):
+        """
+        Yield the users page by page, so only one page has to be kept in memory.
+
+        :param max_pages int: stop after this amount of pages, all pages if `None`.
+            Never more than `INTEGRATION_MAX_PAGES`.
+        :param prefetch bool: fetch the next page while the current one is processed
+        """
+        if max_pages is None or max_pages > settings.INTEGRATION_MAX_PAGES:
+            max_pages = settings.INTEGRATION_MAX_PAGES
+
         success, response = self.integration.execute()
         if not success:
             raise FailedPaginatedResponseError(
                 self.integration.clean_response(response)
             )
 
-        users = self.extract_data_from_list_response(response)
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            users = self.extract_data_from_list_response(response)
+            fetched_pages = 1
+            page_urls = set()
+            while True:
+                # The next url is built here, so only the request itself runs in the
+                # other thread (building it writes the token to the params)
+                next_page_url = None
+                if fetched_pages < max_pages:
+                    next_page_url = self.get_next_page(response)
+                if next_page_url in page_urls:
+                    logger.warning(
+                        "Integration %s sent the same next page twice: %s",
+                        self.integration.id,
+                        next_page_url,
+                    )
+                    next_page_url = None
+                if next_page_url is not None:
+                    page_urls.add(next_page_url)
+                    if executor is not None:
+                        next_response = executor.submit(
+                            self._prefetch_next_response, next_page_url
+                        )
+
+                yield users
+
+                if next_page_url is None:
+                    return
+                if executor is not None:
+                    response = next_response.result()
+                else:
+                    response = self._get_next_response(next_page_url)
+                if response is None:
+                    return
+
+                users = self.extract_data_from_list_response(response)
+                fetched_pages += 1
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
+    def get_data_from_paginated_response(self):
+        # All users in one list (to show them). Only the first few pages by default, as
+        # everything has to be rendered
         amount_pages_to_fetch = self.integration.manifest.get(
             "amount_pages_to_fetch", 5
         )
-        fetched_pages = 1
-        while amount_pages_to_fetch != fetched_pages:
-            # End everything if next page does not exist
-            next_page_url = self.get_next_page(response)
-            if next_page_url is None:
-                break
-
-            success, response = self.integration.run_request(
-                {"method": "GET", "url": next_page_url}
-            )
-            if not success:
-                raise FailedPaginatedResponseError(
-                    _("Paginated URL fetch: %(response)s")
-                    % {"response": self.integration.clean_response(response)}
-                )
-
-            # Check if there are any new results. Google could send no users back
-            try:
-                data_from = self.integration.manifest["data_from"]
-                get_value_from_notation(data_from, response.json())
-            except KeyIsNotInDataError:
-                break
-
-            users += self.extract_data_from_list_response(response)
-            fetched_pages += 1
-
-        return users
+        return [
+            user
+            for users in self.iter_pages(max_pages=amount_pages_to_fetch)
+            for user in users
+        ]
@@ -3,19 +3,18 @@ import base64
 import io
 import json
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
-import requests
-
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connections, models
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
-from django.template import Context, Template
-from django.urls import reverse_lazy
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from django_q.models import Schedule
 from django_q.tasks import schedule
@@ -34,6 +33,7 @@ from requests.exceptions import (
 )
 from twilio.rest import Client
 
+from admin.integrations.sessions import IntegrationSessions
 from admin.integrations.utils import get_value_from_notation
 from admin.integrations.serializers import (
     WebhookManifestSerializer,
@@ -43,6 +43,7 @@ from misc.fernet_fields import EncryptedTextField
 from misc.fields import EncryptedJSONField
 from organization.models import Notification
 from organization.utils import send_email_with_notification
+from users.utils import render_template
 
 
 class IntegrationManager(models.Manager):
@@ -206,13 +207,13 @@ class Integration(models.Model):
                 )
 
         try:
-            response = requests.request(
+            response = IntegrationSessions.request(
+                self.id,
                 data.get("method", "POST"),
                 url,
                 headers=self.headers(data.get("headers", {})),
                 data=post_data,
                 files=files_to_send,
-                timeout=120,
             )
         except (InvalidJSONError, JSONDecodeError):
             return False, "JSON is invalid"
@@ -246,18 +247,25 @@ class Integration(models.Model):
 
         return True, response
 
-    def _replace_vars(self, text):
-        params = {} if not hasattr(self, "params") else self.params
-        params["redirect_url"] = settings.BASE_URL + reverse_lazy(
+    @cached_property
+    def oauth_callback_url(self):
+        return settings.BASE_URL + reverse(
             "integrations:oauth-callback", args=[self.id]
         )
+
+    def _replace_vars(self, text):
+        # Steps and pages can be requested from other threads, so the shared params
+        # are never written to here
+        params = {
+            **getattr(self, "params", {}),
+            "redirect_url": self.oauth_callback_url,
+        }
         if hasattr(self, "new_hire") and self.new_hire is not None:
             text = self.new_hire.personalize(text, self.extra_args | params)
             return text
-        t = Template(text)
-        context = Context(self.extra_args | params)
-        text = t.render(context)
-        return text
+        # Manifests are rendered over and over again, the compiled templates are
+        # cached and texts without template tags are returned as is
+        return render_template(text, self.extra_args | params)
 
     @property
     def has_oauth(self):
@@ -396,26 +404,64 @@ class Integration(models.Model):
             response_value = ""
         return value == response_value
 
-    def _polling(self, item, response):
-        polling = item.get("polling")
-        continue_if = item.get("continue_if")
-        interval = polling.get("interval")
-        amount = polling.get("amount")
+    def _schedule_poll(self, params, step, tried, interval):
+        # Store where we are, so the next attempt can continue from there without
+        # keeping a worker busy in the meantime
+        poll = IntegrationPoll.objects.create(
+            integration=self,
+            new_hire=self.new_hire,
+            state={
+                "params": None
+                if params is None
+                else {
+                    key: value
+                    for key, value in params.items()
+                    if key not in ["files", "responses"]
+                },
+                "state": self.params
+                | {
+                    "files": {
+                        name: base64.b64encode(file.getvalue()).decode()
+                        for name, file in self.params["files"].items()
+                    }
+                },
+                "generated": {
+                    item["id"]: self.extra_args[item["id"]]
+                    for item in self.manifest.get("initial_data_form", [])
+                    if item.get("name") == "generate"
+                },
+            },
+        )
+        schedule(
+            "admin.integrations.tasks.resume_integration",
+            poll.id,
+            step,
+            tried,
+            next_run=timezone.now() + timedelta(seconds=interval),
+            schedule_type=Schedule.ONCE,
+        )
 
-        got_expected_result = self._check_condition(response, continue_if)
-        if got_expected_result:
-            return True, response
+    def resume_execute(self, new_hire, poll, step, tried):
+        """
+        Continue an execution that was waiting for a polling step. The poll is
+        created by `_schedule_poll` and is removed once it's picked up.
+        """
+        state = poll.state
+        poll.delete()
+        self.params = state["state"]
+        self.params["files"] = {
+            name: io.BytesIO(base64.b64decode(content))
+            for name, content in self.params["files"].items()
+        }
+        self.new_hire = new_hire
+        self.has_user_context = True
+        self.extra_args |= state["generated"]
 
-        tried = 1
-        while amount > tried:
-            time.sleep(interval)
-            success, response = self.run_request(item)
-            got_expected_result = self._check_condition(response, continue_if)
-            if got_expected_result:
-                return True, response
-            tried += 1
-        # if exceeding the max amounts, then fail
-        return False, response
+        # Renew token if necessary, polling might take a while
+        if not self.renew_key():
+            return False, None
+
+        return self._execute_steps(state["params"], step, tried)
 
     def execute(self, new_hire=None, params=None):
         self.params = params or {}
@@ -437,95 +483,64 @@ class Integration(models.Model):
             if "name" in item and item["name"] == "generate":
                 self.extra_args[item["id"]] = get_random_string(length=10)
 
+        return self._execute_steps(params)
+
+    def _execute_steps(self, params, start=0, tried=0):
+        new_hire = self.new_hire
+        steps = self.manifest["execute"]
+        response = None
+
         # Run all requests
-        for item in self.manifest["execute"]:
+        for group in self._step_groups(start):
+            if len(group) > 1:
+                results = self._run_concurrently(group)
+                for step in group:
+                    if step not in results:
+                        continue
+                    success, response = results[step]
+                    if result := self._process_response(
+                        params, steps[step], success, response
+                    ):
+                        return result
+                continue
+
+            step = group[0]
+            item = steps[step]
+            # precondition has already been checked when the polling started
+            resuming = step == start and tried > 0
             precondition=True
-            if "precondition" in item:
+            if "precondition" in item and not resuming:
                 precondition = self._expected_precondition(item["precondition"])
             if not precondition:
                 continue
-            success, response = self.run_request(item)
-
-            # check if we need to poll before continuing
-            if polling := item.get("polling", False):
-                success, response = self._polling(item, response)
 
-            # check if we need to block this integration based on condition
-            if continue_if := item.get("continue_if", False):
-                got_expected_result = self._check_condition(response, continue_if)
-                if not got_expected_result:
-                    response = self.clean_response(response=response)
-                    Notification.objects.create(
-                        notification_type=Notification.Type.BLOCKED_INTEGRATION,
-                        extra_text=self.name,
-                        created_for=new_hire,
-                        description=f"Execute url ({item['url']}): {response}",
-                    )
-                    return False, response
-
-            # No need to retry or log when we are importing users
-            if not success:
+            polling = item.get("polling", False)
+            while True:
+                success, response = self.run_request(item)
+                if not polling:
+                    break
+
+                # check if we need to poll before continuing
+                tried += 1
+                if self._check_condition(response, item.get("continue_if")):
+                    success = True
+                    break
+                # if exceeding the max amounts, then fail
+                if tried >= polling["amount"]:
+                    success = False
+                    break
                 if self.has_user_context:
-                    response = self.clean_response(response=response)
-                    if polling:
-                        response = "Polling timed out: " + response
-                    Notification.objects.create(
-                        notification_type=Notification.Type.FAILED_INTEGRATION,
-                        extra_text=self.name,
-                        created_for=new_hire,
-                        description=f"Execute url ({item['url']}): {response}",
+                    self._schedule_poll(params, step, tried, polling["interval"])
+                    return None, _(
+                        "Waiting for the integration to finish. You will get a "
+                        "notification once it's done."
                     )
-                # Retry url in one hour
-                try:
-                    schedule(
-                        "admin.integrations.tasks.retry_integration",
-                        new_hire.id,
-                        self.id,
-                        params,
-                        name=(
-                            f"Retrying integration {self.id} for new hire {new_hire.id}"
-                        ),
-                        next_run=timezone.now() + timedelta(hours=1),
-                        schedule_type=Schedule.ONCE,
-                    )
-                except:  # noqa E722
-                    # Only errors when item gets added another time, so we can safely
-                    # let it pass.
-                    pass
-                return False, response
+                # Without a user, the response is needed right away (syncing users)
+                time.sleep(polling["interval"])
+            tried = 0
 
-            # save if file, so we can reuse later
-            save_as_file = item.get("save_as_file")
-            if save_as_file is not None:
-                self.params["files"][save_as_file] = io.BytesIO(response.content)
-
-            # save json response temporarily to be reused in other parts
-            try:
-                self.params["responses"].append(response.json())
-            except:  # noqa E722
-                # if we save a file, then just append an empty dict
-                self.params["responses"].append({})
-
-            # store data coming back from response to the user, so we can reuse in other
-            # integrations
-            if store_data := item.get("store_data", {}):
-                for new_hire_prop, notation_for_response in store_data.items():
-                    try:
-                        value = get_value_from_notation(
-                            notation_for_response, response.json()
-                        )
-                    except KeyError:
-                        return (
-                            False,
-                            f"Could not store data to new hire: {notation_for_response}"
-                            f" not found in {self.clean_response(response.json())}",
-                        )
-
-                    # save to new hire and to temp var `params` on this model for use in
-                    # the same integration
-                    new_hire.extra_fields[new_hire_prop] = value
-                    self.params[new_hire_prop] = value
-                new_hire.save()
+            if result := self._process_response(params, item, success, response):
+                return result
 
         # Run all post requests (notifications)
         for item in self.manifest.get("post_execute_notification", []):
@@ -569,6 +584,149 @@ class Integration(models.Model):
             )
         return True, response
 
+    def _process_response(self, params, item, success, response):
+        # Handle the outcome of a step. Returns the result of the integration when it
+        # can't continue, otherwise `None`
+        new_hire = self.new_hire
+        polling = item.get("polling", False)
+
+        # check if we need to block this integration based on condition
+        if continue_if := item.get("continue_if", False):
+            got_expected_result = self._check_condition(response, continue_if)
+            if not got_expected_result:
+                response = self.clean_response(response=response)
+                Notification.objects.create(
+                    notification_type=Notification.Type.BLOCKED_INTEGRATION,
+                    extra_text=self.name,
+                    created_for=new_hire,
+                    description=f"Execute url ({item['url']}): {response}",
+                )
+                return False, response
+
+        # No need to retry or log when we are importing users
+        if not success:
+            if self.has_user_context:
+                response = self.clean_response(response=response)
+                if polling:
+                    response = "Polling timed out: " + response
+                Notification.objects.create(
+                    notification_type=Notification.Type.FAILED_INTEGRATION,
+                    extra_text=self.name,
+                    created_for=new_hire,
+                    description=f"Execute url ({item['url']}): {response}",
+                )
+            # Retry url in one hour
+            try:
+                schedule(
+                    "admin.integrations.tasks.retry_integration",
+                    new_hire.id,
+                    self.id,
+                    params,
+                    name=(f"Retrying integration {self.id} for new hire {new_hire.id}"),
+                    next_run=timezone.now() + timedelta(hours=1),
+                    schedule_type=Schedule.ONCE,
+                )
+            except:  # noqa E722
+                # Only errors when item gets added another time, so we can safely
+                # let it pass.
+                pass
+            return False, response
+
+        # save if file, so we can reuse later
+        save_as_file = item.get("save_as_file")
+        if save_as_file is not None:
+            self.params["files"][save_as_file] = io.BytesIO(response.content)
+
+        # save json response temporarily to be reused in other parts
+        try:
+            self.params["responses"].append(response.json())
+        except:  # noqa E722
+            # if we save a file, then just append an empty dict
+            self.params["responses"].append({})
+
+        # store data coming back from response to the user, so we can reuse in other
+        # integrations
+        if store_data := item.get("store_data", {}):
+            for new_hire_prop, notation_for_response in store_data.items():
+                try:
+                    value = get_value_from_notation(
+                        notation_for_response, response.json()
+                    )
+                except KeyError:
+                    return (
+                        False,
+                        f"Could not store data to new hire: {notation_for_response}"
+                        f" not found in {self.clean_response(response.json())}",
+                    )
+
+                # save to new hire and to temp var `params` on this model for use in
+                # the same integration
+                new_hire.extra_fields[new_hire_prop] = value
+                self.params[new_hire_prop] = value
+            new_hire.save()
+        return None
+
+    def _step_groups(self, start):
+        # Steps run one by one, unless a step declares which earlier steps it depends
+        # on (`depends_on`). Then it can run together with the steps before it.
+        steps = self.manifest["execute"]
+        step = start
+        while step < len(steps):
+            group = [step]
+            if "polling" not in steps[step]:
+                while step + len(group) < len(steps) and self._can_run_along(
+                    group, step + len(group)
+                ):
+                    group.append(step + len(group))
+            yield group
+            step += len(group)
+
+    def _can_run_along(self, group, step):
+        steps = self.manifest["execute"]
+        item = steps[step]
+        if "depends_on" not in item or "polling" in item:
+            return False
+        if any(dependency >= group[0] for dependency in item["depends_on"]):
+            return False
+
+        # Never run it along with steps that produce something it uses, even if it
+        # wasn't declared
+        text = json.dumps(item)
+        if "responses" in text:
+            return False
+        for other in group:
+            produced = list(steps[other].get("store_data", {})) + [
+                steps[other].get("save_as_file")
+            ]
+            if any(name and name in text for name in produced):
+                return False
+        return True
+
+    def _run_concurrently(self, group):
+        steps = self.manifest["execute"]
+        group = [
+            step
+            for step in group
+            if "precondition" not in steps[step]
+            or self._expected_precondition(steps[step]["precondition"])
+        ]
+        if self.has_user_context:
+            # load it once, instead of in every thread
+            self.new_hire.personalization_context
+
+        def run_request(item):
+            try:
+                return self.run_request(item)
+            finally:
+                # every thread gets its own database connection
+                connections.close_all()
+
+        with ThreadPoolExecutor(
+            max_workers=settings.INTEGRATION_MAX_CONCURRENT_STEPS
+        ) as executor:
+            results = executor.map(run_request, [steps[step] for step in group])
+            return dict(zip(group, results))
+
     def config_form(self, data=None):
         from .forms import IntegrationConfigForm
 
@@ -633,6 +791,17 @@ class Integration(models.Model):
     objects = IntegrationManager()
 
 
+class IntegrationPoll(models.Model):
+    # State of an execution that is waiting for a polling step. It contains
+    # responses, params and generated secrets, so it's kept encrypted and only its
+    # id ends up in the scheduled task. See `Integration._schedule_poll`.
+    integration = models.ForeignKey(Integration, on_delete=models.CASCADE)
+    new_hire = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    state = EncryptedJSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+
+
 @receiver(post_delete, sender=Integration)
 def delete_schedule(sender, instance, **kwargs):
     Schedule.objects.filter(name=instance.schedule_name).delete()
+    IntegrationSessions.close(instance.id)
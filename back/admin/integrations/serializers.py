@@ -72,6 +72,9 @@ class ManifestExecuteSerializer(ValidateMixin, serializers.Serializer):
     save_as_file = serializers.CharField(required=False)
     polling = ManifestPollingSerializer(required=False)
     continue_if = ManifestConditionSerializer(required=False)
+    depends_on = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), required=False
+    )
 
     def validate(self, data):
         # Check that if polling has been filled, that continue_if is also filled
@@ -0,0 +1,79 @@
+import logging
+from http.cookiejar import DefaultCookiePolicy
+from threading import Lock
+from time import monotonic
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class IntegrationSessions:
+    """
+    One `requests.Session` per integration, so the connections to a provider are
+    kept open and reused by all steps of a manifest and all tasks in the same worker.
+    """
+
+    _sessions = {}
+    _lock = Lock()
+
+    # Latency of the requests per integration, in seconds
+    stats = {}
+
+    @classmethod
+    def get(cls, integration_id):
+        with cls._lock:
+            if integration_id not in cls._sessions:
+                cls._sessions[integration_id] = cls._create_session()
+            return cls._sessions[integration_id]
+
+    @staticmethod
+    def _create_session():
+        session = requests.Session()
+        # Requests shouldn't depend on cookies of earlier requests
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            pool_connections=settings.INTEGRATION_POOL_SIZE,
+            pool_maxsize=settings.INTEGRATION_POOL_SIZE,
+            max_retries=Retry(
+                total=settings.INTEGRATION_RETRIES,
+                connect=settings.INTEGRATION_RETRIES,
+                read=0,
+                status=0,
+                backoff_factor=0.5,
+            ),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @classmethod
+    def request(cls, integration_id, method, url, **kwargs):
+        kwargs.setdefault("timeout", settings.INTEGRATION_TIMEOUT)
+        start = monotonic()
+        try:
+            return cls.get(integration_id).request(method, url, **kwargs)
+        finally:
+            cls._add_latency(integration_id, monotonic() - start)
+
+    @classmethod
+    def _add_latency(cls, integration_id, latency):
+        with cls._lock:
+            stats = cls.stats.setdefault(
+                integration_id, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["total"] += latency
+            stats["max"] = max(stats["max"], latency)
+        logger.debug("Request for integration %s took %.3fs", integration_id, latency)
+
+    @classmethod
+    def close(cls, integration_id):
+        with cls._lock:
+            session = cls._sessions.pop(integration_id, None)
+            cls.stats.pop(integration_id, None)
+        if session is not None:
+            session.close()
@@ -18,22 +18,25 @@ class SyncUsers(PaginatedResponse):
     Paginated response is supported.
     """
 
-    def __init__(self, integration):
-        super().__init__(integration)
-        self.users = self.get_data_from_paginated_response()
-
     def run(self):
         action = self.integration.manifest.get("action", "create")
-        if action == "create":
-            new_users = self.get_import_user_candidates()
-            self.create_users(new_users)
+        # Handle the users page by page, so any amount of users can be synced without
+        # keeping them all in memory
+        pages = self.iter_pages(
+            max_pages=self.integration.manifest.get("amount_pages_to_fetch"),
+            prefetch=True,
+        )
+        for users in pages:
+            if action == "create":
+                new_users = self.get_import_user_candidates(users)
+                self.create_users(new_users)
 
-        elif action == "update":
-            self.update_users()
+            elif action == "update":
+                self.update_users(users)
 
-    def update_users(self):
+    def update_users(self, users):
         # Email param is currently hardcoded, no way to change
-        users_dict = {u["email"]: u for u in self.users}
+        users_dict = {u["email"]: u for u in users}
         emails = list(users_dict.keys())
 
         user_objects = get_user_model().objects.filter(email__in=emails)
@@ -65,19 +68,24 @@ class SyncUsers(PaginatedResponse):
         if len(valid_ones):
             self.create_users(valid_ones)
 
-    def get_import_user_candidates(self):
+    def get_import_user_candidates(self, users=None):
+        if users is None:
+            users = self.get_data_from_paginated_response()
+
         # Remove users that are already in the system or have been ignored
-        existing_user_emails = list(
-            get_user_model().objects.all().values_list("email", flat=True)
+        existing_user_emails = set(
+            get_user_model()
+            .objects.filter(email__in=[user_data.get("email") for user_data in users])
+            .values_list("email", flat=True)
         )
-        ignored_user_emails = Organization.objects.get().ignored_user_emails
-        excluded_emails = (
-            existing_user_emails + ignored_user_emails + ["", None]
+        ignored_user_emails = Organization.object.get().ignored_user_emails
+        excluded_emails = existing_user_emails.union(
+            ignored_user_emails, ["", None]
         )  # also add blank emails to ignore
 
         user_candidates = [
             user_data
-            for user_data in self.users
+            for user_data in users
             if user_data.get("email", "") not in excluded_emails
         ]
 
@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 
-from admin.integrations.models import Integration
+from admin.integrations.models import Integration, IntegrationPoll
 from admin.integrations.sync_userinfo import SyncUsers
 
 
@@ -10,6 +10,14 @@ def retry_integration(new_hire_id, integration_id, params):
     integration.execute(new_hire, params)
 
 
+def resume_integration(poll_id, step, tried):
+    # Continue an integration that is polling for a result
+    poll = IntegrationPoll.objects.select_related("integration", "new_hire").get(
+        id=poll_id
+    )
+    poll.integration.resume_execute(poll.new_hire, poll, step, tried)
+
+
 def sync_user_info(integration_id):
     # Depending on the manifest, we wil either sync specific info with the current
     # users or we will add new users. This is done in the background.
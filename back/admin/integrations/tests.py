@@ -1,5 +1,7 @@
+import ast
 import base64
 from datetime import timedelta
+from threading import Barrier
 from unittest.mock import Mock, patch
 
 import pytest
@@ -7,12 +9,15 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import timezone
 from django_q.models import Schedule
+from freezegun import freeze_time
 
+from admin.integrations.sessions import IntegrationSessions
 from admin.integrations.sync_userinfo import SyncUsers
 from admin.integrations.utils import get_value_from_notation
-from admin.integrations.models import Integration
+from admin.integrations.models import Integration, IntegrationPoll
 from organization.models import Notification
 from users.factories import IntegrationUserFactory
+from users.utils import compile_template
 
 
 @pytest.mark.django_db
@@ -818,6 +823,21 @@ def test_integration_save_data_to_user_invalid_lookup(
     assert new_hire.extra_fields == {}
 
 
+def run_scheduled_polls():
+    # Run the polls the scheduler would pick up once their interval passed
+    result = None
+    while poll := Schedule.objects.filter(
+        func="admin.integrations.tasks.resume_integration"
+    ).first():
+        poll.delete()
+        poll_id, step, tried = ast.literal_eval(poll.args)
+        integration_poll = IntegrationPoll.objects.get(id=poll_id)
+        result = integration_poll.integration.resume_execute(
+            integration_poll.new_hire, integration_poll, step, tried
+        )
+    return result
+
+
 @pytest.mark.django_db
 def test_polling_not_getting_correct_state(
     new_hire_factory, custom_integration_factory
@@ -871,6 +891,10 @@ def test_polling_not_getting_correct_state(
         ),
     ) as request_mock:
         success, _response = integration.execute(new_hire, {})
+        # worker is free while waiting for the next attempt
+        assert success is None
+
+        success, _response = run_scheduled_polls()
 
     assert request_mock.call_count == 3
     assert success is False
@@ -878,7 +902,7 @@ def test_polling_not_getting_correct_state(
 
 @pytest.mark.django_db
 @patch(
-    "requests.request",
+    "requests.Session.request",
     Mock(
         return_value=Mock(
             status_code=200,
@@ -887,7 +911,7 @@ def test_polling_not_getting_correct_state(
     ),
 )
 @patch(
-    "requests.request",
+    "requests.Session.request",
     Mock(return_value=Mock(status_code=201)),
 )
 def test_receiving_and_sending_file(new_hire_factory, custom_integration_factory):
@@ -917,7 +941,7 @@ def test_receiving_and_sending_file(new_hire_factory, custom_integration_factory
 
 @pytest.mark.django_db
 @patch(
-    "requests.request",
+    "requests.Session.request",
     Mock(
         return_value=Mock(
             status_code=200,
@@ -926,7 +950,7 @@ def test_receiving_and_sending_file(new_hire_factory, custom_integration_factory
     ),
 )
 @patch(
-    "requests.request",
+    "requests.Session.request",
     Mock(return_value=Mock(status_code=201)),
 )
 def test_receiving_and_sending_file_invalid_lookup(
@@ -998,7 +1022,9 @@ def test_polling_getting_correct_state(new_hire_factory, custom_integration_fact
     )
 
     success, _response = integration.execute(new_hire, {})
+    assert success is None
 
+    success, _response = run_scheduled_polls()
     assert success is True
 
 
@@ -1192,3 +1218,218 @@ def test_integration_sync_data_create_users(
     assert (
         not get_user_model().objects.filter(email="test5@chiefonboarding.com").exists()
     )
+
+
+@pytest.mark.django_db
+@patch("requests.Session.request", return_value=Mock(status_code=200))
+def test_integration_reuses_session(request_mock, settings, custom_integration_factory):
+    settings.INTEGRATION_TIMEOUT = 30
+    integration = custom_integration_factory()
+
+    integration.run_request({"method": "GET", "url": "http://localhost/"})
+    session = IntegrationSessions.get(integration.id)
+    integration.run_request({"method": "POST", "url": "http://localhost/test"})
+
+    assert IntegrationSessions.get(integration.id) is session
+    assert request_mock.call_count == 2
+    assert request_mock.call_args.kwargs["timeout"] == 30
+    assert IntegrationSessions.stats[integration.id]["count"] == 2
+
+    # other integrations get their own connections
+    assert IntegrationSessions.get(custom_integration_factory().id) is not session
+
+    integration_id = integration.id
+    integration.delete()
+    assert integration_id not in IntegrationSessions._sessions
+    assert integration_id not in IntegrationSessions.stats
+
+
+@pytest.mark.django_db
+def test_integration_replace_vars_compiles_once(custom_integration_factory):
+    integration = custom_integration_factory(extra_args={"TOKEN": "123"})
+    compile_template.cache_clear()
+
+    for _ in range(3):
+        assert integration._replace_vars("Bearer {{ TOKEN }}") == "Bearer 123"
+        assert integration._replace_vars("application/json") == "application/json"
+        assert integration._replace_vars("{{ redirect_url }}").endswith(
+            reverse("integrations:oauth-callback", args=[integration.id])
+        )
+
+    # texts without template tags don't get compiled at all
+    assert compile_template.cache_info().misses == 2
+    assert compile_template.cache_info().hits == 4
+
+    # the params shared with other threads are not written to
+    integration.params = {"ID": "1"}
+    assert integration._replace_vars("{{ ID }} {{ redirect_url }}").startswith("1 ")
+    assert integration.params == {"ID": "1"}
+
+
+@pytest.mark.django_db
+@freeze_time("2023-10-10 10:00:00")
+def test_polling_resumes_where_it_stopped(new_hire_factory, custom_integration_factory):
+    new_hire = new_hire_factory()
+    integration = custom_integration_factory(
+        manifest={
+            "initial_data_form": [{"id": "PASSWORD", "name": "generate"}],
+            "execute": [
+                {"url": "http://localhost/create", "save_as_file": "test.png"},
+                {
+                    "url": "http://localhost/status",
+                    "polling": {"interval": 60, "amount": 3},
+                    "continue_if": {"response_notation": "status", "value": "done"},
+                },
+            ],
+        }
+    )
+
+    with patch(
+        "admin.integrations.models.Integration.run_request",
+        Mock(
+            side_effect=[
+                (True, Mock(json=lambda: {"id": 5}, content=b"file")),
+                (True, Mock(json=lambda: {"status": "not_done"})),
+            ]
+        ),
+    ):
+        success, _response = integration.execute(new_hire, {"team": "sales"})
+
+    assert success is None
+    poll = Schedule.objects.get(func="admin.integrations.tasks.resume_integration")
+    assert poll.next_run == timezone.now() + timedelta(seconds=60)
+
+    # Only a reference to the state ends up in the (unencrypted) schedule
+    password = integration.extra_args["PASSWORD"]
+    assert password not in poll.args
+    assert "sales" not in poll.args
+    poll_id, step, tried = ast.literal_eval(poll.args)
+    assert step == 1
+    assert tried == 1
+    state = IntegrationPoll.objects.get(id=poll_id).state
+    assert state["params"]["team"] == "sales"
+    assert state["state"]["responses"] == [{"id": 5}]
+    assert state["state"]["files"] == {"test.png": "ZmlsZQ=="}
+    assert state["generated"]["PASSWORD"] == password
+
+    # only the polling step is run again
+    with patch(
+        "admin.integrations.models.Integration.run_request",
+        Mock(return_value=(True, Mock(json=lambda: {"status": "done"}))),
+    ) as request_mock:
+        success, _response = run_scheduled_polls()
+
+    assert success is True
+    assert request_mock.call_count == 1
+    assert Notification.objects.filter(
+        notification_type=Notification.Type.RAN_INTEGRATION
+    ).exists()
+    assert not IntegrationPoll.objects.exists()
+
+
+@pytest.mark.django_db
+def test_integration_runs_independent_steps_concurrently(
+    new_hire_factory, custom_integration_factory
+):
+    new_hire = new_hire_factory()
+    integration = custom_integration_factory(
+        manifest={
+            "execute": [
+                {"url": "http://localhost/user", "store_data": {"user_id": "url"}},
+                {"url": "http://localhost/group/1", "depends_on": [0]},
+                {"url": "http://localhost/group/2", "depends_on": [0]},
+                # uses data of the previous step, even though it's not declared
+                {"url": "http://localhost/{{ responses.2.url }}", "depends_on": [0]},
+            ]
+        }
+    )
+    steps = integration.manifest["execute"]
+    assert list(integration._step_groups(0)) == [[0], [1, 2], [3]]
+    assert list(integration._step_groups(2)) == [[2], [3]]
+
+    # first step produces `user_id`, so the second one can't run along with it
+    steps[1] |= {"url": "http://localhost/group/{{ user_id }}", "depends_on": []}
+    steps[2]["depends_on"] = []
+    assert list(integration._step_groups(0)) == [[0], [1, 2], [3]]
+
+    steps[1]["url"] = "http://localhost/group/1"
+    assert list(integration._step_groups(0)) == [[0, 1, 2], [3]]
+
+    # both group requests need to run at the same time to get past the barrier
+    barrier = Barrier(2, timeout=5)
+
+    def run_request(item):
+        if "group" in item["url"]:
+            barrier.wait()
+        return True, Mock(json=lambda: {"url": item["url"]})
+
+    with patch(
+        "admin.integrations.models.Integration.run_request", side_effect=run_request
+    ):
+        success, _response = integration.execute(new_hire, {})
+
+    assert success is True
+    # responses are in the order of the steps
+    assert integration.params["responses"] == [{"url": step["url"]} for step in steps]
+
+
+@pytest.mark.django_db
+def test_integration_sync_users_page_by_page(settings, custom_integration_factory):
+    def run_request(data):
+        page = int(data["url"].split("=")[-1]) if "=" in data["url"] else 1
+        response = {
+            "users": [{"email": f"test{page}@chiefonboarding.com", "name": "test"}]
+        }
+        if page < 7:
+            response["next"] = page + 1
+        return True, Mock(json=lambda: response)
+
+    integration = custom_integration_factory(
+        manifest_type=Integration.ManifestType.SYNC_USERS,
+        manifest={
+            "execute": [{"url": "http://localhost/"}],
+            "data_from": "users",
+            "action": "create",
+            "data_structure": {
+                "first_name": "name",
+                "last_name": "name",
+                "email": "email",
+            },
+            "next_page_token_from": "next",
+            "next_page": "http://localhost/?page={{ NEXT_PAGE_TOKEN }}",
+        },
+    )
+
+    with patch(
+        "admin.integrations.models.Integration.run_request", side_effect=run_request
+    ), patch.object(
+        SyncUsers, "create_users", side_effect=SyncUsers.create_users, autospec=True
+    ) as create_users:
+        SyncUsers(integration).run()
+
+    # no page limit when syncing and every page is saved on its own
+    assert create_users.call_count == 7
+    assert get_user_model().objects.filter(email__startswith="test").count() == 7
+
+    # showing the users is limited to the first pages
+    with patch(
+        "admin.integrations.models.Integration.run_request", side_effect=run_request
+    ):
+        assert len(SyncUsers(integration).get_data_from_paginated_response()) == 5
+
+    # never more pages than the hard limit
+    settings.INTEGRATION_MAX_PAGES = 3
+    with patch(
+        "admin.integrations.models.Integration.run_request", side_effect=run_request
+    ) as request_mock:
+        assert len(SyncUsers(integration).get_data_from_paginated_response()) == 3
+    assert request_mock.call_count == 3
+
+    # stops when the api keeps sending the same next page
+    settings.INTEGRATION_MAX_PAGES = 1000
+    with patch(
+        "admin.integrations.models.Integration.run_request",
+        return_value=(True, Mock(json=lambda: {"users": [], "next": 2})),
+    ) as request_mock:
+        SyncUsers(integration).run()
+    assert request_mock.call_count == 2
@@ -132,6 +132,9 @@ class UserGiveAccessView(LoginRequiredMixin, IsAdminOrNewHireManagerMixin, Detai
 
             if success:
                 messages.success(request, _("Account has been created"))
+            elif success is None:
+                # still polling for the result in the background
+                messages.info(request, error)
             else:
                 messages.error(request, _("Account could not be created"))
                 messages.error(request, error)
@@ -204,14 +207,20 @@ class UserToggleAccessView(LoginRequiredMixin, IsAdminOrNewHireManagerMixin, Vie
             success, error = integration.execute(user)
             created = True
 
+        # still polling for the result in the background, the error is the
+        # message to show while waiting
+        pending = created and success is None
+
         return render(
             request,
             "_user_access_card.html",
             {
                 "object": user,
                 "integration": integration,
-                "active": created,
-                "error": error,
+                "active": created and not pending,
+                "pending": pending,
+                "error": None if pending else error,
+                "info": error if pending else None,
                 "needs_user_info": needs_user_info,
             },
         )
@@ -409,6 +409,19 @@ class SequenceChoiceForm(forms.Form):
     )
 
 
+class CohortSequenceChoiceForm(SequenceChoiceForm):
+    def __init__(self, *args, **kwargs):
+        new_hires = kwargs.pop("new_hires")
+        super().__init__(*args, **kwargs)
+        self.fields["new_hires"].queryset = new_hires
+
+    new_hires = forms.ModelMultipleChoiceField(
+        label=_("Select new hires you want to add the sequences to"),
+        widget=forms.CheckboxSelectMultiple,
+        queryset=get_user_model().objects.none(),
+    )
+
+
 class RemindMessageForm(forms.Form):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
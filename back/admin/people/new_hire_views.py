@@ -22,6 +22,7 @@ from admin.admin_tasks.models import AdminTask
 from admin.integrations.forms import IntegrationExtraUserInfoForm
 from admin.notes.models import Note
 from admin.sequences.models import Condition, Sequence
+from admin.sequences.tasks import assign_sequences_to_users
 from admin.templates.utils import get_templates_model, get_user_field
 from organization.models import Notification, Organization, WelcomeMessage
 from slack_bot.slack_resource import SlackResource
@@ -42,6 +43,7 @@ from users.mixins import (
 from users.models import NewHireWelcomeMessage, PreboardingUser, ResourceUser, ToDoUser
 
 from .forms import (
+    CohortSequenceChoiceForm,
     NewHireAddForm,
     NewHireProfileForm,
     PreboardingSendForm,
@@ -68,6 +70,37 @@ class NewHireListView(LoginRequiredMixin, ManagerPermMixin, ListView):
         return context
 
 
+class NewHireCohortAddSequenceView(LoginRequiredMixin, ManagerPermMixin, FormView):
+    template_name = "new_hires_add_sequence.html"
+    form_class = CohortSequenceChoiceForm
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        new_hires = get_user_model().new_hires.all().order_by("-start_day")
+        if not self.request.user.is_admin:
+            new_hires = new_hires.filter(manager=self.request.user)
+        kwargs["new_hires"] = new_hires
+        return kwargs
+
+    def form_valid(self, form):
+        new_hires = form.cleaned_data["new_hires"]
+        assign_sequences_to_users(
+            form.cleaned_data["sequences"], new_hires, created_by=self.request.user
+        )
+        messages.success(
+            self.request,
+            _("Sequence(s) have been added to %(amount)s new hires")
+            % {"amount": len(new_hires)},
+        )
+        return redirect("people:new_hires")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = _("Add sequences to new hires")
+        context["subtitle"] = _("people")
+        return context
+
+
 class NewHireAddView(
     LoginRequiredMixin, ManagerPermMixin, SuccessMessageMixin, CreateView
 ):
@@ -124,9 +157,6 @@ class NewHireAddView(
             created_for=new_hire,
         )
 
-        # Update user amount completed
-        new_hire.update_progress()
-
         # Check if there are items that will not be triggered since date passed
         conditions = Condition.objects.none()
         for seq in sequences:
@@ -260,9 +290,6 @@ class NewHireRemoveSequenceView(LoginRequiredMixin, IsAdminOrNewHireManagerMixin
         new_hire = get_object_or_404(get_user_model(), id=pk)
         new_hire.remove_sequence(sequence)
 
-        # Update user amount and completed
-        new_hire.update_progress()
-
         messages.success(request, _("Sequence items were removed from this new hire"))
 
         return redirect("people:new_hire", pk=new_hire.id)
@@ -278,9 +305,6 @@ class NewHireTriggerConditionView(
         new_hire = get_object_or_404(get_user_model(), id=pk)
         condition.process_condition(new_hire, skip_notification=True)
 
-        # Update user amount completed
-        new_hire.update_progress()
-
         context = self.get_context_data(**kwargs)
         return self.render_to_response(context)
 
@@ -587,15 +611,7 @@ class NewHireReopenTaskView(LoginRequiredMixin, IsAdminOrNewHireManagerMixin, Fo
         template_user_model = apps.get_model("users", template_type)
 
         template_user_obj = template_user_model.objects.get(pk=template_pk)
-        if template_type == "todouser":
-            template_user_obj.completed = False
-            template_user_obj.form = []
-        else:
-            template_user_obj.completed_course = False
-            template_user_obj.step = 0
-            template_user_obj.answers.clear()
-
-        template_user_obj.save()
+        template_user_obj.reopen()
 
         translation.activate(template_user_obj.user.language)
         if template_user_obj.user.has_slack_account:
@@ -622,9 +638,6 @@ class NewHireReopenTaskView(LoginRequiredMixin, IsAdminOrNewHireManagerMixin, Fo
         translation.activate(self.request.user.language)
         messages.success(self.request, _("Item has been reopened"))
 
-        # Update user amount completed
-        template_user_obj.user.update_progress()
-
         return redirect("people:new_hire_progress", pk=template_user_obj.user.id)
 
 
@@ -16,6 +16,7 @@ from admin.introductions.factories import IntroductionFactory
 from admin.notes.models import Note
 from admin.preboarding.factories import PreboardingFactory
 from admin.resources.factories import ResourceFactory
+from admin.sequences.models import SequenceAssignment
 from admin.templates.utils import get_user_field
 from admin.to_do.factories import ToDoFactory
 from misc.models import File
@@ -243,6 +244,52 @@ def test_create_new_hire_with_sequences_before_starting(
     assert to_do2.name not in response.content.decode()
 
 
+@pytest.mark.django_db
+def test_new_hires_add_sequence(
+    client, admin_factory, manager_factory, new_hire_factory, sequence_factory
+):
+    admin = admin_factory()
+    client.force_login(admin)
+
+    new_hire1 = new_hire_factory()
+    new_hire2 = new_hire_factory()
+    new_hire3 = new_hire_factory()
+    sequence = sequence_factory()
+
+    url = reverse("people:new_hires_add_sequence")
+    response = client.get(url)
+
+    assert sequence.name in response.content.decode()
+    assert new_hire1.full_name in response.content.decode()
+
+    response = client.post(
+        url,
+        data={"sequences": [sequence.id], "new_hires": [new_hire1.id, new_hire2.id]},
+        follow=True,
+    )
+
+    assert "Sequence(s) have been added to 2 new hires" in response.content.decode()
+    assert SequenceAssignment.objects.get().processed_users == 2
+    assert (
+        Notification.objects.filter(
+            notification_type=Notification.Type.ADDED_SEQUENCE
+        ).count()
+        == 2
+    )
+    assert not new_hire3.notification_receivers.exists()
+
+    # Managers can only pick their own new hires
+    manager = manager_factory()
+    new_hire1.manager = manager
+    new_hire1.save()
+    client.force_login(manager)
+
+    response = client.get(url)
+
+    assert new_hire1.full_name in response.content.decode()
+    assert new_hire2.full_name not in response.content.decode()
+
+
 @pytest.mark.django_db
 def test_create_new_hire_add_sequence_with_manual_trigger_condition(
     client,
@@ -1725,6 +1772,44 @@ def test_new_hire_access_per_integration_toggle(
     assert integration_user.revoked
 
 
+@pytest.mark.django_db
+def test_new_hire_access_toggle_pending(
+    client, django_user_model, new_hire_factory, custom_integration_factory
+):
+    client.force_login(
+        django_user_model.objects.create(role=get_user_model().Role.ADMIN)
+    )
+
+    new_hire1 = new_hire_factory(email="stan@example.com")
+    integration1 = custom_integration_factory(name="Asana")
+
+    # the integration is still polling for the result in the background
+    with (
+        patch(
+            "admin.integrations.models.Integration.needs_user_info",
+            Mock(return_value=False),
+        ),
+        patch(
+            "admin.integrations.models.Integration.user_exists",
+            Mock(return_value=False),
+        ),
+        patch(
+            "admin.integrations.models.Integration.execute",
+            Mock(return_value=(None, "Waiting for the integration to finish.")),
+        ),
+    ):
+        url = reverse("people:toggle_access", args=[new_hire1.id, integration1.id])
+        response = client.post(url)
+
+    assert response.context["pending"]
+    assert not response.context["active"]
+    assert response.context["error"] is None
+    content = response.content.decode()
+    assert "Waiting for the integration to finish." in content
+    assert "Activated" not in content
+    assert "Give access" not in content
+
+
 @pytest.mark.django_db
 @patch(
     "admin.integrations.models.Integration.run_request",
@@ -2886,7 +2971,7 @@ def test_fetching_employees_paginated_response(
                                 "lastName": "Do",
                             },
                         ],
-                        "nextPageToken": "244",
+                        "nextPageToken": "245",
                     }
                 ),
             ],
@@ -2902,7 +2987,7 @@ def test_fetching_employees_paginated_response(
                                 "lastName": "Do",
                             },
                         ],
-                        "nextPageToken": "244",
+                        "nextPageToken": "246",
                     }
                 ),
             ],
@@ -2918,7 +3003,7 @@ def test_fetching_employees_paginated_response(
                                 "lastName": "Do",
                             },
                         ],
-                        "nextPageToken": "244",
+                        "nextPageToken": "247",
                     }
                 ),
             ],
@@ -2934,7 +3019,7 @@ def test_fetching_employees_paginated_response(
                                 "lastName": "Do",
                             },
                         ],
-                        "nextPageToken": "244",
+                        "nextPageToken": "248",
                     }
                 ),
             ],
@@ -2950,7 +3035,7 @@ def test_fetching_employees_paginated_response(
                                 "lastName": "Do",
                             },
                         ],
-                        "nextPageToken": "244",
+                        "nextPageToken": "249",
                     }
                 ),
             ],
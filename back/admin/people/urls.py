@@ -6,6 +6,11 @@ app_name = "people"
 urlpatterns = [
     path("", new_hire_views.NewHireListView.as_view(), name="new_hires"),
     path("new_hire/add/", new_hire_views.NewHireAddView.as_view(), name="new_hire_add"),
+    path(
+        "new_hire/add_sequence/",
+        new_hire_views.NewHireCohortAddSequenceView.as_view(),
+        name="new_hires_add_sequence",
+    ),
     path(
         "new_hire/<int:pk>/overview/",
         new_hire_views.NewHireSequenceView.as_view(),
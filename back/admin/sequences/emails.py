@@ -27,65 +27,28 @@ def send_sequence_update_message(all_notifications, new_hire):
     subject = _("Here is an update!")
     blocks = []
 
-    notifications = all_notifications.filter(
-        notification_type=Notification.Type.ADDED_TODO
-    )
-    if notifications.exists():
-        blocks.append(
-            {
-                "type": "paragraph",
-                "data": {
-                    "text": _("Todo item")
-                    if notifications.count() == 1
-                    else _("Todo items")
-                },
-            }
-        )
-        text = ""
-        for to_do in ToDo.objects.filter(
-            id__in=notifications.values_list("item_id", flat=True)
-        ):
-            text += f"- {to_do.name} <br />"
-        blocks.append({"type": "quote", "data": {"text": text}})
-
-    notifications = all_notifications.filter(
-        notification_type=Notification.Type.ADDED_RESOURCE
-    )
-    if notifications.exists():
-        blocks.append(
-            {
-                "type": "paragraph",
-                "data": {
-                    "text": _("Resource")
-                    if notifications.count() == 1
-                    else _("Resources")
-                },
-            }
-        )
-        text = ""
-        for i in Resource.objects.filter(
-            id__in=notifications.values_list("item_id", flat=True)
-        ):
-            text += f"- {i.name} <br />"
-        blocks.append({"type": "quote", "data": {"text": text}})
+    for notification_type, model, title, title_plural in [
+        (Notification.Type.ADDED_TODO, ToDo, _("Todo item"), _("Todo items")),
+        (Notification.Type.ADDED_RESOURCE, Resource, _("Resource"), _("Resources")),
+        (Notification.Type.ADDED_BADGE, Badge, _("Badge"), _("Badges")),
+    ]:
+        item_ids = [
+            notification.item_id
+            for notification in all_notifications
+            if notification.notification_type == notification_type
+        ]
+        if not item_ids:
+            continue
 
-    notifications = all_notifications.filter(
-        notification_type=Notification.Type.ADDED_BADGE
-    )
-    if notifications.exists():
         blocks.append(
             {
                 "type": "paragraph",
-                "data": {
-                    "text": _("Badge") if notifications.count() == 1 else _("Badges")
-                },
+                "data": {"text": title if len(item_ids) == 1 else title_plural},
             }
         )
         text = ""
-        for i in Badge.objects.filter(
-            id__in=notifications.values_list("item_id", flat=True)
-        ):
-            text += f"- {i.name} <br />"
+        for item in model.objects.filter(id__in=item_ids):
+            text += f"- {item.name} <br />"
         blocks.append({"type": "quote", "data": {"text": text}})
 
     html_message = org.create_email({"org": org, "content": blocks, "user": new_hire})
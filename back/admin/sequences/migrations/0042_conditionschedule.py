@@ -0,0 +1,112 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:27
+
+from datetime import datetime, timedelta
+
+import django.db.models.deletion
+import pytz
+from django.conf import settings
+from django.db import migrations, models
+
+
+def workday_to_date(start_day, workdays):
+    # Copy of `users.utils.workday_to_date` as it was when this migration was made
+    # (without holidays), so later changes to it don't change this migration. The
+    # start day always counts as the first workday, every weekday after that adds one
+    day = start_day
+    while workdays > 1:
+        day += timedelta(days=1)
+        if day.weekday() < 5:
+            workdays -= 1
+    return day
+
+
+def schedule_timed_conditions(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    Condition = apps.get_model("sequences", "Condition")
+    ConditionSchedule = apps.get_model("sequences", "ConditionSchedule")
+    Organization = apps.get_model("organization", "Organization")
+
+    org = Organization._default_manager.first()
+    org_timezone = "UTC" if org is None else org.timezone
+
+    users = {
+        user_id: (start_day, pytz.timezone(user_timezone or org_timezone))
+        for user_id, start_day, user_timezone in User._default_manager.values_list(
+            "id", "start_day", "timezone"
+        )
+    }
+
+    schedule = []
+    # 0 = after new hire has started, 2 = before new hire has started
+    for user_id, condition_id, condition_type, days, time in Condition.objects.filter(
+        user__isnull=False, condition_type__in=[0, 2]
+    ).values_list("user__id", "id", "condition_type", "days", "time"):
+        start_day, local_tz = users[user_id]
+        if start_day is None or days < 1:
+            continue
+
+        if condition_type == 2:
+            fire_date = start_day - timedelta(days=days)
+        else:
+            fire_date = workday_to_date(start_day, days)
+            if fire_date.weekday() >= 5:
+                continue
+
+        schedule.append(
+            ConditionSchedule(
+                user_id=user_id,
+                condition_id=condition_id,
+                fire_at=local_tz.localize(datetime.combine(fire_date, time)).astimezone(
+                    pytz.utc
+                ),
+            )
+        )
+
+    ConditionSchedule.objects.bulk_create(schedule)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("users", "0035_integrationuser_user_integrations"),
+        ("organization", "0037_alter_notification_notification_type"),
+        ("sequences", "0041_condition_condition_admin_tasks_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConditionSchedule",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fire_at", models.DateTimeField(db_index=True)),
+                (
+                    "condition",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="schedule",
+                        to="sequences.condition",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="condition_schedule",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "condition")},
+            },
+        ),
+        migrations.RunPython(schedule_timed_conditions, migrations.RunPython.noop),
+    ]
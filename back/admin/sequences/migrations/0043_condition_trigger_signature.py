@@ -0,0 +1,51 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:52
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def set_trigger_signatures(apps, schema_editor):
+    Condition = apps.get_model("sequences", "Condition")
+
+    for condition in Condition.objects.all():
+        # 0 = after, 1 = to do, 2 = before, 4 = admin task
+        if condition.condition_type == 1:
+            trigger = [
+                condition.condition_type,
+                sorted(condition.condition_to_do.values_list("id", flat=True)),
+            ]
+        elif condition.condition_type == 4:
+            trigger = [
+                condition.condition_type,
+                sorted(condition.condition_admin_tasks.values_list("id", flat=True)),
+            ]
+        elif condition.condition_type in [0, 2]:
+            trigger = [
+                condition.condition_type,
+                condition.days,
+                condition.time.strftime("%H:%M:%S"),
+            ]
+        else:
+            trigger = [condition.condition_type]
+
+        condition.trigger_signature = hashlib.sha256(
+            json.dumps(trigger).encode()
+        ).hexdigest()
+        condition.save(update_fields=["trigger_signature"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sequences", "0042_conditionschedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="condition",
+            name="trigger_signature",
+            field=models.CharField(db_index=True, default="", max_length=64),
+        ),
+        migrations.RunPython(set_trigger_signatures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("sequences", "0043_condition_trigger_signature"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SequenceAssignment",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("total_users", models.IntegerField(default=0)),
+                ("processed_users", models.IntegerField(default=0)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("sequences", models.ManyToManyField(to="sequences.sequence")),
+            ],
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_pending_triggers(apps, schema_editor):
+    Condition = apps.get_model("sequences", "Condition")
+    ConditionTriggerCounter = apps.get_model("sequences", "ConditionTriggerCounter")
+    ToDoUser = apps.get_model("users", "ToDoUser")
+    AdminTask = apps.get_model("admin_tasks", "AdminTask")
+
+    completed_to_dos = set(
+        ToDoUser.objects.filter(completed=True).values_list("user_id", "to_do_id")
+    )
+    completed_admin_tasks = set(
+        AdminTask.objects.filter(completed=True, based_on__isnull=False).values_list(
+            "new_hire_id", "based_on_id"
+        )
+    )
+
+    counters = []
+    # 1 = to do, 4 = admin task
+    for condition in Condition.objects.filter(
+        user__isnull=False, condition_type__in=[1, 4]
+    ).distinct():
+        if condition.condition_type == 1:
+            items = set(condition.condition_to_do.values_list("id", flat=True))
+            completed = completed_to_dos
+        else:
+            items = set(condition.condition_admin_tasks.values_list("id", flat=True))
+            completed = completed_admin_tasks
+
+        for user_id in condition.user_set.values_list("id", flat=True):
+            counters.append(
+                ConditionTriggerCounter(
+                    user_id=user_id,
+                    condition_id=condition.id,
+                    pending=len(
+                        [item for item in items if (user_id, item) not in completed]
+                    ),
+                )
+            )
+
+    ConditionTriggerCounter.objects.bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("users", "0035_integrationuser_user_integrations"),
+        ("admin_tasks", "0011_admintask_based_on"),
+        ("sequences", "0044_sequenceassignment"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConditionTriggerCounter",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pending", models.IntegerField(default=0)),
+                (
+                    "condition",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trigger_counters",
+                        to="sequences.condition",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="condition_trigger_counters",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "condition")},
+            },
+        ),
+        migrations.RunPython(count_pending_triggers, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,16 @@
+import hashlib
+import json
+import operator
+from datetime import datetime, timedelta
+from functools import reduce
+
+import pytz
 from django.conf import settings
-from django.db import models
-from django.db.models import Case, F, IntegerField, Prefetch, When
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Prefetch, When
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -16,9 +26,10 @@ from admin.resources.models import Resource
 from admin.to_do.models import ToDo
 from misc.fields import ContentJSONField, EncryptedJSONField
 from misc.mixins import ContentMixin
-from organization.models import Notification
+from organization.models import Notification, Organization
 from slack_bot.models import SlackChannel
 from slack_bot.utils import Slack
+from users.utils import workday_to_date
 
 from .emails import send_sequence_message
 
@@ -53,167 +64,199 @@ class Sequence(models.Model):
     def assign_to_user(self, user):
         # adding conditions
         for sequence_condition in self.conditions.all():
-            user_condition = None
-
-            # Check what kind of condition it is
-            if sequence_condition.condition_type in [
-                Condition.Type.BEFORE,
-                Condition.Type.AFTER,
-            ]:
-                # Get the timed based condition or return None if not exist
-                user_condition = user.conditions.filter(
-                    condition_type=sequence_condition.condition_type,
-                    days=sequence_condition.days,
-                    time=sequence_condition.time,
-                ).first()
-
-            elif sequence_condition.condition_type == Condition.Type.TODO:
-                # For to_do items, filter all condition items to find if one matches
-                # Both the amount and the todos itself need to match exactly
-                conditions = user.conditions.filter(condition_type=Condition.Type.TODO)
-                original_condition_to_do_ids = (
-                    sequence_condition.condition_to_do.all().values_list(
-                        "id", flat=True
-                    )
-                )
-
-                for condition in conditions:
-                    # Quickly check if the amount of items match - if not match, drop
-                    if condition.condition_to_do.all().count() != len(
-                        original_condition_to_do_ids
-                    ):
-                        continue
-
-                    found_to_do_items = condition.condition_to_do.filter(
-                        id__in=original_condition_to_do_ids
-                    ).count()
-
-                    if found_to_do_items == len(original_condition_to_do_ids):
-                        # We found our match. Amount matches AND the todos match
-                        user_condition = condition
-                        break
-
-            elif sequence_condition.condition_type == Condition.Type.ADMIN_TASK:
-                # For admin to do items, filter all condition items to find if one
-                # matches. Both the amount and the admin to do itself need to match
-                # exactly
-                conditions = user.conditions.filter(
-                    condition_type=Condition.Type.ADMIN_TASK
-                )
-                original_condition_admin_tasks_ids = (
-                    sequence_condition.condition_admin_tasks.all().values_list(
-                        "id", flat=True
-                    )
-                )
-
-                for condition in conditions:
-                    # Quickly check if the amount of items match - if not match, drop
-                    if condition.condition_admin_tasks.all().count() != len(  # noqa
-                        original_condition_admin_tasks_ids
-                    ):
-                        continue
-
-                    found_admin_tasks = condition.condition_admin_tasks.filter(
-                        id__in=original_condition_admin_tasks_ids
-                    ).count()
-
-                    if found_admin_tasks == len(original_condition_admin_tasks_ids):
-                        # We found our match. Amount matches AND the admin_tasks match
-                        user_condition = condition
-                        break
-            else:
+            if sequence_condition.condition_type == Condition.Type.WITHOUT:
                 # Condition (always just one) that will be assigned directly (type == 3)
                 # Just run the condition with the new hire
                 sequence_condition.process_condition(user)
                 continue
 
+            # Find a condition of the new hire that triggers at the exact same moment.
+            # I.e. same day/time or exactly the same to do items/admin tasks
+            user_conditions = list(
+                user.conditions.filter(
+                    trigger_signature=sequence_condition.trigger_signature
+                ).order_by("id")
+            )
+
             # Let's add the condition to the new hire. Either through adding it to the
-            # exising one or creating a new one
-            if user_condition is not None:
+            # exising one or sharing the one of the sequence
+            if sequence_condition in user_conditions:
+                # Already shared with the new hire
+                continue
+            elif len(user_conditions):
+                user_condition = user_conditions[0]
+                if user_condition.sequence_id is not None:
+                    # Merging changes the timeline of the new hire, so the new hire
+                    # needs its own copy of the condition first
+                    user_condition = user_condition.materialize_for_users([user])[
+                        user.id
+                    ]
                 # adding items to existing condition
                 user_condition.include_other_condition(sequence_condition)
             else:
-                # duplicating condition and adding to user
-                # Force getting it, as we are about to duplicate it and set the pk to
-                # None
-                old_condition = Condition.objects.get(id=sequence_condition.id)
-
-                sequence_condition.pk = None
-                sequence_condition.sequence = None
-                sequence_condition.save()
-
-                # Add condition to_dos
-                sequence_condition.condition_to_do.set(
-                    old_condition.condition_to_do.all()
-                )
+                # The condition is not copied, the new hire will use the one of the
+                # sequence until it gets customized (see `materialize_for_users`)
+                user.conditions.add(sequence_condition)
 
-                for condition_admin_task in old_condition.condition_admin_tasks.all():
-                    sequence_condition.condition_admin_tasks.add(condition_admin_task)
-                # Add all the things that get triggered
-                sequence_condition.include_other_condition(old_condition)
+    def assign_to_users(self, users):
+        """
+        Same as `assign_to_user`, but for many users at once with a fixed number of
+        queries. Items of conditions without a trigger are assigned directly, but
+        admin tasks, messages and integrations of those are not executed. Use
+        `Condition.execute_items` for that.
+
+        :param users list: the users the sequence should be assigned to
+        """
+        users = list(users)
+        user_ids = [user.id for user in users]
+        sequence_conditions = list(self.conditions.all())
+
+        # Conditions of the users that trigger at the exact same moment as one of the
+        # sequence conditions, oldest first
+        user_conditions = {}
+        for user_id, trigger_signature, condition_id, sequence_id in (
+            Condition.objects.filter(
+                user__id__in=user_ids,
+                trigger_signature__in=[
+                    condition.trigger_signature for condition in sequence_conditions
+                ],
+            )
+            .order_by("id")
+            .values_list("user__id", "trigger_signature", "id", "sequence_id")
+        ):
+            user_conditions.setdefault((user_id, trigger_signature), []).append(
+                (condition_id, sequence_id)
+            )
 
-                # Add newly created condition back to user
-                user.conditions.add(sequence_condition)
+        # Items get added to an existing condition or the sequence condition gets
+        # shared with the user. Shared conditions that get items merged in, need to
+        # become private first.
+        merges = []
+        shared = []
+        materialize = {}
+        for sequence_condition in sequence_conditions:
+            if sequence_condition.condition_type == Condition.Type.WITHOUT:
+                sequence_condition.assign_items_to_users(users)
+                continue
+
+            for user_id in user_ids:
+                key = (user_id, sequence_condition.trigger_signature)
+                existing = user_conditions.setdefault(key, [])
+                if (sequence_condition.id, self.id) in existing:
+                    continue
+                elif len(existing):
+                    condition_id, sequence_id = existing[0]
+                    if sequence_id is not None:
+                        materialize.setdefault(condition_id, set()).add(user_id)
+                    merges.append((user_id, condition_id, sequence_condition.id))
+                else:
+                    existing.append((sequence_condition.id, self.id))
+                    shared.append((user_id, sequence_condition.id))
+
+        if not merges and not shared:
+            return
+
+        user_conditions_through = get_user_model().conditions.through
+        user_conditions_through.objects.bulk_create(
+            [
+                user_conditions_through(user_id=user_id, condition_id=condition_id)
+                for user_id, condition_id in shared
+            ],
+            ignore_conflicts=True,
+        )
+
+        copies = {}
+        for condition in Condition.objects.filter(id__in=materialize.keys()):
+            for user_id, copy in condition.materialize_for_users(
+                [user for user in users if user.id in materialize[condition.id]]
+            ).items():
+                copies[(user_id, condition.id)] = copy.id
+        merges = [
+            (copies.get((user_id, condition_id), condition_id), sequence_condition_id)
+            for user_id, condition_id, sequence_condition_id in merges
+        ]
+
+        # Existing conditions only get the items
+        for field in Condition.item_fields() if merges else []:
+            through = field.remote_field.through
+            condition_column = field.m2m_column_name()
+            item_column = field.m2m_reverse_name()
+
+            sequence_condition_items = {}
+            for condition_id, item_id in through.objects.filter(
+                **{f"{condition_column}__in": sequence_conditions}
+            ).values_list(condition_column, item_column):
+                sequence_condition_items.setdefault(condition_id, []).append(item_id)
+
+            rows = {
+                (user_condition_id, item_id)
+                for user_condition_id, sequence_condition_id in merges
+                for item_id in sequence_condition_items.get(sequence_condition_id, [])
+            }
+            existing = set(
+                through.objects.filter(
+                    **{
+                        f"{condition_column}__in": {
+                            condition_id for condition_id, _ in rows
+                        },
+                        f"{item_column}__in": {item_id for _, item_id in rows},
+                    }
+                ).values_list(condition_column, item_column)
+            )
+            through.objects.bulk_create(
+                [
+                    through(**{condition_column: condition_id, item_column: item_id})
+                    for condition_id, item_id in rows - existing
+                ]
+            )
+
+        # Bulk inserts don't send signals, so schedule and count them here
+        ConditionSchedule.objects.refresh_for_users(user_ids)
+        ConditionTriggerCounter.objects.refresh_for_users(user_ids)
 
     def remove_from_user(self, new_hire):
-        from admin.admin_tasks.models import AdminTask
-
-        # get all items from all conditions
-        to_dos = ToDo.objects.none()
-        badges = Badge.objects.none()
-        resources = Resource.objects.none()
-        admin_tasks = AdminTask.objects.none()
-        external_messages = ExternalMessage.objects.none()
-        introductions = Introduction.objects.none()
-        preboarding = Preboarding.objects.none()
-        appointments = Appointment.objects.none()
-        integration_configs = IntegrationConfig.objects.none()
-
-        # TODO: this is going to make a lot of queries, should be optimized
-        for condition in self.conditions.all():
-            to_dos |= condition.to_do.all()
-            badges |= condition.badges.all()
-            resources |= condition.resources.all()
-            admin_tasks |= condition.admin_tasks.all()
-            external_messages |= condition.external_messages.all()
-            introductions |= condition.introductions.all()
-            preboarding |= condition.preboarding.all()
-            appointments |= condition.appointments.all()
-            integration_configs |= condition.integration_configs.all()
-
-        # Cycle through new hire's item and remove the ones that aren't supposed to
-        # be there
-        new_hire.to_do.remove(*to_dos)
-        new_hire.badges.remove(*badges)
-        new_hire.appointments.remove(*appointments)
-        new_hire.preboarding.remove(*preboarding)
-        new_hire.introductions.remove(*introductions)
-
-        # Do the same with the conditions
-        conditions_to_be_deleted = []
+        # All items of all conditions of this sequence, per condition field. These
+        # are only used as subqueries, nothing gets loaded.
+        item_fields = Condition.item_fields()
         items = {
-            "to_do": to_dos,
-            "resources": resources,
-            "badges": badges,
-            "admin_tasks": admin_tasks,
-            "external_messages": external_messages,
-            "introductions": introductions,
-            "preboarding": preboarding,
-            "appointments": appointments,
-            "integration_configs": integration_configs,
+            field.name: field.remote_field.through.objects.filter(
+                **{f"{field.m2m_field_name()}__in": self.conditions.all()}
+            ).values(field.m2m_reverse_name())
+            for field in item_fields
         }
-        for condition in new_hire.conditions.all():
-            for field in condition._meta.many_to_many:
-                # We only want to remove assigned items, not triggers
-                if field.name in ("condition_to_do", "condition_admin_tasks"):
-                    continue
-                getattr(condition, field.name).remove(*items[field.name])
 
-            if condition.is_empty:
-                conditions_to_be_deleted.append(condition.id)
+        # Remove the items that were already assigned to the new hire
+        for field_name in [
+            "to_do",
+            "badges",
+            "appointments",
+            "preboarding",
+            "introductions",
+        ]:
+            user_field = get_user_model()._meta.get_field(field_name)
+            user_field.remote_field.through.objects.filter(
+                **{
+                    user_field.m2m_column_name(): new_hire.id,
+                    f"{user_field.m2m_reverse_name()}__in": items[field_name],
+                }
+            ).delete()
+
+        # Unlink the shared conditions of this sequence
+        new_hire.conditions.remove(*self.conditions.all())
+
+        # Remove the items from the customized conditions. Shared conditions of other
+        # sequences are left alone.
+        private_conditions = new_hire.conditions.filter(sequence__isnull=True)
+        for field in item_fields:
+            field.remote_field.through.objects.filter(
+                **{
+                    f"{field.m2m_field_name()}__in": private_conditions,
+                    f"{field.m2m_reverse_name()}__in": items[field.name],
+                }
+            ).delete()
 
         # Remove all empty conditions
-        Condition.objects.filter(id__in=conditions_to_be_deleted).delete()
+        new_hire.conditions.empty().filter(sequence__isnull=True).delete()
         # Delete sequence
         Notification.objects.order_by("-created").filter(
             notification_type=Notification.Type.ADDED_SEQUENCE
@@ -544,6 +587,22 @@ class IntegrationConfig(models.Model):
 
 
 class ConditionPrefetchManager(models.Manager):
+    def empty(self):
+        # Conditions without any items, triggers don't count
+        return self.get_queryset().exclude(
+            reduce(
+                operator.or_,
+                [
+                    Exists(
+                        field.remote_field.through.objects.filter(
+                            **{field.m2m_field_name(): OuterRef("pk")}
+                        )
+                    )
+                    for field in Condition.item_fields()
+                ],
+            )
+        )
+
     def prefetched(self):
         return (
             self.get_queryset()
@@ -629,9 +688,32 @@ class Condition(models.Model):
     preboarding = models.ManyToManyField(Preboarding)
     appointments = models.ManyToManyField(Appointment)
     integration_configs = models.ManyToManyField(IntegrationConfig)
+    # Hash of everything that determines when this condition triggers. Conditions
+    # with the same signature can be merged into one.
+    trigger_signature = models.CharField(max_length=64, default="", db_index=True)
 
     objects = ConditionPrefetchManager()
 
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        self.trigger_signature = self.get_trigger_signature()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = [*kwargs["update_fields"], "trigger_signature"]
+        super(Condition, self).save(*args, **kwargs)
+        if not is_new:
+            # Type, days or time might have changed, recalculate when this fires
+            ConditionSchedule.objects.refresh_for_condition(self)
+            ConditionTriggerCounter.objects.refresh_for_condition(self)
+
+    @staticmethod
+    def item_fields():
+        # All m2m fields with items that get assigned, so not the triggers
+        return [
+            field
+            for field in Condition._meta.many_to_many
+            if field.name not in ("condition_to_do", "condition_admin_tasks")
+        ]
+
     @property
     def is_empty(self):
         return not (
@@ -646,6 +728,39 @@ class Condition(models.Model):
             or self.integration_configs.exists()
         )
 
+    @staticmethod
+    def create_trigger_signature(
+        condition_type, days, time, condition_to_do_ids, condition_admin_tasks_ids
+    ):
+        if condition_type == Condition.Type.TODO:
+            # Only the to do items matter, in any order
+            trigger = [condition_type, sorted(condition_to_do_ids)]
+        elif condition_type == Condition.Type.ADMIN_TASK:
+            trigger = [condition_type, sorted(condition_admin_tasks_ids)]
+        elif condition_type in [Condition.Type.AFTER, Condition.Type.BEFORE]:
+            trigger = [condition_type, days, time.strftime("%H:%M:%S")]
+        else:
+            trigger = [condition_type]
+        return hashlib.sha256(json.dumps(trigger).encode()).hexdigest()
+
+    def get_trigger_signature(self):
+        condition_to_do_ids = []
+        condition_admin_tasks_ids = []
+        if self.pk is not None:
+            condition_to_do_ids = self.condition_to_do.values_list("id", flat=True)
+            condition_admin_tasks_ids = self.condition_admin_tasks.values_list(
+                "id", flat=True
+            )
+
+        return Condition.create_trigger_signature(
+            self.condition_type,
+            self.days,
+            # Could be a string or datetime when it hasn't been saved yet
+            self._meta.get_field("time").to_python(self.time),
+            condition_to_do_ids,
+            condition_admin_tasks_ids,
+        )
+
     @property
     def based_on_to_do(self):
         return self.condition_type == Condition.Type.TODO
@@ -658,6 +773,17 @@ class Condition(models.Model):
     def based_on_time(self):
         return self.condition_type in [Condition.Type.AFTER, Condition.Type.BEFORE]
 
+    def _item_fields(self, model_item):
+        # Names of the fields that hold assigned items of the type of model_item
+        return [
+            field.name
+            for field in self._meta.many_to_many
+            # We only want assigned items, not triggers
+            if field.name not in ("condition_to_do", "condition_admin_tasks")
+            and field.related_model._meta.model_name
+            == type(model_item)._meta.model_name
+        ]
+
     def remove_item(self, model_item):
         # If any of the external messages, then get the root one
         if type(model_item)._meta.model_name in [
@@ -667,27 +793,27 @@ class Condition(models.Model):
         ]:
             model_item = ExternalMessage.objects.get(pk=model_item.id)
         # model_item is a template item. I.e. a ToDo object.
-        for field in self._meta.many_to_many:
-            # We only want to remove assigned items, not triggers
-            if field.name in ("condition_to_do", "condition_admin_tasks"):
-                continue
-            if (
-                field.related_model._meta.model_name
-                == type(model_item)._meta.model_name
-            ):
-                getattr(self, field.name).remove(model_item)
+        fields = [
+            field_name
+            for field_name in self._item_fields(model_item)
+            if getattr(self, field_name).filter(pk=model_item.pk).exists()
+        ]
+        if len(fields):
+            self.detach_from_users()
+        for field_name in fields:
+            getattr(self, field_name).remove(model_item)
 
     def add_item(self, model_item):
         # model_item is a template item. I.e. a ToDo object.
-        for field in self._meta.many_to_many:
-            # We only want to add assigned items, not triggers
-            if field.name in ("condition_to_do", "condition_admin_tasks"):
-                continue
-            if (
-                field.related_model._meta.model_name
-                == type(model_item)._meta.model_name
-            ):
-                getattr(self, field.name).add(model_item)
+        fields = [
+            field_name
+            for field_name in self._item_fields(model_item)
+            if not getattr(self, field_name).filter(pk=model_item.pk).exists()
+        ]
+        if len(fields):
+            self.detach_from_users()
+        for field_name in fields:
+            getattr(self, field_name).add(model_item)
 
     def include_other_condition(self, condition):
         # this will put another condition into this one
@@ -700,6 +826,77 @@ class Condition(models.Model):
             for item in condition_field.all():
                 getattr(self, field.name).add(item)
 
+    def materialize_for_users(self, users):
+        """
+        Give the users a private copy of this condition (with the same triggers and
+        items) instead of the one of the sequence. The copies can be customized
+        without changing the sequence or the timeline of other users.
+
+        :param users list: users that currently share this condition
+        :return dict: the private condition per user id
+        """
+        user_ids = [user.id for user in users]
+        if self.sequence_id is None or not user_ids:
+            return {user_id: self for user_id in user_ids}
+
+        user_conditions_through = get_user_model().conditions.through
+        with transaction.atomic():
+            copies = Condition.objects.bulk_create(
+                [
+                    Condition(
+                        condition_type=self.condition_type,
+                        days=self.days,
+                        time=self.time,
+                        trigger_signature=self.trigger_signature,
+                    )
+                    for _ in user_ids
+                ]
+            )
+            for field in self._meta.many_to_many:
+                through = field.remote_field.through
+                item_ids = list(
+                    through.objects.filter(
+                        **{field.m2m_column_name(): self.id}
+                    ).values_list(field.m2m_reverse_name(), flat=True)
+                )
+                through.objects.bulk_create(
+                    [
+                        through(
+                            **{
+                                field.m2m_column_name(): copy.id,
+                                field.m2m_reverse_name(): item_id,
+                            }
+                        )
+                        for copy in copies
+                        for item_id in item_ids
+                    ]
+                )
+
+            # Swap the shared condition for the copy
+            user_conditions_through.objects.filter(
+                user_id__in=user_ids, condition_id=self.id
+            ).delete()
+            user_conditions_through.objects.bulk_create(
+                [
+                    user_conditions_through(user_id=user_id, condition_id=copy.id)
+                    for user_id, copy in zip(user_ids, copies)
+                ]
+            )
+            ConditionSchedule.objects.refresh_for_users(user_ids)
+            ConditionTriggerCounter.objects.refresh_for_users(user_ids)
+
+        return dict(zip(user_ids, copies))
+
+    def detach_from_users(self):
+        """
+        Changes to the condition of a sequence should only apply to users that get
+        the sequence from now on. Users that already have it keep their own copy of
+        the condition as it is now, so it doesn't fire again or change for them.
+        Call this before saving the changes.
+        """
+        if self.sequence_id is not None:
+            Condition.objects.get(id=self.id).materialize_for_users(self.user_set.all())
+
     def duplicate(self, admin_tasks):
         old_condition = Condition.objects.get(id=self.id)
         self.pk = None
@@ -755,41 +952,430 @@ class Condition(models.Model):
         return self, admin_tasks
 
     def process_condition(self, user, skip_notification=False):
+        self.process_condition_for_users([user], skip_notification=skip_notification)
+
+    def process_condition_for_users(self, users, skip_notification=False):
+        """
+        Add all items of this condition to the given users.
+
+        :param users list: the users the condition got triggered for
+        :param skip_notification bool: mark notifications as already sent
+        """
+        self.assign_items_to_users(users, skip_notification=skip_notification)
+        self.execute_items(users)
+
+    def assign_items_to_users(self, users, skip_notification=False):
+        """
+        Add the items of this condition that only have to be linked to the users (to
+        do items, resources, badges, etc.). Nothing gets executed.
+
+        :param users list: the users the items should be assigned to
+        :param skip_notification bool: mark notifications as already sent
+        """
+        # Items that can be easily added are copied over in bulk: one query to find
+        # the ones that already exist, one to insert the rest. Notifications are
+        # created in one go for all fields.
+        notifications = []
+        with transaction.atomic():
+            for field in [
+                "to_do",
+                "resources",
+                "badges",
+                "appointments",
+                "introductions",
+                "preboarding",
+            ]:
+                items = list(getattr(self, field).all())
+                if not items:
+                    continue
+
+                user_field = get_user_model()._meta.get_field(field)
+                through = user_field.remote_field.through
+                user_column = user_field.m2m_column_name()
+                item_column = user_field.m2m_reverse_name()
+
+                existing = set(
+                    through.objects.filter(
+                        **{
+                            f"{user_column}__in": [user.id for user in users],
+                            f"{item_column}__in": [item.id for item in items],
+                        }
+                    ).values_list(user_column, item_column)
+                )
+                through.objects.bulk_create(
+                    [
+                        through(**{user_column: user.id, item_column: item.id})
+                        for user in users
+                        for item in items
+                        if (user.id, item.id) not in existing
+                    ]
+                )
+
+                notifications += [
+                    Notification(
+                        notification_type=item.notification_add_type,
+                        extra_text=item.name,
+                        created_for=user,
+                        item_id=item.id,
+                        notified_user=skip_notification,
+                        public_to_new_hire=True,
+                    )
+                    for user in users
+                    for item in items
+                ]
+
+            Notification.objects.bulk_create(notifications)
+
+    def execute_items(self, users):
+        """
+        Execute the items of this condition that aren't a quick copy/paste (admin
+        tasks, messages and integrations) for the given users.
+
+        :param users list: the users the condition got triggered for
+        """
         # avoid circular import
         from users.models import IntegrationUser
 
-        # Loop over all m2m fields and add the ones that can be easily added
-        for field in [
-            "to_do",
-            "resources",
-            "badges",
-            "appointments",
-            "introductions",
-            "preboarding",
-        ]:
+        # Follow back to their model and execute them. It will also add an item to the
+        # notification model there.
+        for field in ["admin_tasks", "external_messages", "integration_configs"]:
             for item in getattr(self, field).all():
-                getattr(user, field).add(item)
+                for user in users:
+                    # Only for integration configs
+                    if getattr(item, "integration", None) is not None:
+                        if item.integration.skip_user_provisioning:
+                            IntegrationUser.objects.create(
+                                user=user, integration=item.integration
+                            )
+                        else:
+                            item.integration.execute(user, item.additional_data)
+                    else:
+                        item.execute(user)
+
+
+@receiver(m2m_changed, sender=Condition.condition_to_do.through)
+@receiver(m2m_changed, sender=Condition.condition_admin_tasks.through)
+def update_trigger_signature(sender, instance, action, reverse, pk_set, **kwargs):
+    # The triggers of the condition changed, so the signature changes as well
+    if not reverse:
+        conditions = [instance] if action.startswith("post_") else []
+    elif action == "pre_clear":
+        # Conditions can't be found anymore after clearing, so remember them
+        instance._trigger_condition_ids = list(
+            Condition.objects.filter(
+                models.Q(condition_to_do=instance)
+                | models.Q(condition_admin_tasks=instance)
+            ).values_list("id", flat=True)
+        )
+        conditions = []
+    elif action == "post_clear":
+        conditions = Condition.objects.filter(
+            id__in=getattr(instance, "_trigger_condition_ids", [])
+        )
+    elif action.startswith("post_"):
+        conditions = Condition.objects.filter(id__in=pk_set)
+    else:
+        conditions = []
 
-                Notification.objects.create(
-                    notification_type=item.notification_add_type,
-                    extra_text=item.name,
-                    created_for=user,
-                    item_id=item.id,
-                    notified_user=skip_notification,
-                    public_to_new_hire=True,
+    refresh_trigger_signatures(conditions)
+
+
+def refresh_trigger_signatures(conditions):
+    for condition in conditions:
+        condition.trigger_signature = condition.get_trigger_signature()
+        Condition.objects.filter(id=condition.id).update(
+            trigger_signature=condition.trigger_signature
+        )
+        ConditionTriggerCounter.objects.refresh_for_condition(condition)
+
+
+@receiver(pre_delete, sender=ToDo)
+@receiver(pre_delete, sender=PendingAdminTask)
+def remember_trigger_conditions(sender, instance, **kwargs):
+    # Deleting a trigger item removes it from the conditions without sending
+    # `m2m_changed`, so remember the conditions to update them afterwards
+    lookup = "condition_to_do" if sender is ToDo else "condition_admin_tasks"
+    instance._trigger_condition_ids = list(
+        Condition.objects.filter(**{lookup: instance}).values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=ToDo)
+@receiver(post_delete, sender=PendingAdminTask)
+def update_deleted_trigger_signature(sender, instance, **kwargs):
+    refresh_trigger_signatures(
+        Condition.objects.filter(id__in=getattr(instance, "_trigger_condition_ids", []))
+    )
+
+
+@receiver(pre_delete, sender=Condition)
+def materialize_deleted_condition(sender, instance, **kwargs):
+    # Users that got this condition through a sequence keep their own copy when it
+    # gets removed from the sequence (or the sequence gets removed)
+    instance.detach_from_users()
+
+
+class ConditionScheduleManager(models.Manager):
+    def due(self, start, end):
+        # All timed conditions that should fire between `start` (exclusive) and `end`
+        return (
+            self.get_queryset()
+            .filter(
+                fire_at__gt=start,
+                fire_at__lte=end,
+                user__role=get_user_model().Role.NEWHIRE,
+            )
+            .select_related("user")
+            .order_by("fire_at", "id")
+        )
+
+    def refresh_for_users(self, user_ids):
+        """
+        Recalculate the fire moments of all timed conditions of the given users.
+
+        :param user_ids list: ids of the users that need to be (re)scheduled
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+
+        org = Organization.object.get()
+        org_timezone = "UTC" if org is None else org.timezone
+
+        users = {
+            user_id: (start_day, pytz.timezone(user_timezone or org_timezone))
+            for user_id, start_day, user_timezone in get_user_model()
+            .objects.filter(id__in=user_ids)
+            .values_list("id", "start_day", "timezone")
+        }
+        conditions = Condition.objects.filter(
+            user__id__in=user_ids,
+            condition_type__in=[Condition.Type.BEFORE, Condition.Type.AFTER],
+        ).values_list("user__id", "id", "condition_type", "days", "time")
+
+        schedule = []
+        for user_id, condition_id, condition_type, days, time in conditions:
+            start_day, local_tz = users[user_id]
+            fire_at = ConditionSchedule.get_fire_at(
+                condition_type, days, time, start_day, local_tz
+            )
+            if fire_at is not None:
+                schedule.append(
+                    ConditionSchedule(
+                        user_id=user_id, condition_id=condition_id, fire_at=fire_at
+                    )
                 )
 
-        # For the ones that aren't a quick copy/paste, follow back to their model and
-        # execute them. It will also add an item to the notification model there.
-        for field in ["admin_tasks", "external_messages", "integration_configs"]:
-            for item in getattr(self, field).all():
-                # Only for integration configs
-                if getattr(item, "integration", None) is not None:
-                    if item.integration.skip_user_provisioning:
-                        IntegrationUser.objects.create(
-                            user=user, integration=item.integration
-                        )
-                    else:
-                        item.integration.execute(user, item.additional_data)
-                else:
-                    item.execute(user)
+        with transaction.atomic():
+            self.get_queryset().filter(user__id__in=user_ids).delete()
+            self.bulk_create(schedule)
+
+    def refresh_for_condition(self, condition):
+        self.refresh_for_users(condition.user_set.values_list("id", flat=True))
+
+
+class ConditionSchedule(models.Model):
+    # Materialized moment (in UTC) on which a timed condition fires for a user. Kept
+    # up to date when conditions, start days or timezones change, so the timed
+    # trigger task only has to do one range query.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="condition_schedule",
+    )
+    condition = models.ForeignKey(
+        Condition, on_delete=models.CASCADE, related_name="schedule"
+    )
+    fire_at = models.DateTimeField(db_index=True)
+
+    objects = ConditionScheduleManager()
+
+    class Meta:
+        unique_together = ["user", "condition"]
+
+    @staticmethod
+    def get_fire_at(condition_type, days, time, start_day, local_tz):
+        """
+        Get the moment a timed condition fires, based on the new hire's start day and
+        timezone. Returns `None` if the condition will never fire.
+        """
+        if start_day is None or days < 1:
+            return None
+
+        if condition_type == Condition.Type.BEFORE:
+            # Calendar days, not workdays
+            fire_date = start_day - timedelta(days=days)
+        elif condition_type == Condition.Type.AFTER:
+            fire_date = workday_to_date(start_day, days)
+            # Conditions after the new hire started are only triggered on workdays
+            if fire_date.weekday() >= 5:
+                return None
+        else:
+            return None
+
+        return local_tz.localize(datetime.combine(fire_date, time)).astimezone(pytz.utc)
+
+
+class ConditionTriggerCounterManager(models.Manager):
+    def refresh_for_users(self, user_ids):
+        """
+        Recount the trigger items that still have to be completed for all to do and
+        admin task based conditions of the given users.
+
+        :param user_ids list: ids of the users that need to be recounted
+        """
+        # avoid circular import
+        from users.models import ToDoUser
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+
+        conditions = list(
+            Condition.objects.filter(
+                user__id__in=user_ids,
+                condition_type__in=[Condition.Type.TODO, Condition.Type.ADMIN_TASK],
+            ).values_list("user__id", "id", "condition_type")
+        )
+
+        # Trigger items per condition
+        triggers = {}
+        for field_name in ["condition_to_do", "condition_admin_tasks"]:
+            field = Condition._meta.get_field(field_name)
+            for condition_id, item_id in field.remote_field.through.objects.filter(
+                **{
+                    f"{field.m2m_column_name()}__in": [
+                        condition[1] for condition in conditions
+                    ]
+                }
+            ).values_list(field.m2m_column_name(), field.m2m_reverse_name()):
+                triggers.setdefault((field_name, condition_id), set()).add(item_id)
+
+        # Trigger items that have been completed per user
+        completed_to_dos = set(
+            ToDoUser.objects.filter(user__id__in=user_ids, completed=True).values_list(
+                "user_id", "to_do_id"
+            )
+        )
+        completed_admin_tasks = set(
+            AdminTask.objects.filter(
+                new_hire__id__in=user_ids, completed=True, based_on__isnull=False
+            ).values_list("new_hire_id", "based_on_id")
+        )
+
+        counters = []
+        for user_id, condition_id, condition_type in conditions:
+            if condition_type == Condition.Type.TODO:
+                items = triggers.get(("condition_to_do", condition_id), set())
+                completed = completed_to_dos
+            else:
+                items = triggers.get(("condition_admin_tasks", condition_id), set())
+                completed = completed_admin_tasks
+            counters.append(
+                ConditionTriggerCounter(
+                    user_id=user_id,
+                    condition_id=condition_id,
+                    pending=len(
+                        [item for item in items if (user_id, item) not in completed]
+                    ),
+                )
+            )
+
+        # Update in place, so rows that might be locked by a completion stay the same
+        current = {(counter.user_id, counter.condition_id) for counter in counters}
+        with transaction.atomic():
+            self.get_queryset().filter(
+                id__in=[
+                    counter_id
+                    for counter_id, user_id, condition_id in self.get_queryset()
+                    .filter(user__id__in=user_ids)
+                    .values_list("id", "user_id", "condition_id")
+                    if (user_id, condition_id) not in current
+                ]
+            ).delete()
+            self.bulk_create(
+                counters,
+                update_conflicts=True,
+                unique_fields=["user", "condition"],
+                update_fields=["pending"],
+            )
+
+    def refresh_for_condition(self, condition):
+        self.refresh_for_users(condition.user_set.values_list("id", flat=True))
+
+    def complete_trigger(self, user, conditions):
+        """
+        One of the trigger items of the conditions has been completed by the user.
+        Rows are locked, so only one completion can bring a counter to zero.
+
+        :param user User: the user that completed the item
+        :param conditions QuerySet: the user's conditions that contain the item
+        :return list: ids of the conditions that should be triggered now
+        """
+        triggered = []
+        with transaction.atomic():
+            for counter in (
+                self.get_queryset()
+                .select_for_update()
+                .filter(user=user, condition__in=conditions, pending__gt=0)
+                .order_by("id")
+            ):
+                counter.pending -= 1
+                counter.save(update_fields=["pending"])
+                if counter.pending == 0:
+                    triggered.append(counter.condition_id)
+        return triggered
+
+    def reopen_trigger(self, user, conditions):
+        """
+        One of the trigger items of the conditions got uncompleted by the user.
+
+        :param user User: the user the item got reopened for
+        :param conditions QuerySet: the user's conditions that contain the item
+        """
+        self.get_queryset().filter(user=user, condition__in=conditions).update(
+            pending=F("pending") + 1
+        )
+
+
+class ConditionTriggerCounter(models.Model):
+    # Amount of trigger items (to do items or admin tasks) of a condition the user
+    # still has to complete. The condition fires when this hits zero, so completing
+    # an item doesn't require recounting all other trigger items.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="condition_trigger_counters",
+    )
+    condition = models.ForeignKey(
+        Condition, on_delete=models.CASCADE, related_name="trigger_counters"
+    )
+    pending = models.IntegerField(default=0)
+
+    objects = ConditionTriggerCounterManager()
+
+    class Meta:
+        unique_together = ["user", "condition"]
+
+
+class SequenceAssignment(models.Model):
+    # Sequences that got assigned to a group of users at once. Conditions are added
+    # in one go, but everything that has to be executed per user runs in the
+    # background. This keeps track of how far along that is.
+    sequences = models.ManyToManyField(Sequence)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    total_users = models.IntegerField(default=0)
+    processed_users = models.IntegerField(default=0)
+
+    @property
+    def progress(self):
+        if self.total_users == 0:
+            return 100
+        return int(self.processed_users / self.total_users * 100)
+
+    @property
+    def completed(self):
+        return self.processed_users >= self.total_users
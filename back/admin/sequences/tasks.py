@@ -1,6 +1,6 @@
-from datetime import timedelta
-
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django_q.tasks import async_task
@@ -8,7 +8,7 @@ from django_q.tasks import async_task
 from admin.badges.models import Badge
 from admin.introductions.models import Introduction
 from admin.sequences.emails import send_sequence_update_message
-from admin.sequences.models import Condition
+from admin.sequences.models import Condition, ConditionSchedule, SequenceAssignment
 from organization.models import Notification, Organization
 from slack_bot.slack_intro import SlackIntro
 from slack_bot.slack_resource import SlackResource
@@ -31,60 +31,81 @@ def process_condition(condition_id, user_id, send_email=True):
     condition.process_condition(user)
 
     # Send notifications to user
-    notifications = Notification.objects.filter(
-        notification_type__in=[
-            Notification.Type.ADDED_TODO,
-            Notification.Type.ADDED_RESOURCE,
-            Notification.Type.ADDED_BADGE,
-            Notification.Type.ADDED_INTRODUCTION,
-        ],
-        created_for=user,
-        notified_user=False,
+    notification_types = [
+        Notification.Type.ADDED_TODO,
+        Notification.Type.ADDED_RESOURCE,
+        Notification.Type.ADDED_BADGE,
+        Notification.Type.ADDED_INTRODUCTION,
+    ]
+    notifications = list(
+        Notification.objects.filter(
+            notification_type__in=notification_types,
+            created_for=user,
+            notified_user=False,
+        )
     )
 
-    if not notifications.exists():
+    if not notifications:
         return
 
     if user.has_slack_account:
+        item_ids = {
+            notification_type: [
+                notif.item_id
+                for notif in notifications
+                if notif.notification_type == notification_type
+            ]
+            for notification_type in notification_types
+        }
+
+        # Fetch all items upfront, one query per type
+        to_do_users = {
+            to_do_user.to_do_id: to_do_user
+            for to_do_user in ToDoUser.objects.filter(
+                user=user, to_do__id__in=item_ids[Notification.Type.ADDED_TODO]
+            ).select_related("to_do")
+        }
+        resource_users = {
+            resource_user.resource_id: resource_user
+            for resource_user in ResourceUser.objects.filter(
+                user=user, resource__id__in=item_ids[Notification.Type.ADDED_RESOURCE]
+            ).select_related("resource")
+        }
+        badges = Badge.objects.in_bulk(item_ids[Notification.Type.ADDED_BADGE])
+        intros = Introduction.objects.select_related(
+            "intro_person", "intro_person__profile_image"
+        ).in_bulk(item_ids[Notification.Type.ADDED_INTRODUCTION])
+
         to_do_blocks = [
-            SlackToDo(
-                ToDoUser.objects.get(to_do__id=notif.item_id, user=user), user
-            ).get_block()
-            for notif in notifications.filter(
-                notification_type=Notification.Type.ADDED_TODO
-            )
+            SlackToDo(to_do_users[item_id], user).get_block()
+            for item_id in item_ids[Notification.Type.ADDED_TODO]
+            if item_id in to_do_users
         ]
 
         resource_blocks = [
-            SlackResource(
-                ResourceUser.objects.get(user=user, resource__id=notif.item_id), user
-            ).get_block()
-            for notif in notifications.filter(
-                notification_type=Notification.Type.ADDED_RESOURCE
-            )
+            SlackResource(resource_users[item_id], user).get_block()
+            for item_id in item_ids[Notification.Type.ADDED_RESOURCE]
+            if item_id in resource_users
         ]
 
         badge_blocks = []
-        for notif in notifications.filter(
-            notification_type=Notification.Type.ADDED_BADGE
-        ):
+        for item_id in item_ids[Notification.Type.ADDED_BADGE]:
+            if item_id not in badges:
+                continue
             badge_blocks.append(
                 paragraph(
                     _("*Congrats, you unlocked: %(item_name)s *")
                     % {
-                        "item_name": user.personalize(
-                            Badge.objects.get(id=notif.item_id).name
-                        ),
+                        "item_name": user.personalize(badges[item_id].name),
                     },
                 ),
             )
-            badge_blocks += Badge.objects.get(id=notif.item_id).to_slack_block(user)
+            badge_blocks += badges[item_id].to_slack_block(user)
 
         intro_blocks = [
-            SlackIntro(Introduction.objects.get(id=notif.item_id), user).format_block()
-            for notif in notifications.filter(
-                notification_type=Notification.Type.ADDED_INTRODUCTION
-            )
+            SlackIntro(intros[item_id], user).format_block()
+            for item_id in item_ids[Notification.Type.ADDED_INTRODUCTION]
+            if item_id in intros
         ]
 
         if len(to_do_blocks):
@@ -124,10 +145,79 @@ def process_condition(condition_id, user_id, send_email=True):
         send_sequence_update_message(notifications, user)
 
     # Update notifications to not notify user again
-    notifications.update(notified_user=True)
+    Notification.objects.filter(id__in=[notif.id for notif in notifications]).update(
+        notified_user=True
+    )
+
+
+def assign_sequences_to_users(sequences, users, created_by=None):
+    """
+    Assign sequences to a group of users at once. Conditions and items are added in
+    one transaction, everything that has to be executed per user (admin tasks,
+    messages and integrations) is offloaded to the task queue.
+
+    :param sequences list: the sequences that should be assigned
+    :param users list: the users the sequences should be assigned to
+    :param created_by User: the user that assigned the sequences
+    :return SequenceAssignment: to follow the progress of the background tasks
+    """
+    sequences = list(sequences)
+    users = list(users)
+
+    with transaction.atomic():
+        for sequence in sequences:
+            sequence.assign_to_users(users)
+
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    notification_type=Notification.Type.ADDED_SEQUENCE,
+                    item_id=sequence.id,
+                    created_for=user,
+                    extra_text=sequence.name,
+                )
+                for user in users
+                for sequence in sequences
+            ]
+        )
+        get_user_model().objects.refresh_progress([user.id for user in users])
+
+        assignment = SequenceAssignment.objects.create(
+            created_by=created_by, total_users=len(users)
+        )
+        assignment.sequences.set(sequences)
 
-    # Update user amount completed
-    user.update_progress()
+    for user in users:
+        async_task(
+            process_sequence_assignment,
+            assignment.id,
+            user.id,
+            task_name=f"Process sequence assignment: {assignment.id} for "
+            f"{user.full_name}",
+        )
+
+    return assignment
+
+
+def process_sequence_assignment(assignment_id, user_id):
+    """
+    Execute the unconditional items of the assigned sequences for one user
+
+    :param assignment_id int: the assignment the user is part of
+    :param user_id int: the user the sequences got assigned to
+    """
+    assignment = SequenceAssignment.objects.get(id=assignment_id)
+    user = get_user_model().objects.get(id=user_id)
+
+    for condition in Condition.objects.filter(
+        sequence__in=assignment.sequences.all(),
+        condition_type=Condition.Type.WITHOUT,
+    ):
+        condition.execute_items([user])
+
+    SequenceAssignment.objects.filter(id=assignment_id).update(
+        processed_users=F("processed_users") + 1
+    )
 
 
 def timed_triggers():
@@ -135,7 +225,8 @@ def timed_triggers():
     This gets triggered every 5 minutes to trigger conditions within sequences.
     These conditions are already assigned to new hires.
     """
-    org = Organization.object.get()
+    # Not the cached organization, the last check is updated below without saving it
+    org = Organization.objects.first()
     if org is None:
         return
 
@@ -155,44 +246,25 @@ def timed_triggers():
         minute=last_updated.minute - off_by_minutes, second=0, microsecond=0
     )
 
-    # Generally this loop will only go through once. In the case of an outage, it will
-    # walk through all the 5 minutes that it needs to catch up on based on the last
-    # updated variable
-    while current_datetime > last_updated:
-        last_updated += timedelta(minutes=5)
-        org.timed_triggers_last_check = last_updated
-        org.save()
-
-        for user in get_user_model().new_hires.all():
-            amount_days = user.workday
-            amount_days_before = user.days_before_starting
-            current_time = user.get_local_time(last_updated).time()
-
-            # Get conditions before/after they started
-            # Generally, this should be only one, but just in case, we can handle more
-            conditions = Condition.objects.none()
-            if amount_days == 0:
-                # Before starting
-                conditions = user.conditions.filter(
-                    condition_type=Condition.Type.BEFORE,
-                    days=amount_days_before,
-                    time=current_time,
-                )
-            elif user.get_local_time(last_updated).weekday() < 5:
-                # On workday x
-                conditions = user.conditions.filter(
-                    condition_type=Condition.Type.AFTER,
-                    days=amount_days,
-                    time=current_time,
-                )
+    if current_datetime <= last_updated:
+        return
 
-            # Schedule conditions to be executed with new scheduled task, we do this to
-            # avoid long standing tasks. I.e. sending lots of emails might take more
-            # time.
-            for i in conditions:
-                async_task(
-                    process_condition,
-                    i.id,
-                    user.id,
-                    task_name=f"Process condition: {i.id} for {user.full_name}",
-                )
+    Organization.objects.filter(id=org.id).update(
+        timed_triggers_last_check=current_datetime
+    )
+
+    # Fire moments are precalculated per user, so this is a single range query. In
+    # the case of an outage, this will also catch up on everything that got missed
+    # since the last check.
+    # Schedule conditions to be executed with new scheduled task, we do this to avoid
+    # long standing tasks. I.e. sending lots of emails might take more time.
+    for scheduled in ConditionSchedule.objects.due(last_updated, current_datetime):
+        async_task(
+            process_condition,
+            scheduled.condition_id,
+            scheduled.user_id,
+            task_name=(
+                f"Process condition: {scheduled.condition_id} for "
+                f"{scheduled.user.full_name}"
+            ),
+        )
@@ -36,6 +36,8 @@ from admin.sequences.forms import (
 )
 from admin.sequences.models import (
     Condition,
+    ConditionSchedule,
+    ConditionTriggerCounter,
     ExternalMessage,
     IntegrationConfig,
     PendingAdminTask,
@@ -44,7 +46,11 @@ from admin.sequences.models import (
     PendingTextMessage,
     Sequence,
 )
-from admin.sequences.tasks import process_condition, timed_triggers
+from admin.sequences.tasks import (
+    assign_sequences_to_users,
+    process_condition,
+    timed_triggers,
+)
 from admin.to_do.factories import ToDoFactory
 from admin.to_do.forms import ToDoForm
 from admin.to_do.models import ToDo
@@ -1043,6 +1049,116 @@ def test_sequence_trigger_two_people_same_time(
     assert new_hire2.to_do.all().count() == 1
 
 
+@pytest.mark.django_db
+@freeze_time("2022-05-13 12:02")
+def test_sequence_trigger_task_catch_up_after_outage(
+    sequence_factory, new_hire_factory, condition_timed_factory, to_do_factory
+):
+    org = Organization.object.get()
+    # Triggers haven't run for more than a day
+    org.timed_triggers_last_check = timezone.now() - timedelta(days=1, hours=4)
+    org.save()
+
+    # Started yesterday (Thursday), so today is their second workday
+    new_hire1 = new_hire_factory(start_day=datetime.date(2022, 5, 12))
+
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+    to_do3 = to_do_factory()
+
+    seq = sequence_factory()
+    # Missed during the outage
+    condition1 = condition_timed_factory(days=1, time="09:00")
+    condition1.add_item(to_do1)
+    condition2 = condition_timed_factory(days=2, time="11:00")
+    condition2.add_item(to_do2)
+    # Still in the future
+    condition3 = condition_timed_factory(days=2, time="12:05")
+    condition3.add_item(to_do3)
+    seq.conditions.add(condition1, condition2, condition3)
+
+    new_hire1.add_sequences([seq])
+
+    timed_triggers()
+
+    org.refresh_from_db()
+    assert org.timed_triggers_last_check == timezone.now().replace(
+        minute=0, second=0, microsecond=0
+    )
+    assert new_hire1.to_do.all().count() == 2
+    assert not new_hire1.to_do.filter(id=to_do3.id).exists()
+
+
+@pytest.mark.django_db
+def test_condition_schedule(new_hire_factory, condition_timed_factory):
+    org = Organization.object.get()
+    org.timezone = "UTC"
+    org.save()
+
+    # Friday
+    new_hire1 = new_hire_factory(start_day=datetime.date(2022, 5, 13))
+    before_condition = condition_timed_factory(
+        condition_type=Condition.Type.BEFORE, days=2, time="10:00"
+    )
+    after_condition = condition_timed_factory(days=2, time="08:00")
+    new_hire1.conditions.add(before_condition, after_condition)
+
+    schedule = ConditionSchedule.objects.filter(user=new_hire1)
+    assert schedule.get(condition=before_condition).fire_at == datetime.datetime(
+        2022, 5, 11, 10, 0, tzinfo=datetime.timezone.utc
+    )
+    # Second workday is on Monday
+    assert schedule.get(condition=after_condition).fire_at == datetime.datetime(
+        2022, 5, 16, 8, 0, tzinfo=datetime.timezone.utc
+    )
+
+    # Changing the start day reschedules the conditions
+    new_hire1.start_day = datetime.date(2022, 5, 17)
+    new_hire1.save()
+    assert schedule.get(condition=after_condition).fire_at == datetime.datetime(
+        2022, 5, 18, 8, 0, tzinfo=datetime.timezone.utc
+    )
+
+    # Changing the timezone of the new hire too
+    new_hire1.timezone = "Europe/Amsterdam"
+    new_hire1.save()
+    assert schedule.get(condition=after_condition).fire_at == datetime.datetime(
+        2022, 5, 18, 6, 0, tzinfo=datetime.timezone.utc
+    )
+
+    # And changing the condition itself
+    after_condition.time = "09:00"
+    after_condition.save()
+    assert schedule.get(condition=after_condition).fire_at == datetime.datetime(
+        2022, 5, 18, 7, 0, tzinfo=datetime.timezone.utc
+    )
+
+    # Removing the condition removes it from the schedule
+    new_hire1.conditions.remove(after_condition)
+    assert not schedule.filter(condition=after_condition).exists()
+
+    # Users without their own timezone follow the org timezone
+    new_hire1.timezone = ""
+    new_hire1.save()
+    org.timezone = "America/New_York"
+    org.save()
+    assert schedule.get(condition=before_condition).fire_at == datetime.datetime(
+        2022, 5, 15, 14, 0, tzinfo=datetime.timezone.utc
+    )
+
+
+@pytest.mark.django_db
+def test_condition_schedule_never_fires_on_weekend(
+    new_hire_factory, condition_timed_factory
+):
+    # Starts on a Saturday, first workday never falls on a weekday
+    new_hire1 = new_hire_factory(start_day=datetime.date(2022, 5, 14))
+    condition = condition_timed_factory(days=1)
+    new_hire1.conditions.add(condition)
+
+    assert not ConditionSchedule.objects.filter(user=new_hire1).exists()
+
+
 # MODEL TESTS
 
 
@@ -1226,6 +1342,97 @@ def test_sequence_assign_to_user_merge_to_do_condition(
     assert new_hire.conditions.all().count() == 2
 
 
+@pytest.mark.django_db
+def test_condition_trigger_signature(condition_to_do_factory, to_do_factory):
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+
+    condition1 = condition_to_do_factory(condition_to_do=[to_do1])
+    condition1.condition_to_do.set([to_do1])
+    condition2 = condition_to_do_factory(condition_to_do=[to_do2])
+    condition2.condition_to_do.set([to_do2])
+    assert condition1.trigger_signature != condition2.trigger_signature
+
+    # Order of the to do items does not matter
+    condition1.condition_to_do.add(to_do2)
+    condition2.condition_to_do.add(to_do1)
+    condition1.refresh_from_db()
+    condition2.refresh_from_db()
+    assert condition1.trigger_signature == condition2.trigger_signature
+
+    # Also updates when changed from the to do side
+    to_do2.condition_to_do.remove(condition2)
+    condition2.refresh_from_db()
+    assert condition1.trigger_signature != condition2.trigger_signature
+
+    to_do2.condition_to_do.add(condition2)
+    condition2.refresh_from_db()
+    assert condition1.trigger_signature == condition2.trigger_signature
+
+    # Days and time don't matter for to do based conditions
+    condition2.days = 10
+    condition2.save()
+    assert condition1.trigger_signature == condition2.trigger_signature
+
+    # Type does
+    condition2.condition_type = Condition.Type.AFTER
+    condition2.save()
+    assert condition1.trigger_signature != condition2.trigger_signature
+
+
+@pytest.mark.django_db
+def test_condition_trigger_signature_deleted_trigger(
+    condition_to_do_factory, to_do_factory
+):
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+
+    condition1 = condition_to_do_factory()
+    condition1.condition_to_do.set([to_do1])
+    condition2 = condition_to_do_factory()
+    condition2.condition_to_do.set([to_do1, to_do2])
+
+    # Deleting the to do doesn't send `m2m_changed`, but should still update it
+    to_do2.delete()
+    condition2.refresh_from_db()
+    assert condition1.trigger_signature == condition2.trigger_signature
+
+
+@pytest.mark.django_db
+def test_condition_trigger_signature_deleted_admin_task(
+    condition_admin_task_factory,
+    pending_admin_task_factory,
+    admin_task_factory,
+    new_hire_factory,
+):
+    pending_admin_task1 = pending_admin_task_factory()
+    pending_admin_task2 = pending_admin_task_factory()
+
+    condition1 = condition_admin_task_factory()
+    condition1.condition_admin_tasks.set([pending_admin_task1])
+    condition2 = condition_admin_task_factory()
+    condition2.condition_admin_tasks.set([pending_admin_task1, pending_admin_task2])
+    condition1.refresh_from_db()
+    condition2.refresh_from_db()
+    assert condition1.trigger_signature != condition2.trigger_signature
+
+    # Admin tasks of a new hire are not triggers themselves, deleting them (or the
+    # new hire) leaves the conditions alone
+    new_hire = new_hire_factory()
+    admin_task_factory(new_hire=new_hire, based_on=pending_admin_task2).delete()
+    admin_task_factory(new_hire=new_hire, based_on=pending_admin_task2)
+    new_hire.delete()
+    condition2.refresh_from_db()
+    assert condition2.condition_admin_tasks.count() == 2
+    assert condition1.trigger_signature != condition2.trigger_signature
+
+    # Deleting the pending admin task doesn't send `m2m_changed`, but should still
+    # update it
+    pending_admin_task2.delete()
+    condition2.refresh_from_db()
+    assert condition1.trigger_signature == condition2.trigger_signature
+
+
 @pytest.mark.django_db
 def test_sequence_assign_to_user_merge_time_condition(
     sequence_factory,
@@ -1381,6 +1588,110 @@ def test_sequence_add_unconditional_item(
     assert new_hire.preboarding.all().count() == 2
 
 
+@pytest.mark.django_db
+def test_sequence_assign_to_users(
+    sequence_factory,
+    new_hire_factory,
+    condition_timed_factory,
+    condition_to_do_factory,
+    to_do_factory,
+):
+    new_hire1 = new_hire_factory()
+    new_hire2 = new_hire_factory()
+
+    # First new hire already has a condition on the same moment
+    sequence1 = sequence_factory()
+    to_do1 = to_do_factory()
+    condition_timed_factory(sequence=sequence1, days=1).to_do.add(to_do1)
+    new_hire1.add_sequences([sequence1])
+
+    sequence2 = sequence_factory()
+    to_do2 = to_do_factory()
+    to_do3 = to_do_factory()
+    to_do4 = to_do_factory()
+    trigger_to_do = to_do_factory()
+    condition_timed_factory(sequence=sequence2, days=1).to_do.add(to_do2)
+    condition = condition_to_do_factory(sequence=sequence2)
+    condition.condition_to_do.set([trigger_to_do])
+    condition.to_do.add(to_do3)
+    sequence2.conditions.get(condition_type=Condition.Type.WITHOUT).to_do.add(to_do4)
+
+    sequence2.assign_to_users([new_hire1, new_hire2])
+
+    # Timed condition got merged for the first new hire
+    assert new_hire1.conditions.count() == 2
+    assert set(
+        new_hire1.conditions.get(condition_type=Condition.Type.AFTER).to_do.all()
+    ) == {to_do1, to_do2}
+
+    # And shared with the second one
+    assert set(new_hire2.conditions.all()) == set(
+        sequence2.conditions.exclude(condition_type=Condition.Type.WITHOUT)
+    )
+    assert new_hire1.conditions.get(condition_type=Condition.Type.TODO) == condition
+
+    # Unconditional items have been added directly
+    assert to_do4 in new_hire1.to_do.all()
+    assert to_do4 in new_hire2.to_do.all()
+
+    # Adding it a second time won't change anything
+    sequence2.assign_to_users([new_hire1, new_hire2])
+    assert new_hire1.conditions.count() == 2
+    assert new_hire2.conditions.count() == 2
+    assert (
+        new_hire2.conditions.get(condition_type=Condition.Type.AFTER).to_do.count() == 1
+    )
+
+
+@pytest.mark.django_db
+def test_assign_sequences_to_users(
+    sequence_factory,
+    new_hire_factory,
+    admin_factory,
+    to_do_factory,
+    pending_admin_task_factory,
+):
+    admin = admin_factory()
+    new_hire1 = new_hire_factory()
+    new_hire2 = new_hire_factory()
+    sequence = sequence_factory()
+    to_do = to_do_factory()
+    pending_admin_task = pending_admin_task_factory()
+    unconditional_condition = sequence.conditions.get(
+        condition_type=Condition.Type.WITHOUT
+    )
+    unconditional_condition.to_do.add(to_do)
+    unconditional_condition.admin_tasks.add(pending_admin_task)
+
+    assignment = assign_sequences_to_users(
+        Sequence.objects.filter(id=sequence.id),
+        [new_hire1, new_hire2],
+        created_by=admin,
+    )
+
+    assert list(assignment.sequences.all()) == [sequence]
+    assert assignment.total_users == 2
+    assert assignment.created_by == admin
+    assert (
+        Notification.objects.filter(
+            notification_type=Notification.Type.ADDED_SEQUENCE, item_id=sequence.id
+        ).count()
+        == 2
+    )
+
+    # Tasks run synchronously in tests, so all users have been processed
+    assignment.refresh_from_db()
+    assert assignment.processed_users == 2
+    assert assignment.progress == 100
+    assert assignment.completed
+
+    for new_hire in [new_hire1, new_hire2]:
+        new_hire.refresh_from_db()
+        assert list(new_hire.to_do.all()) == [to_do]
+        assert new_hire.total_tasks == 1
+        assert AdminTask.objects.filter(new_hire=new_hire).count() == 1
+
+
 @pytest.mark.django_db
 def test_pending_email_message_item(
     new_hire_factory, admin_factory, pending_email_message_factory, mailoutbox
@@ -1650,9 +1961,294 @@ def test_condition_is_empty(condition_to_do_factory, to_do_factory):
     assert not condition.is_empty
 
 
+@pytest.mark.django_db
+def test_condition_process_condition_for_users(
+    condition_timed_factory,
+    new_hire_factory,
+    to_do_factory,
+    resource_factory,
+    badge_factory,
+    preboarding_factory,
+    django_assert_max_num_queries,
+):
+    condition = condition_timed_factory()
+    condition.to_do.add(*[to_do_factory() for _ in range(10)])
+    condition.resources.add(*[resource_factory() for _ in range(10)])
+    condition.badges.add(*[badge_factory() for _ in range(10)])
+    condition.preboarding.add(*[preboarding_factory() for _ in range(10)])
+    new_hires = [new_hire_factory() for _ in range(5)]
+
+    # One item has already been assigned before
+    new_hires[0].to_do.add(condition.to_do.first())
+
+    # Amount of queries does not depend on the amount of items or new hires
+    with django_assert_max_num_queries(25):
+        condition.process_condition_for_users(new_hires, skip_notification=True)
+
+    for new_hire in new_hires:
+        assert new_hire.to_do.count() == condition.to_do.count()
+        assert new_hire.resources.count() == condition.resources.count()
+        assert new_hire.badges.count() == condition.badges.count()
+        assert new_hire.preboarding.count() == condition.preboarding.count()
+
+    assert (
+        Notification.objects.filter(
+            notification_type=Notification.Type.ADDED_TODO,
+            notified_user=True,
+            created_for=new_hires[0],
+        ).count()
+        == condition.to_do.count()
+    )
+    assert not Notification.objects.filter(
+        notification_type=Notification.Type.ADDED_TODO, notified_user=False
+    ).exists()
+
+
+@pytest.mark.django_db
+def test_condition_manager_empty(condition_to_do_factory, to_do_factory):
+    condition1 = condition_to_do_factory()
+    condition2 = condition_to_do_factory()
+    condition2.to_do.add(to_do_factory())
+
+    # Trigger items don't count
+    assert list(Condition.objects.empty()) == [condition1]
+
+
+@pytest.mark.django_db
+def test_sequence_remove_from_user(
+    sequence_factory,
+    new_hire_factory,
+    condition_timed_factory,
+    to_do_factory,
+    badge_factory,
+    django_assert_max_num_queries,
+):
+    new_hire = new_hire_factory()
+    sequence1 = sequence_factory()
+    sequence2 = sequence_factory()
+    to_do1 = to_do_factory()
+    condition = condition_timed_factory(sequence=sequence1, days=1)
+    condition.to_do.add(to_do1)
+    for i in range(2, 30):
+        condition = condition_timed_factory(sequence=sequence2, days=i)
+        condition.to_do.add(to_do_factory())
+        condition.badges.add(badge_factory())
+    # Same day as the one from sequence1, so this one will merge with it
+    condition = condition_timed_factory(sequence=sequence2, days=1)
+    condition.to_do.add(to_do_factory())
+
+    new_hire.add_sequences([sequence1, sequence2])
+    new_hire.to_do.add(*ToDo.objects.all())
+
+    assert new_hire.conditions.count() == 29
+
+    # Amount of queries doesn't depend on the amount of conditions
+    with django_assert_max_num_queries(35):
+        sequence2.remove_from_user(new_hire)
+
+    assert new_hire.conditions.count() == 1
+    assert list(new_hire.conditions.first().to_do.all()) == [to_do1]
+    assert list(new_hire.to_do.all()) == [to_do1]
+
+
+@pytest.mark.django_db
+def test_sequence_conditions_are_shared(
+    sequence_factory, new_hire_factory, condition_timed_factory, to_do_factory
+):
+    new_hire1 = new_hire_factory()
+    new_hire2 = new_hire_factory()
+    sequence = sequence_factory()
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+    condition = condition_timed_factory(sequence=sequence, days=1)
+    condition.to_do.add(to_do1)
+
+    new_hire1.add_sequences([sequence])
+    new_hire2.add_sequences([sequence])
+
+    # Nothing got copied, both new hires use the condition of the sequence
+    assert Condition.objects.filter(condition_type=Condition.Type.AFTER).count() == 1
+    assert new_hire1.conditions.get() == condition
+    assert new_hire2.conditions.get() == condition
+
+    # Changes to the sequence are picked up by the new hires
+    condition.to_do.add(to_do2)
+    assert set(new_hire1.conditions.get().to_do.all()) == {to_do1, to_do2}
+
+    # Customizing the condition for one new hire gives them their own copy
+    copies = condition.materialize_for_users([new_hire1])
+    new_hire_condition = new_hire1.conditions.get()
+    assert copies[new_hire1.id] == new_hire_condition
+    assert new_hire_condition.sequence is None
+    assert new_hire_condition.trigger_signature == condition.trigger_signature
+    assert set(new_hire_condition.to_do.all()) == {to_do1, to_do2}
+    assert new_hire2.conditions.get() == condition
+    assert not ConditionSchedule.objects.filter(
+        user=new_hire1, condition=condition
+    ).exists()
+
+    # Deleting the sequence keeps the timeline of the new hires intact
+    sequence.delete()
+    new_hire_condition = new_hire2.conditions.get()
+    assert new_hire_condition.sequence is None
+    assert set(new_hire_condition.to_do.all()) == {to_do1, to_do2}
+    assert new_hire1.conditions.count() == 1
+
+
+@pytest.mark.django_db
+def test_editing_sequence_condition_keeps_timeline_of_new_hires(
+    client,
+    admin_factory,
+    sequence_factory,
+    new_hire_factory,
+    condition_timed_factory,
+    to_do_factory,
+):
+    client.force_login(admin_factory())
+    new_hire1 = new_hire_factory()
+    new_hire2 = new_hire_factory()
+    sequence = sequence_factory()
+    to_do1 = to_do_factory(template=True)
+    to_do2 = to_do_factory(template=True)
+    condition = condition_timed_factory(sequence=sequence, days=1, time="08:00")
+    condition.to_do.add(to_do1)
+
+    new_hire1.add_sequences([sequence])
+    new_hire2.add_sequences([sequence])
+
+    # Saving without changes keeps sharing the condition
+    url = reverse("sequences:condition-update", args=[sequence.id, condition.id])
+    client.post(url, {"days": 1, "time": "08:00", "condition_type": 0})
+    client.post(
+        reverse("sequences:template_condition", args=[condition.id, "todo", to_do1.id])
+    )
+    assert new_hire1.conditions.get() == condition
+    assert new_hire2.conditions.get() == condition
+
+    client.post(url, {"days": 11, "time": "10:05", "condition_type": 0})
+    url = reverse(
+        "sequences:template_condition", args=[condition.id, "todo", to_do2.id]
+    )
+    client.post(url)
+
+    # The sequence got updated
+    condition.refresh_from_db()
+    assert condition.days == 11
+    assert condition.time == datetime.time(10, 5)
+    assert set(condition.to_do.all()) == {to_do1, to_do2}
+    assert not condition.user_set.exists()
+
+    # The new hires that already had the sequence keep their timeline
+    for new_hire in [new_hire1, new_hire2]:
+        new_hire_condition = new_hire.conditions.get()
+        assert new_hire_condition.sequence is None
+        assert new_hire_condition.days == 1
+        assert new_hire_condition.time == datetime.time(8, 0)
+        assert list(new_hire_condition.to_do.all()) == [to_do1]
+
+
+@pytest.mark.django_db
+def test_condition_trigger_counter(
+    sequence_factory, new_hire_factory, condition_to_do_factory, to_do_factory
+):
+    from users.models import ToDoUser
+
+    new_hire = new_hire_factory()
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+    to_do3 = to_do_factory()
+    sequence = sequence_factory()
+    condition = condition_to_do_factory(sequence=sequence)
+    condition.condition_to_do.set([to_do1, to_do2])
+    condition.to_do.add(to_do3)
+
+    new_hire.add_sequences([sequence])
+    new_hire_condition = new_hire.conditions.get()
+    counter = ConditionTriggerCounter.objects.get(
+        user=new_hire, condition=new_hire_condition
+    )
+    assert counter.pending == 2
+
+    to_do_user1 = ToDoUser.objects.create(user=new_hire, to_do=to_do1)
+    to_do_user2 = ToDoUser.objects.create(user=new_hire, to_do=to_do2)
+
+    to_do_user1.mark_completed()
+    counter.refresh_from_db()
+    assert counter.pending == 1
+
+    # Completing it again doesn't count twice
+    to_do_user1.mark_completed()
+    counter.refresh_from_db()
+    assert counter.pending == 1
+    assert not new_hire.to_do.filter(id=to_do3.id).exists()
+
+    # Reopening it counts it again
+    to_do_user1.reopen()
+    counter.refresh_from_db()
+    assert counter.pending == 2
+
+    to_do_user1.mark_completed()
+    to_do_user2.mark_completed()
+    counter.refresh_from_db()
+    assert counter.pending == 0
+    assert new_hire.to_do.filter(id=to_do3.id).exists()
+
+    # Removing a completed item counts it again
+    to_do_user2.delete()
+    counter.refresh_from_db()
+    assert counter.pending == 1
+
+    # Changing the triggers recounts
+    new_hire_condition.condition_to_do.set([to_do1])
+    counter.refresh_from_db()
+    assert counter.pending == 0
+
+
 # TASKS
 
 
+@pytest.mark.django_db
+def test_process_condition_notification_queries(
+    condition_to_do_factory,
+    new_hire_factory,
+    to_do_factory,
+    resource_factory,
+    badge_factory,
+    introduction_factory,
+    django_assert_max_num_queries,
+    mailoutbox,
+):
+    condition = condition_to_do_factory()
+    for i in range(5):
+        condition.to_do.add(to_do_factory())
+        condition.resources.add(resource_factory())
+        condition.badges.add(badge_factory())
+        condition.introductions.add(introduction_factory())
+
+    # Amount of queries does not depend on the amount of items
+    new_hire = new_hire_factory(slack_user_id="test")
+    with django_assert_max_num_queries(70):
+        process_condition(condition.id, new_hire.id)
+
+    # Last message has the intros, badges and resources (to do items are separate)
+    assert len(cache.get("slack_blocks")) == 25
+    assert not Notification.objects.filter(
+        created_for=new_hire, notified_user=False
+    ).exists()
+
+    # Same when it gets send through email
+    new_hire = new_hire_factory()
+    with django_assert_max_num_queries(40):
+        process_condition(condition.id, new_hire.id)
+
+    assert len(mailoutbox) == 1
+    assert not (
+        Notification.objects.filter(created_for=new_hire, notified_user=False)
+        .exclude(notification_type=Notification.Type.SENT_EMAIL_NEWHIRE_UPDATES)
+        .exists()
+    )
+
+
 @pytest.mark.django_db
 def test_send_slack_message_after_process_condition(
     condition_to_do_factory,
@@ -160,6 +160,9 @@ class SequenceConditionUpdateView(LoginRequiredMixin, ManagerPermMixin, UpdateVi
         return kwargs
 
     def form_valid(self, form):
+        # new hires that already have the sequence keep the condition as it was
+        if form.has_changed():
+            form.instance.detach_from_users()
         form.save()
         return HttpResponse(headers={"HX-Trigger": "reload-sequence"})
 
@@ -45,7 +45,8 @@ class OrganizationGeneralUpdateView(
     success_message = _("Organization info has been updated")
 
     def get_object(self):
-        return Organization.object.get()
+        # the form changes it, so not the (shared) cached one
+        return Organization.objects.get()
 
     def form_valid(self, form):
         from admin.sequences.models import Sequence
@@ -71,7 +72,8 @@ class SlackSettingsUpdateView(
     success_message = _("Slackbot settings have been updated")
 
     def get_object(self):
-        return Organization.object.get()
+        # the form changes it, so not the (shared) cached one
+        return Organization.objects.get()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
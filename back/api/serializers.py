@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from admin.sequences.models import Sequence
+from admin.sequences.models import Sequence, SequenceAssignment
 from users.models import User
 
 
@@ -44,3 +44,25 @@ class SequenceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sequence
         fields = ["id", "name"]
+
+
+class SequenceAssignmentSerializer(serializers.ModelSerializer):
+    users = serializers.ListField(child=serializers.IntegerField(), write_only=True)
+
+    def validate_users(self, value):
+        if User.new_hires.filter(pk__in=value).count() != len(set(value)):
+            raise serializers.ValidationError("Not all new hire ids are valid.")
+        return value
+
+    class Meta:
+        model = SequenceAssignment
+        fields = [
+            "id",
+            "sequences",
+            "users",
+            "total_users",
+            "processed_users",
+            "progress",
+            "completed",
+        ]
+        read_only_fields = ["total_users", "processed_users"]
@@ -107,6 +107,45 @@ def test_sequences_endpoint(setup_rest, sequence_factory):
     ]
 
 
+@pytest.mark.django_db
+def test_sequence_assignment_endpoint(setup_rest, sequence_factory, new_hire_factory):
+    client = setup_rest
+
+    seq1 = sequence_factory()
+    new_hire1 = new_hire_factory()
+    new_hire2 = new_hire_factory()
+
+    response = client.post(
+        reverse("api:sequence_assignments"),
+        data={"sequences": [seq1.id], "users": [new_hire1.id, new_hire2.id]},
+        format="json",
+    )
+    assert response.status_code == 201
+    assignment_id = response.json()["id"]
+    assert response.json()["sequences"] == [seq1.id]
+    assert response.json()["total_users"] == 2
+
+    response = client.get(
+        reverse("api:sequence_assignment", args=[assignment_id]), format="json"
+    )
+    assert response.json() == {
+        "id": assignment_id,
+        "sequences": [seq1.id],
+        "total_users": 2,
+        "processed_users": 2,
+        "progress": 100,
+        "completed": True,
+    }
+
+    # Only new hires can get sequences assigned
+    response = client.post(
+        reverse("api:sequence_assignments"),
+        data={"sequences": [seq1.id], "users": [new_hire1.id, 1999999]},
+        format="json",
+    )
+    assert response.status_code == 400
+
+
 @pytest.mark.django_db
 def test_create_new_hire_endpoint(setup_rest, sequence_factory):
     client = setup_rest
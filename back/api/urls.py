@@ -7,4 +7,14 @@ urlpatterns = [
     path("users/", views.UserView.as_view(), name="users"),
     path("employees/", views.EmployeeView.as_view(), name="employees"),
     path("sequences/", views.SequenceView.as_view(), name="sequences"),
+    path(
+        "sequences/assign/",
+        views.SequenceAssignmentView.as_view(),
+        name="sequence_assignments",
+    ),
+    path(
+        "sequences/assign/<int:pk>/",
+        views.SequenceAssignmentDetailView.as_view(),
+        name="sequence_assignment",
+    ),
 ]
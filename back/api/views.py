@@ -2,13 +2,19 @@ from django.contrib.auth import get_user_model
 from django_q.tasks import async_task
 from rest_framework import generics
 
-from admin.sequences.models import Sequence
+from admin.sequences.models import Sequence, SequenceAssignment
+from admin.sequences.tasks import assign_sequences_to_users
 from organization.models import Notification, Organization
 from slack_bot.tasks import link_slack_users
 from users.emails import email_new_admin_cred
 from users.models import User
 
-from .serializers import EmployeeSerializer, SequenceSerializer, UserSerializer
+from .serializers import (
+    EmployeeSerializer,
+    SequenceAssignmentSerializer,
+    SequenceSerializer,
+    UserSerializer,
+)
 
 
 class UserView(generics.CreateAPIView):
@@ -59,8 +65,6 @@ class UserView(generics.CreateAPIView):
 
             # Linking user in Slack and sending welcome message (if exists)
             link_slack_users([user])
-            # Update user total todo items
-            user.update_progress()
 
             notification_type = Notification.Type.ADDED_NEWHIRE
         if role in [get_user_model().Role.ADMIN, get_user_model().Role.MANAGER]:
@@ -98,3 +102,27 @@ class SequenceView(generics.ListAPIView):
 
     queryset = Sequence.objects.all().order_by("id")
     serializer_class = SequenceSerializer
+
+
+class SequenceAssignmentView(generics.CreateAPIView):
+    """
+    API endpoint that assigns sequences to many new hires at once
+    """
+
+    serializer_class = SequenceAssignmentSerializer
+
+    def perform_create(self, serializer):
+        serializer.instance = assign_sequences_to_users(
+            serializer.validated_data["sequences"],
+            User.objects.filter(id__in=serializer.validated_data["users"]),
+            created_by=self.request.user,
+        )
+
+
+class SequenceAssignmentDetailView(generics.RetrieveAPIView):
+    """
+    API endpoint that shows the progress of assigning sequences
+    """
+
+    queryset = SequenceAssignment.objects.all()
+    serializer_class = SequenceAssignmentSerializer
@@ -307,6 +307,19 @@ AWS_STORAGE_BUCKET_NAME = env("AWS_STORAGE_BUCKET_NAME", default="")
 AWS_REGION = env("AWS_REGION", default="eu-west-1")
 AWS_DEFAULT_REGION = env("AWS_DEFAULT_REGION", default=AWS_REGION)
 
+# Integrations
+# Connections to the same provider are kept open and reused between requests
+INTEGRATION_POOL_SIZE = env.int("INTEGRATION_POOL_SIZE", default=10)
+# Only retries requests that couldn't connect, so nothing is sent twice
+INTEGRATION_RETRIES = env.int("INTEGRATION_RETRIES", default=2)
+INTEGRATION_TIMEOUT = env.int("INTEGRATION_TIMEOUT", default=120)
+# Steps of a manifest that don't depend on each other run at the same time
+INTEGRATION_MAX_CONCURRENT_STEPS = env.int(
+    "INTEGRATION_MAX_CONCURRENT_STEPS", default=4
+)
+# Paginated responses never fetch more pages, in case an api keeps sending new ones
+INTEGRATION_MAX_PAGES = env.int("INTEGRATION_MAX_PAGES", default=1000)
+
 # Twilio
 TWILIO_FROM_NUMBER = env("TWILIO_FROM_NUMBER", default="")
 TWILIO_ACCOUNT_SID = env("TWILIO_ACCOUNT_SID", default="")
@@ -39,6 +39,7 @@ from organization.factories import (
     OrganizationFactory,
     WelcomeMessageFactory,
 )
+from organization.models import Organization
 from users.factories import (
     AdminFactory,
     DepartmentFactory,
@@ -56,6 +57,8 @@ from users.factories import (
 
 @pytest.fixture(autouse=True)
 def run_around_tests(request, settings):
+    # Don't reuse the organization of a previous test
+    Organization.object.clear_cache()
     if request.node.get_closest_marker("no_run_around_tests"):
         yield
         return
@@ -1,21 +1,91 @@
 import json
+from threading import local
+from time import monotonic
 
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import request_finished, request_started
 from django.db import models
 from django.db.models import JSONField
+from django.dispatch import receiver
 from django.utils.encoding import force_bytes
+from django.utils.functional import lazy
+from django_q.signals import pre_execute
 
 from misc.fernet_fields import EncryptedField
 
 from .models import File
 
 
+_files = local()
+# Files are only kept for the current request/task. Threads that don't have those
+# drop them once there are too many or they are too old.
+MAX_CACHED_FILES = 1000
+MAX_CACHED_FILES_AGE = 60
+
+
+def _get_files():
+    started = getattr(_files, "started", None)
+    if (
+        started is None
+        or monotonic() - started > MAX_CACHED_FILES_AGE
+        or len(_files.loaded) > MAX_CACHED_FILES
+        or len(_files.pending) > MAX_CACHED_FILES
+    ):
+        _files.__dict__.update(loaded={}, pending=set(), started=monotonic())
+    return _files.loaded, _files.pending
+
+
+def _get_file_url(file_id):
+    # Fetch all files that were loaded so far at once, instead of one by one
+    loaded, pending = _get_files()
+    if file_id not in loaded:
+        pending.add(file_id)
+        loaded.update(File.objects.in_bulk(pending))
+        pending.clear()
+    if file_id not in loaded:
+        raise File.DoesNotExist
+    return loaded[file_id].get_url()
+
+
+_lazy_file_url = lazy(_get_file_url, str)
+
+
+def lazy_file_url(file_id):
+    """
+    Signed url of a file that is only created once it's rendered
+    """
+    _get_files()[1].add(file_id)
+    return _lazy_file_url(file_id)
+
+
+@receiver(request_started)
+@receiver(request_finished)
+@receiver(pre_execute)
+def clear_file_cache(sender, **kwargs):
+    _files.__dict__.clear()
+
+
 class ContentJSONField(JSONField):
     """
     Custom JSONField renderer. It will update the signed url of the files before
     pushing it to the frontend. Signed urls expire. We will always want to fetch a new
-    one, so users don't bump into files that can't be fetched in the editor
+    one, so users don't bump into files that can't be fetched in the editor.
+
+    Urls are lazy, files of all loaded items are fetched with one query and the url is
+    only signed when it's actually rendered.
     """
 
+    def __init__(self, *args, **kwargs):
+        # The lazy urls need an encoder that knows how to handle them
+        kwargs.setdefault("encoder", DjangoJSONEncoder)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get("encoder") is DjangoJSONEncoder:
+            del kwargs["encoder"]
+        return name, path, args, kwargs
+
     def from_db_value(self, value, expression, connection):
         value = super().from_db_value(value, expression, connection)
         if "blocks" not in value:
@@ -24,9 +94,9 @@ class ContentJSONField(JSONField):
         for block in value["blocks"]:
             if block["type"] in ["attaches", "image"]:
                 if "id" in block["data"]["file"]:
-                    block["data"]["file"]["url"] = File.objects.get(
-                        id=block["data"]["file"]["id"]
-                    ).get_url()
+                    block["data"]["file"]["url"] = lazy_file_url(
+                        block["data"]["file"]["id"]
+                    )
                 else:
                     block["data"]["title"] = (
                         "File is invalid. Please remove and try again:"
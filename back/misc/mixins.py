@@ -1,50 +1,157 @@
+import hashlib
+import html
+import json
+import re
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import monotonic
+
 from misc.models import File
-from misc.urlparser import URLParser
+
+# Slack blocks of content that was sent recently, see
+# `ContentMixin._get_slack_block_templates`. Urls of files are valid for a week, so
+# the cache timeout needs to stay well below that.
+SLACK_BLOCK_CACHE_SIZE = 256
+SLACK_BLOCK_CACHE_TIMEOUT = 60 * 60
+
+# How the parts of a text in a cached Slack block are rendered for a user
+TEXT_LITERAL = 0
+TEXT_PERSONALIZED = 1
+TEXT_MRKDWN = 2
+
+_slack_block_cache = OrderedDict()
+_slack_block_cache_lock = Lock()
+
+HTML_TAG = re.compile(r"<(/?)([a-zA-Z]+)([^>]*)>")
+HTML_HREF = re.compile(r"""href\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+MRKDWN_MARKS = {
+    "p": "",
+    "br": "",
+    "b": "*",
+    "strong": "*",
+    "i": "_",
+    "em": "_",
+    "u": "",
+    "code": "`",
+    "strike": "~",
+}
+
+
+def html_to_mrkdwn(text):
+    """
+    Convert the HTML of a text block to Slack's mrkdwn in one pass. Links become
+    `<url|text>`, unknown tags and everything else are left as they are.
+    """
+    parts = []
+    # index in parts where the open link starts, the url and the original tag
+    link = None
+    position = 0
+    for match in HTML_TAG.finditer(text):
+        parts.append(text[position : match.start()])
+        position = match.end()
+        closing, tag, attrs = match.groups()
+        tag = tag.lower()
+        if tag in MRKDWN_MARKS:
+            parts.append(MRKDWN_MARKS[tag])
+        elif tag == "a" and not closing and link is None:
+            href = HTML_HREF.search(attrs)
+            if href is None:
+                parts.append(match.group())
+                continue
+            # attribute values are escaped (`&amp;`), Slack needs the actual url
+            url = html.unescape(href.group(1) or href.group(2) or "")
+            link = (len(parts), url, match.group())
+        elif tag == "a" and closing and link is not None:
+            start, url, _tag = link
+            link_text = "".join(parts[start:])
+            del parts[start:]
+            parts.append("<" + url + "|" + link_text + ">")
+            link = None
+        else:
+            parts.append(match.group())
+    parts.append(text[position:])
+
+    if link is not None:
+        # link was never closed, leave the tag in place
+        parts.insert(link[0], link[2])
+    return "".join(parts)
 
 
 class ContentMixin:
     def _prep_inner_text_for_slack(self, text):
-        replacements = (
-            ("<p>", ""),
-            ("</p>", ""),
-            ("<br>", ""),
-            ("<br />", ""),
-            ("<b>", "*"),
-            ("</b>", "*"),
-            ("<strong>", "*"),
-            ("</strong>", "*"),
-            ("</i>", "_"),
-            ("<i>", "_"),
-            ("<em>", "_"),
-            ("</em>", "_"),
-            ("<u>", ""),
-            ("</u>", ""),
-            ("<code>", "`"),
-            ("</code>", "`"),
-            ("</strike>", "~"),
-            ("<strike>", "~"),
-        )
-        for r in replacements:
-            text = text.replace(*r)
-            parser = URLParser()
-            parser.feed(text)
-            for link in parser.get_links():
-                text = text.replace(
-                    link["original_tag"] + link["text"] + "</a>",
-                    "<" + link["url"] + "|" + link["text"] + ">",
+        return html_to_mrkdwn(text)
+
+    def to_slack_block(self, user, **kwargs):
+        slack_blocks = []
+        for block, paths in self._get_slack_block_templates():
+            block = deepcopy(block)
+            # Only the personalization differs per user
+            for path, parts in paths:
+                parent = block
+                for key in path[:-1]:
+                    parent = parent[key]
+                parent[path[-1]] = "".join(
+                    self._render_text_part(user, part, kind) for part, kind in parts
                 )
+            slack_blocks.append(block)
+        return slack_blocks
+
+    def _render_text_part(self, user, text, kind):
+        # The text is personalized before it's converted, so values of the user are
+        # never read as HTML
+        if kind == TEXT_LITERAL:
+            return text
+        text = user.personalize(text)
+        if kind == TEXT_MRKDWN:
+            text = self._prep_inner_text_for_slack(text)
         return text
 
-    def to_slack_block(self, user, **kwargs):
-        blocks = getattr(self, "content")["blocks"]
+    def _get_slack_block_templates(self):
+        # The conversion to Slack blocks is the same for every user, so it's cached
+        # per version of the content. Changing the content gives it a new key.
+        content = getattr(self, "content")
+        # Urls of files are lazy (see `ContentJSONField`), leave them out
+        key = hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=lambda value: None).encode()
+        ).hexdigest()
+
+        with _slack_block_cache_lock:
+            cached = _slack_block_cache.get(key)
+            if cached is not None and cached[0] > monotonic():
+                _slack_block_cache.move_to_end(key)
+                return cached[1]
+
+        templates = self._build_slack_block_templates(content["blocks"])
+
+        with _slack_block_cache_lock:
+            _slack_block_cache[key] = (
+                monotonic() + SLACK_BLOCK_CACHE_TIMEOUT,
+                templates,
+            )
+            _slack_block_cache.move_to_end(key)
+            while len(_slack_block_cache) > SLACK_BLOCK_CACHE_SIZE:
+                _slack_block_cache.popitem(last=False)
+        return templates
+
+    def _build_slack_block_templates(self, blocks):
+        """
+        Convert the content blocks to Slack blocks, without personalizing them.
 
+        :return list: tuples of a Slack block and its texts that still need to be
+            personalized: the path (list of keys) to the text and the parts (text and
+            `TEXT_*` kind) it's made of
+        """
         # Is a course item with questions
         if len(blocks) == 0:
             return [
-                {
-                    "type": "section",
-                    "text": {"type": "mrkdwn", "text": "-"},
-                }
+                (
+                    {
+                        "type": "section",
+                        "text": {"type": "mrkdwn", "text": "-"},
+                    },
+                    [],
+                )
             ]
         if "data" not in blocks[0]:
             slack_blocks = []
@@ -63,101 +170,115 @@ class ContentMixin:
                     )
 
                 slack_blocks.append(
-                    {
-                        "type": "input",
-                        "block_id": f"item-{idx}",
-                        "element": {
-                            "type": "radio_buttons",
-                            "options": slack_options,
-                            "action_id": f"item-{idx}",
-                        },
-                        "label": {
-                            "type": "plain_text",
-                            "text": question["content"],
-                            "emoji": True,
+                    (
+                        {
+                            "type": "input",
+                            "block_id": f"item-{idx}",
+                            "element": {
+                                "type": "radio_buttons",
+                                "options": slack_options,
+                                "action_id": f"item-{idx}",
+                            },
+                            "label": {
+                                "type": "plain_text",
+                                "text": question["content"],
+                                "emoji": True,
+                            },
                         },
-                    }
+                        [],
+                    )
                 )
 
             return slack_blocks
 
+        # Get all files at once
+        files = File.objects.in_bulk(
+            [
+                item["data"]["file"]["id"]
+                for item in blocks
+                if item["type"] in ["attaches", "video", "image"]
+            ]
+        )
+
+        def get_file_url(file_id):
+            if file_id not in files:
+                return File.objects.get(id=file_id).get_url()
+            return files[file_id].get_url()
+
         slack_blocks = []
         for item in blocks:
+            # Texts are personalized for every user, they are filled in later on
+            text = []
             if "text" in item["data"]:
-                if item["data"]["text"] == "":
-                    item["data"]["text"] = "-"
-                text = user.personalize(item["data"]["text"])
-                item["data"]["text"] = self._prep_inner_text_for_slack(text)
-            if "items" in item["data"]:
-                for list_item in item["data"]["items"]:
-                    if list_item["content"] == "":
-                        list_item["content"] = "-"
-                    text = user.personalize(list_item["content"])
-                    list_item["content"] = self._prep_inner_text_for_slack(text)
-            if "text" in item["data"]:
-                default_text = item["data"]["text"]
-            else:
-                default_text = ""
+                text = [(item["data"]["text"] or "-", TEXT_MRKDWN)]
+            list_items = [
+                (list_item["content"] or "-", TEXT_MRKDWN)
+                for list_item in item["data"].get("items", [])
+            ]
 
             slack_block = {
                 "type": "section",
-                "text": {"type": "mrkdwn", "text": default_text},
+                "text": {"type": "mrkdwn", "text": ""},
             }
+            paths = [(["text", "text"], text)]
             if item["type"] == "header":
-                slack_block["text"]["text"] = "*" + item["data"]["text"] + "*"
+                paths = [
+                    (
+                        ["text", "text"],
+                        [("*", TEXT_LITERAL), *text, ("*", TEXT_LITERAL)],
+                    )
+                ]
             elif item["type"] == "quote":
                 slack_block = {
                     "type": "context",
-                    "elements": {
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": item["data"]["text"]
-                            + "\n"
-                            + item["data"]["caption"],
-                        }
-                    },
+                    "elements": {"text": {"type": "mrkdwn", "text": ""}},
                 }
-            elif item["type"] == "list" and item["data"]["style"] == "ordered":
-                ul_list = ""
-                for idx, list_item in enumerate(item["data"]["items"]):
-                    ul_list += (
-                        str(idx + 1)
-                        + ". "
-                        + user.personalize(list_item["content"])
-                        + "\n"
+                paths = [
+                    (
+                        ["elements", "text", "text"],
+                        text + [("\n" + item["data"]["caption"], TEXT_LITERAL)],
                     )
-                slack_block["text"]["text"] = ul_list
+                ]
+            elif item["type"] == "list" and item["data"]["style"] == "ordered":
+                ul_list = []
+                for idx, list_item in enumerate(list_items):
+                    ul_list += [
+                        (str(idx + 1) + ". ", TEXT_LITERAL),
+                        list_item,
+                        ("\n", TEXT_LITERAL),
+                    ]
+                paths = [(["text", "text"], ul_list)]
             elif item["type"] == "list" and item["data"]["style"] == "unordered":
-                ol_list = ""
-                for list_item in item["data"]["items"]:
-                    ol_list += "* " + user.personalize(list_item["content"]) + "\n"
-                slack_block["text"]["text"] = ol_list
+                ol_list = []
+                for list_item in list_items:
+                    ol_list += [("* ", TEXT_LITERAL), list_item, ("\n", TEXT_LITERAL)]
+                paths = [(["text", "text"], ol_list)]
             elif item["type"] == "delimiter":
                 slack_block = {"type": "divider"}
+                paths = []
             elif item["type"] == "attaches":
                 files_text = (
                     "<"
-                    + File.objects.get(id=item["data"]["file"]["id"]).get_url()
+                    + get_file_url(item["data"]["file"]["id"])
                     + "|"
                     + item["data"]["file"]["title"]
                     + ">"
                 )
                 slack_block["text"]["text"] = files_text
+                paths = []
             elif item["type"] == "video":
                 files_text = (
-                    "<"
-                    + File.objects.get(id=item["data"]["file"]["id"]).get_url()
-                    + "|Watch video>"
+                    "<" + get_file_url(item["data"]["file"]["id"]) + "|Watch video>"
                 )
                 slack_block["text"]["text"] = files_text
+                paths = []
             elif item["type"] == "image":
                 slack_block = {
                     "type": "image",
-                    "image_url": File.objects.get(
-                        id=item["data"]["file"]["id"]
-                    ).get_url(),
+                    "image_url": get_file_url(item["data"]["file"]["id"]),
                     "alt_text": "image",
                 }
+                paths = []
             elif item["type"] == "question":
                 options = []
                 for i in item["items"]:
@@ -165,7 +286,7 @@ class ContentMixin:
                         {
                             "text": {
                                 "type": "plain_text",
-                                "text": user.personalize(i["text"]),
+                                "text": "",
                                 "emoji": True,
                             },
                             "value": i["id"],
@@ -186,10 +307,17 @@ class ContentMixin:
                     },
                     "label": {
                         "type": "plain_text",
-                        "text": item["data"]["text"],
+                        "text": "",
                         "emoji": True,
                     },
                 }
+                paths = [(["label", "text"], text)] + [
+                    (
+                        ["element", "options", idx, "text", "text"],
+                        [(i["text"], TEXT_PERSONALIZED)],
+                    )
+                    for idx, i in enumerate(item["items"])
+                ]
             if item["type"] == "form":
                 if item["data"]["type"] == "input":
                     slack_block = {
@@ -201,10 +329,11 @@ class ContentMixin:
                         },
                         "label": {
                             "type": "plain_text",
-                            "text": item["data"]["text"],
+                            "text": "",
                             "emoji": True,
                         },
                     }
+                    paths = [(["label", "text"], text)]
                 if item["data"]["type"] == "text":
                     slack_block = {
                         "type": "input",
@@ -216,9 +345,10 @@ class ContentMixin:
                         },
                         "label": {
                             "type": "plain_text",
-                            "text": item["data"]["text"],
+                            "text": "",
                             "emoji": True,
                         },
                     }
-            slack_blocks.append(slack_block)
+                    paths = [(["label", "text"], text)]
+            slack_blocks.append((slack_block, paths))
         return slack_blocks
@@ -1,16 +1,51 @@
+import logging
+from threading import Lock
+
 import boto3
 from botocore.config import Config
 from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
 
 
 class S3:
+    # Signed urls are reused for at most a day, and never for more than half of the
+    # time they are valid, so a cached url always has most of its time left
+    URL_CACHE_TIMEOUT = 60 * 60 * 24
+
+    # One client per process, creating one is slow and they are thread safe
+    _client = None
+    _client_config = None
+    _lock = Lock()
+
+    # Hits and misses of the signed url cache of this process
+    url_cache_stats = {"hits": 0, "misses": 0}
+
     def __init__(self):
-        self.client = boto3.client(
-            "s3",
+        self.client = self.get_client()
+
+    @classmethod
+    def get_client(cls):
+        config = (
             settings.AWS_DEFAULT_REGION,
-            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-            config=Config(signature_version="s3v4"),
+            settings.AWS_S3_ENDPOINT_URL,
+            settings.AWS_ACCESS_KEY_ID,
         )
+        with cls._lock:
+            if cls._client is None or cls._client_config != config:
+                cls._client = boto3.client(
+                    "s3",
+                    settings.AWS_DEFAULT_REGION,
+                    endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                    config=Config(signature_version="s3v4"),
+                )
+                cls._client_config = config
+            return cls._client
+
+    @staticmethod
+    def _url_cache_key(key):
+        return f"s3_file_url:{settings.AWS_STORAGE_BUCKET_NAME}:{key}"
 
     def get_presigned_url(self, key, time=3600):
         return self.client.generate_presigned_url(
@@ -25,8 +60,16 @@ class S3:
         if settings.AWS_STORAGE_BUCKET_NAME == "":
             return ""
 
+        timeout = min(self.URL_CACHE_TIMEOUT, time // 2)
+        if timeout > 0:
+            url = cache.get(self._url_cache_key(key))
+            if url is not None:
+                S3.url_cache_stats["hits"] += 1
+                return url
+            S3.url_cache_stats["misses"] += 1
+
         try:
-            return self.client.generate_presigned_url(
+            url = self.client.generate_presigned_url(
                 ClientMethod="get_object",
                 ExpiresIn=time,
                 Params={"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": key},
@@ -35,7 +78,13 @@ class S3:
             print("Credentials are not set or incorrect")
             return ""
 
+        if timeout > 0:
+            cache.set(self._url_cache_key(key), url, timeout)
+        logger.debug("Signed url of %s, cache stats: %s", key, S3.url_cache_stats)
+        return url
+
     def delete_file(self, key):
+        cache.delete(self._url_cache_key(key))
         return self.client.delete_object(
             Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key
         )
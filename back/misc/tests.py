@@ -1,4 +1,13 @@
+from unittest.mock import patch
+
 import pytest
+from freezegun import freeze_time
+
+from admin.to_do.models import ToDo
+from misc.fields import _files, clear_file_cache, lazy_file_url
+from misc.mixins import ContentMixin, html_to_mrkdwn
+from misc.models import File
+from misc.s3 import S3
 
 
 @pytest.mark.django_db
@@ -20,3 +29,199 @@ def test_to_slack_block_questions(new_hire_factory, to_do_factory):
 
     assert to_do.to_slack_block(new_hire) == [{'type': 'input', 'block_id': 'item-0', 'element': {'type': 'radio_buttons', 'options': [{'text': {'type': 'plain_text', 'text': 'test', 'emoji': True}, 'value': 'temp-54be'}, {'text': {'type': 'plain_text', 'text': 'tesstt', 'emoji': True}, 'value': 'temp-4eb2'}, {'text': {'type': 'plain_text', 'text': 'testttttt', 'emoji': True}, 'value': 'temp-7300'}, {'text': {'type': 'plain_text', 'text': 'test2', 'emoji': True}, 'value': 'temp-215a'}], 'action_id': 'item-0'}, 'label': {'type': 'plain_text', 'text': 'TEst', 'emoji': True}}, {'type': 'input', 'block_id': 'item-1', 'element': {'type': 'radio_buttons', 'options': [{'text': {'type': 'plain_text', 'text': 'option1', 'emoji': True}, 'value': 'temp-6272'}, {'text': {'type': 'plain_text', 'text': 'option2', 'emoji': True}, 'value': 'temp-6e14'}], 'action_id': 'item-1'}, 'label': {'type': 'plain_text', 'text': 'Another question', 'emoji': True}}]  # noqa: E231, E501
     # fmt: on
+
+
+@pytest.mark.django_db
+def test_to_slack_block_cache(new_hire_factory, to_do_factory):
+    to_do = to_do_factory(
+        content={
+            "blocks": [
+                {"type": "paragraph", "data": {"text": "Hi {{ first_name }}"}},
+                {"type": "header", "data": {"text": "<b>Welcome</b>"}},
+            ]
+        }
+    )
+    new_hire1 = new_hire_factory(first_name="John")
+    new_hire2 = new_hire_factory(first_name="Jane")
+
+    assert to_do.to_slack_block(new_hire1)[0]["text"]["text"] == "Hi John"
+    with patch.object(ContentMixin, "_build_slack_block_templates") as build_blocks:
+        blocks = to_do.to_slack_block(new_hire2)
+
+    # conversion is reused, only the personalization differs
+    build_blocks.assert_not_called()
+    assert blocks[0]["text"]["text"] == "Hi Jane"
+    assert blocks[1]["text"]["text"] == "**Welcome**"
+    # content itself is left untouched
+    assert to_do.content["blocks"][0]["data"]["text"] == "Hi {{ first_name }}"
+
+    # changed content is converted again
+    to_do.content["blocks"][0]["data"]["text"] = "Bye {{ first_name }}"
+    to_do.save()
+    assert to_do.to_slack_block(new_hire2)[0]["text"]["text"] == "Bye Jane"
+
+
+@pytest.mark.django_db
+def test_to_slack_block_personalizes_before_converting(new_hire_factory, to_do_factory):
+    to_do = to_do_factory(
+        content={
+            "blocks": [
+                {"type": "paragraph", "data": {"text": "Hi {{ first_name }}"}},
+                {
+                    "type": "quote",
+                    "data": {"text": "{{ first_name }}", "caption": "{{ last_name }}"},
+                },
+                {
+                    "id": "question",
+                    "type": "question",
+                    "data": {"text": "Pick one"},
+                    "items": [{"id": "1", "text": "{{ first_name }}"}],
+                },
+            ]
+        }
+    )
+    new_hire = new_hire_factory(first_name="<b>John</b>", last_name="Doe")
+
+    blocks = to_do.to_slack_block(new_hire)
+    # Personalized values are escaped, so they can't add any markup
+    assert blocks[0]["text"]["text"] == "Hi &lt;b&gt;John&lt;/b&gt;"
+    # Quote captions are not personalized, question options are
+    assert (
+        blocks[1]["elements"]["text"]["text"]
+        == "&lt;b&gt;John&lt;/b&gt;\n{{ last_name }}"
+    )
+    assert (
+        blocks[2]["element"]["options"][0]["text"]["text"] == "&lt;b&gt;John&lt;/b&gt;"
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "html, mrkdwn",
+    [
+        ("<p>Hi <b>there</b><br></p>", "Hi *there*"),
+        (
+            "<strong>a</strong><em>b</em><code>c</code><strike>d</strike>",
+            "*a*_b_`c`~d~",
+        ),
+        ('<a href="https://google.com">test</a>', "<https://google.com|test>"),
+        (
+            "<a target='_blank' href='https://google.com'><b>test</b></a>",
+            "<https://google.com|*test*>",
+        ),
+        (
+            '<a href="https://google.com/search?q=a&amp;hl=en">test</a>',
+            "<https://google.com/search?q=a&hl=en|test>",
+        ),
+        ('<a href="https://google.com">test', '<a href="https://google.com">test'),
+        (
+            "<mark>&nbsp;{{ first_name }}</mark> 1 < 2",
+            "<mark>&nbsp;{{ first_name }}</mark> 1 < 2",
+        ),
+    ],
+)
+def test_html_to_mrkdwn(html, mrkdwn):
+    assert html_to_mrkdwn(html) == mrkdwn
+
+
+@pytest.mark.django_db
+def test_content_file_urls_are_lazy(
+    to_do_factory, file_factory, django_assert_num_queries
+):
+    for _ in range(3):
+        file = file_factory()
+        to_do_factory(
+            content={
+                "blocks": [
+                    {"type": "image", "data": {"file": {"id": file.id}}},
+                    {"type": "attaches", "data": {"file": {"id": file.id}}},
+                ]
+            }
+        )
+    clear_file_cache(sender=None)
+
+    with patch.object(File, "get_url", return_value="https://s3/file") as get_url:
+        with django_assert_num_queries(1):
+            to_dos = list(ToDo.objects.all())
+        # nothing is signed until it's rendered
+        get_url.assert_not_called()
+
+        with django_assert_num_queries(1):
+            urls = [
+                str(block["data"]["file"]["url"])
+                for to_do in to_dos
+                for block in to_do.content["blocks"]
+            ]
+        assert urls == ["https://s3/file"] * 6
+        assert get_url.call_count == 6
+
+        # content with lazy urls can still be saved
+        to_dos[0].save()
+
+
+@pytest.mark.django_db
+def test_lazy_file_url_cache_is_bounded(file_factory, monkeypatch):
+    file = file_factory(key="first")
+    clear_file_cache(sender=None)
+
+    with patch.object(File, "get_url", autospec=True, side_effect=str):
+        assert str(lazy_file_url(file.id)) == "first"
+        assert set(_files.loaded) == {file.id}
+
+        # Threads without requests/tasks don't keep files forever
+        monkeypatch.setattr("misc.fields.MAX_CACHED_FILES", 1)
+        for file_id in range(3):
+            lazy_file_url(file_id)
+        assert len(_files.pending) <= 2
+        assert _files.loaded == {}
+
+        File.objects.filter(id=file.id).update(key="second")
+        monkeypatch.setattr("misc.fields.MAX_CACHED_FILES_AGE", -1)
+        assert str(lazy_file_url(file.id)) == "second"
+
+
+@pytest.mark.django_db
+def test_s3_client_and_urls_are_reused(settings, file_factory, monkeypatch):
+    settings.AWS_ACCESS_KEY_ID = "xxx"
+    settings.AWS_STORAGE_BUCKET_NAME = "xxx"
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+
+    file = file_factory()
+    assert S3().client is S3().client
+
+    hits = S3.url_cache_stats["hits"]
+    misses = S3.url_cache_stats["misses"]
+    with patch.object(
+        S3.get_client(),
+        "generate_presigned_url",
+        wraps=S3.get_client().generate_presigned_url,
+    ) as sign:
+        with freeze_time("2024-01-01 10:00:00"):
+            url = file.get_url()
+            assert file.get_url() == url
+            assert file.key in url
+
+        sign.assert_called_once()
+        # Urls are still signed for the full week
+        assert sign.call_args.kwargs["ExpiresIn"] == 604799
+        assert S3.url_cache_stats["hits"] == hits + 1
+        assert S3.url_cache_stats["misses"] == misses + 1
+
+        # The cached url expires long before the signed url does
+        with freeze_time("2024-01-02 10:00:01"):
+            file.get_url()
+
+        assert sign.call_count == 2
+        assert S3.url_cache_stats["misses"] == misses + 2
+
+        # Urls that are only valid for a moment are not cached
+        S3().get_file(file.key, time=1)
+        assert sign.call_count == 3
+        assert S3.url_cache_stats["misses"] == misses + 2
+
+    # a new client is created when the settings change
+    client = S3.get_client()
+    settings.AWS_ACCESS_KEY_ID = "yyy"
+    assert S3.get_client() is not client
@@ -9,7 +9,7 @@ from .models import Organization
 def org_include(request):
     try:
         return {
-            "org": Organization.objects.first(),
+            "org": Organization.object.get(),
             "DEBUG": settings.DEBUG,
             "ConditionType": Condition.Type.__dict__,
             "ExternalMessageType": ExternalMessage.Type.__dict__,
@@ -1,17 +1,24 @@
+import uuid
 from datetime import datetime, timedelta
+from threading import local
 
 import pytz
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
 from django.core.cache import cache
+from django.core.signals import request_finished, request_started
 from django.db import models
 from django.db.models import CheckConstraint, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
+from django_q.signals import pre_execute
 
 from misc.mixins import ContentMixin
 from misc.models import File
@@ -74,8 +81,51 @@ def context_check_content_data(context:dict[str,str,str])->dict[str,str,str]:
     return context
 
 class ObjectManager(models.Manager):
+    # The organization is read all over the place, often once per user in a loop.
+    # Every process keeps a copy of it, which is reused as long as the version in the
+    # (shared) cache matches. The version is checked once per request/task and, for
+    # threads that never see a request/task start, at least every VERSION_CHECK_TTL.
+    # The same instance is handed out every time, so it's read-only: use
+    # `Organization.objects` to get one that can be changed.
+    VERSION_KEY = "organization_version"
+    VERSION_CHECK_TTL = timedelta(seconds=30)
+
+    _process = (None, None)
+    _local = local()
+
     def get(self):
-        return self.get_queryset().first()
+        organization = getattr(self._local, "organization", None)
+        checked_at = getattr(self._local, "checked_at", None)
+        if organization is None or checked_at < timezone.now() - self.VERSION_CHECK_TTL:
+            organization = self._load()
+            if organization is None:
+                return None
+            self._local.organization = organization
+            self._local.checked_at = timezone.now()
+        return organization
+
+    def _load(self):
+        version, organization = ObjectManager._process
+        cached_version = cache.get(self.VERSION_KEY)
+        if cached_version is None or cached_version != version:
+            organization = self.get_queryset().first()
+            if organization is None:
+                return None
+            if cached_version is None:
+                cached_version = uuid.uuid4().hex
+                cache.set(self.VERSION_KEY, cached_version, None)
+            ObjectManager._process = (cached_version, organization)
+        return organization
+
+    def clear_cache(self):
+        # Forget the organization of the current request/task
+        self._local.organization = None
+
+    def invalidate(self):
+        # Let all processes know they need to reload the organization
+        cache.set(self.VERSION_KEY, uuid.uuid4().hex, None)
+        ObjectManager._process = (None, None)
+        self.clear_cache()
 
 
 class Organization(models.Model):
@@ -226,6 +276,28 @@ class Organization(models.Model):
             ),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_timezone = dict(zip(field_names, values)).get("timezone")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super(Organization, self).save(*args, **kwargs)
+        Organization.object.invalidate()
+
+        if getattr(self, "_loaded_timezone", self.timezone) != self.timezone:
+            # avoid circular import
+            from admin.sequences.models import ConditionSchedule
+
+            # Users without their own timezone fall back on the org timezone
+            ConditionSchedule.objects.refresh_for_users(
+                get_user_model().objects.filter(timezone="").values_list(
+                    "id", flat=True
+                )
+            )
+        self._loaded_timezone = self.timezone
+
     @property
     def base_color_rgb(self):
         base_color = self.base_color.strip("#")
@@ -266,6 +338,19 @@ class Organization(models.Model):
         return cache.get("logo_url")
 
 
+@receiver(post_delete, sender=Organization)
+def invalidate_deleted_organization(sender, instance, **kwargs):
+    Organization.object.invalidate()
+
+
+@receiver(request_started)
+@receiver(request_finished)
+@receiver(pre_execute)
+def clear_organization_cache(sender, **kwargs):
+    # Every request/task starts with checking if the organization is still up to date
+    Organization.object.clear_cache()
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=500)
 
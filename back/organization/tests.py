@@ -7,6 +7,7 @@ from django.core.cache import cache
 from django.core.management import call_command
 from django.urls import reverse
 from django.utils import timezone
+from freezegun import freeze_time
 
 from misc.models import File
 
@@ -135,6 +136,46 @@ def test_cache_logo_url(settings, file_factory, monkeypatch):
     assert org.get_logo_url != logo_url
 
 
+@pytest.mark.django_db
+def test_organization_cache(django_assert_num_queries):
+    Organization.object.clear_cache()
+
+    # One query for the version and one for the organization
+    with django_assert_num_queries(2):
+        org = Organization.object.get()
+        Organization.object.get()
+        Organization.object.get()
+
+    # The same (read-only) instance is handed out, without copying it every time
+    assert Organization.object.get() is org
+
+    # Next request/task only checks the version
+    Organization.object.clear_cache()
+    with django_assert_num_queries(1):
+        Organization.object.get()
+
+    # Saving loads the organization again everywhere
+    org = Organization.objects.get()
+    org.name = "changed"
+    org.save()
+    assert Organization.object.get().name == "changed"
+
+    # Another process changed the organization
+    Organization.objects.update(name="other process")
+    Organization.object.invalidate()
+    assert Organization.object.get().name == "other process"
+
+    # Threads that don't get a request/task check the version once in a while
+    Organization.objects.update(name="other thread")
+    cache.set(Organization.object.VERSION_KEY, "new version", None)
+    assert Organization.object.get().name == "other process"
+    with freeze_time(timezone.now() + timedelta(minutes=1)):
+        assert Organization.object.get().name == "other thread"
+
+    Organization.objects.all().delete()
+    assert Organization.object.get() is None
+
+
 @pytest.mark.django_db
 def test_file_url(settings, client, new_hire_factory, file_factory, monkeypatch):
     settings.AWS_ACCESS_KEY_ID = "xxx"
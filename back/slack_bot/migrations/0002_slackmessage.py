@@ -0,0 +1,68 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    def load_schedules(apps, schema_editor):
+        from django_q.models import Schedule
+
+        Schedule.objects.create(
+            func="slack_bot.tasks.send_queued_messages",
+            schedule_type=Schedule.MINUTES,
+            minutes=1,
+        )
+
+    def remove_schedules(apps, schema_editor):
+        from django_q.models import Schedule
+
+        Schedule.objects.filter(func="slack_bot.tasks.send_queued_messages").delete()
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("django_q", "0001_initial"),
+        ("slack_bot", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlackMessage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("channel", models.CharField(max_length=255)),
+                ("text", models.TextField(blank=True, default="")),
+                ("blocks", models.JSONField(default=list)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "send_after",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("sent", models.DateTimeField(null=True)),
+                ("failed", models.BooleanField(default=False)),
+                ("attempts", models.IntegerField(default=0)),
+                (
+                    "created_for",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(load_schedules, remove_schedules),
+    ]
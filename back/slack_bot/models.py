@@ -1,4 +1,8 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 
 from .utils import Slack
 
@@ -21,3 +25,99 @@ class SlackChannel(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class SlackMessageManager(models.Manager):
+    # Text messages to the same channel that are queued within this window are sent
+    # as one
+    COALESCE_WINDOW = timedelta(seconds=30)
+    # Slack truncates longer texts
+    MAX_TEXT_LENGTH = 4000
+    # Claimed messages are skipped by other workers for this long. If sending them
+    # didn't finish by then (the worker got killed), they will be sent again.
+    CLAIM_TIMEOUT = timedelta(minutes=5)
+
+    def due(self):
+        return (
+            self.get_queryset()
+            .filter(sent__isnull=True, failed=False, send_after__lte=timezone.now())
+            .order_by("id")
+        )
+
+    def coalesce(self, messages):
+        """
+        Group the messages that can be sent as one message. Messages stay in the
+        order they were queued in. Only text messages are combined, messages with
+        blocks are sent as they are: their blocks could be interactive and are read
+        back when someone clicks on them (i.e. the to do items).
+
+        :param messages list: the (ordered) messages that should be sent
+        :return list: lists of messages, every list is one message to Slack
+        """
+        groups = []
+        open_groups = {}
+        for message in messages:
+            if len(message.blocks):
+                groups.append([message])
+                # Text that comes after this message shouldn't be moved before it
+                open_groups.pop(message.channel, None)
+                continue
+
+            group = open_groups.get(message.channel)
+            if (
+                group is None
+                or message.created - group[0].created > self.COALESCE_WINDOW
+                or sum(len(item.text) + 1 for item in group) + len(message.text)
+                > self.MAX_TEXT_LENGTH
+            ):
+                group = []
+                groups.append(group)
+                open_groups[message.channel] = group
+            group.append(message)
+        return groups
+
+    def claim_next(self):
+        """
+        Take the next group of due messages (see `coalesce`) to send. The claim is
+        committed right away, so no transaction is kept open while sending them.
+
+        :return list: messages to send as one message, empty if nothing is due
+        """
+        with transaction.atomic():
+            messages = list(self.due().select_for_update(skip_locked=True)[:100])
+            if not len(messages):
+                return []
+            group = self.coalesce(messages)[0]
+            self.filter(id__in=[message.id for message in group]).update(
+                send_after=timezone.now() + self.CLAIM_TIMEOUT
+            )
+        return group
+
+    def remove_sent(self, days=7):
+        # Sent messages are only kept for a while to look up the delivery latency
+        self.get_queryset().filter(
+            sent__isnull=False, sent__lt=timezone.now() - timedelta(days=days)
+        ).delete()
+
+
+class SlackMessage(models.Model):
+    # Message that is waiting to be sent by `slack_bot.tasks.send_queued_messages`
+    channel = models.CharField(max_length=255)
+    text = models.TextField(default="", blank=True)
+    blocks = models.JSONField(default=list)
+    created_for = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now, db_index=True)
+    sent = models.DateTimeField(null=True)
+    failed = models.BooleanField(default=False)
+    attempts = models.IntegerField(default=0)
+
+    objects = SlackMessageManager()
+
+    @property
+    def latency(self):
+        if self.sent is None:
+            return None
+        return self.sent - self.created
@@ -1,3 +1,5 @@
+from time import monotonic
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils import translation
@@ -6,11 +8,12 @@ from django.utils.translation import gettext as _
 
 from admin.integrations.models import Integration
 from organization.models import Organization, WelcomeMessage
+from slack_bot.models import SlackMessage
 from slack_bot.slack_intro import SlackIntro
 from slack_bot.slack_misc import get_new_hire_first_message_buttons
 from slack_bot.slack_resource import SlackResource
 from slack_bot.slack_to_do import SlackToDoManager
-from slack_bot.utils import Slack, actions, button, paragraph
+from slack_bot.utils import RateLimiter, Slack, actions, button, paragraph
 from users.models import ResourceUser, ToDoUser
 
 
@@ -25,11 +28,16 @@ def link_slack_users(users=[]):
     slack = Slack()
     org = Organization.object.get()
 
+    directory = None
     if len(users) == 0:
         users = get_user_model().new_hires.without_slack()
+        # Check all new hires against the Slack users at once. New Slack accounts
+        # are found once the directory gets refreshed.
+        if users.exists():
+            directory = slack.get_user_directory()
 
     for user in users:
-        response = slack.find_by_email(email=user.email.lower())
+        response = slack.find_by_email(email=user.email.lower(), directory=directory)
         if response:
             translation.activate(user.language)
             user.slack_user_id = response["user"]["id"]
@@ -87,16 +95,13 @@ def update_new_hire():
     ):
         return
 
-    for user in get_user_model().new_hires.with_slack():
-        local_datetime = user.get_local_time()
-
-        if not (
-            local_datetime.hour == 8
-            and local_datetime.weekday() < 5
-            and local_datetime.date() >= user.start_day
-        ):
-            continue
-
+    # New hires that have started and for whom it's 8 am on a weekday
+    new_hires = get_user_model().new_hires
+    for user in new_hires.with_workday(
+        new_hires.at_local_hour(8, start_day_lookup="lte", weekdays_only=True).exclude(
+            slack_user_id=""
+        )
+    ):
         translation.activate(user.language)
 
         overdue_items = ToDoUser.objects.overdue(user)
@@ -116,7 +121,7 @@ def update_new_hire():
             course_blocks.insert(
                 0, paragraph(_("Here are some courses that you need to complete"))
             )
-            Slack().send_message(
+            Slack().queue_message(
                 blocks=course_blocks,
                 text=_("Here are some courses that you need to complete"),
                 channel=user.slack_user_id,
@@ -138,7 +143,7 @@ def update_new_hire():
                 tasks.values_list("id", flat=True),
                 text=text,
             )
-            Slack().send_message(blocks=blocks, text=text, channel=user.slack_user_id)
+            Slack().queue_message(blocks=blocks, text=text, channel=user.slack_user_id)
 
 
 def first_day_reminder():
@@ -172,7 +177,7 @@ def first_day_reminder():
             if org.slack_default_channel is not None
             else "general"
         )
-        Slack().send_message(text=text, channel="#" + send_to)
+        Slack().queue_message(text=text, channel="#" + send_to)
 
 
 def birthday_reminder():
@@ -195,7 +200,7 @@ def birthday_reminder():
         text = _("It's %(names)s birthday today!") % {"names": names}
 
         send_to = org.slack_birthday_wishes_channel.name
-        Slack().send_message(text=text, channel="#" + send_to)
+        Slack().queue_message(text=text, channel="#" + send_to)
 
 
 def introduce_new_people():
@@ -284,7 +289,41 @@ def introduce_new_people():
         if org.slack_default_channel is not None
         else "general"
     )
-    Slack().send_message(channel="#" + send_to, text=text, blocks=blocks)
+    Slack().queue_message(channel="#" + send_to, text=text, blocks=blocks)
 
     # Make sure they aren't introduced again
     new_hires.update(is_introduced_to_colleagues=True)
+
+
+# Limits of one run of `send_queued_messages`, which runs every minute
+MAX_QUEUED_MESSAGES_PER_RUN = 200
+MAX_SECONDS_PER_RUN = 45
+
+
+def send_queued_messages():
+    """
+    Send the queued Slack messages. Messages to the same channel that were queued
+    shortly after each other are combined and Slack's rate limits are respected.
+    """
+    if not SlackMessage.objects.due().exists():
+        return
+
+    SlackMessage.objects.remove_sent()
+    slack = Slack()
+    rate_limiter = RateLimiter()
+    started = monotonic()
+    sent = 0
+    # Stay well within the task timeout, the next run picks up the rest
+    while (
+        sent < MAX_QUEUED_MESSAGES_PER_RUN
+        and monotonic() - started < MAX_SECONDS_PER_RUN
+    ):
+        group = SlackMessage.objects.claim_next()
+        if not len(group):
+            return
+
+        rate_limiter.wait("chat.postMessage", group[0].channel)
+        if slack.send_queued_messages(group) is not None:
+            # Slack asked to slow down, try again on the next run
+            return
+        sent += len(group)
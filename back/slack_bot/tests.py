@@ -5,19 +5,24 @@ from unittest.mock import Mock, patch
 import pytest
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.utils import timezone
 from django.utils.formats import localize
 from freezegun import freeze_time
+from slack_sdk.errors import SlackApiError
 
 from admin.integrations.models import Integration
-from organization.models import Organization, WelcomeMessage
-from slack_bot.models import SlackChannel
+from organization.models import Notification, Organization, WelcomeMessage
+from slack_bot.models import SlackChannel, SlackMessage
+from slack_bot.slack_to_do import SlackToDoManager
 from slack_bot.tasks import (
     birthday_reminder,
     first_day_reminder,
     introduce_new_people,
     link_slack_users,
+    send_queued_messages,
     update_new_hire,
 )
+from slack_bot.utils import Slack, paragraph
 from slack_bot.views import (
     slack_add_sequences_to_new_hire,
     slack_catch_all_message_search_resources,
@@ -1857,6 +1862,34 @@ def test_link_slack_users_slack_not_enabled(new_hire_factory, integration_factor
     assert new_hire.slack_user_id == "slackx"
 
 
+@pytest.mark.django_db
+def test_link_slack_users_with_directory(new_hire_factory, integration_factory):
+    integration_factory(integration=Integration.Type.SLACK_BOT)
+    new_hire1 = new_hire_factory(email="john@example.com")
+    new_hire2 = new_hire_factory(email="jane@example.com")
+    cache.delete("slack_directory")
+
+    get_all_users = Mock(
+        return_value=[
+            {"id": "slackx", "profile": {"email": "John@example.com"}},
+            {"id": "slacky", "profile": {"email": "old@example.com"}, "deleted": True},
+            {"id": "bot", "profile": {}},
+        ]
+    )
+    with patch("slack_bot.utils.Slack.get_all_users", get_all_users):
+        link_slack_users()
+        link_slack_users()
+
+    new_hire1.refresh_from_db()
+    new_hire2.refresh_from_db()
+    assert new_hire1.slack_user_id == "slackx"
+    assert new_hire2.slack_user_id == ""
+
+    # Directory was only loaded once
+    get_all_users.assert_called_once()
+    assert cache.get("slack_directory") == {"john@example.com": "slackx"}
+
+
 @pytest.mark.django_db
 @patch("slack_bot.utils.Slack.find_by_email", Mock(return_value=False))
 def test_link_slack_users_not_found(new_hire_factory, integration_factory):
@@ -2414,3 +2447,152 @@ def test_introduce_new_hire(new_hire_factory, integration_factory):
             ],
         },
     ]
+
+
+@pytest.mark.django_db
+def test_slack_client_is_shared(
+    settings, integration_factory, django_assert_num_queries
+):
+    settings.FAKE_SLACK_API = False
+    settings.SLACK_USE_SOCKET = False
+    Slack.clear_client()
+    integration = integration_factory(
+        integration=Integration.Type.SLACK_BOT, token="xoxb-1"
+    )
+
+    # Token is only looked up once
+    with django_assert_num_queries(1):
+        client = Slack().client
+        assert Slack().client is client
+    assert client.token == "xoxb-1"
+
+    # Changing the token creates a new client
+    integration.token = "xoxb-2"
+    integration.save()
+    assert Slack().client.token == "xoxb-2"
+
+    Slack.clear_client()
+
+
+@pytest.mark.django_db
+def test_send_queued_messages(settings, new_hire_factory):
+    settings.FAKE_SLACK_API = False
+    new_hire = new_hire_factory(slack_user_id="slackx")
+    client = Mock()
+
+    with patch("slack_bot.utils.Slack.get_client", Mock(return_value=client)):
+        Slack().queue_message(text="hi", channel="slackx")
+        Slack().queue_message(text="second", channel="slackx")
+        Slack().queue_message(text="other channel", channel="#general")
+
+        # Nothing has been sent yet
+        client.chat_postMessage.assert_not_called()
+        assert SlackMessage.objects.due().count() == 3
+
+        send_queued_messages()
+
+    # Text messages for the same channel are combined
+    assert client.chat_postMessage.call_count == 2
+    first_call = client.chat_postMessage.call_args_list[0].kwargs
+    assert first_call["channel"] == "slackx"
+    assert first_call["text"] == "hi\nsecond"
+    assert first_call["blocks"] == []
+
+    assert not SlackMessage.objects.due().exists()
+    assert all(message.latency is not None for message in SlackMessage.objects.all())
+    assert (
+        Notification.objects.filter(
+            notification_type=Notification.Type.SENT_SLACK_MESSAGE,
+            created_for=new_hire,
+        ).count()
+        == 2
+    )
+
+
+@pytest.mark.django_db
+def test_send_queued_messages_with_blocks_separately(
+    settings, new_hire_factory, to_do_user_factory
+):
+    settings.FAKE_SLACK_API = False
+    new_hire = new_hire_factory(slack_user_id="slackx")
+    to_do_user = to_do_user_factory(user=new_hire)
+    client = Mock()
+
+    to_do_blocks = SlackToDoManager(new_hire).get_blocks(
+        [to_do_user.id], text="Here are your to do items"
+    )
+    with patch("slack_bot.utils.Slack.get_client", Mock(return_value=client)):
+        Slack().queue_message(text="before", channel="slackx")
+        Slack().queue_message(
+            blocks=[paragraph("Here are some courses")],
+            text="Here are some courses",
+            channel="slackx",
+        )
+        Slack().queue_message(
+            blocks=to_do_blocks, text="Here are your to do items", channel="slackx"
+        )
+        Slack().queue_message(text="after", channel="slackx")
+        send_queued_messages()
+
+    # The to do message is sent as it is, so its blocks can be read back
+    assert [
+        (call.kwargs["text"], call.kwargs["blocks"])
+        for call in client.chat_postMessage.call_args_list
+    ] == [
+        ("before", []),
+        ("Here are some courses", [paragraph("Here are some courses")]),
+        ("Here are your to do items", to_do_blocks),
+        ("after", []),
+    ]
+
+
+@pytest.mark.django_db
+def test_send_queued_messages_rate_limited(settings):
+    settings.FAKE_SLACK_API = False
+    client = Mock()
+    client.chat_postMessage.side_effect = SlackApiError(
+        "ratelimited", Mock(status_code=429, headers={"Retry-After": "30"})
+    )
+
+    with patch("slack_bot.utils.Slack.get_client", Mock(return_value=client)):
+        Slack().queue_message(text="first", channel="#general")
+        Slack().queue_message(text="second", channel="#random")
+        send_queued_messages()
+
+    # Stopped after the first one and will be retried after the requested time
+    assert client.chat_postMessage.call_count == 1
+    message = SlackMessage.objects.get(text="first")
+    assert message.sent is None
+    assert not message.failed
+    assert message.attempts == 1
+    assert message.send_after > timezone.now() + timedelta(seconds=25)
+    assert list(SlackMessage.objects.due()) == [SlackMessage.objects.get(text="second")]
+
+
+@pytest.mark.django_db
+def test_send_queued_messages_limits(settings, monkeypatch):
+    settings.FAKE_SLACK_API = False
+    client = Mock()
+    monkeypatch.setattr("slack_bot.tasks.MAX_QUEUED_MESSAGES_PER_RUN", 1)
+
+    with patch("slack_bot.utils.Slack.get_client", Mock(return_value=client)):
+        Slack().queue_message(text="first", channel="#general")
+        Slack().queue_message(text="second", channel="#random")
+
+        # Claimed messages are skipped until the claim expires
+        claimed = SlackMessage.objects.claim_next()
+        assert [message.text for message in claimed] == ["first"]
+        assert list(SlackMessage.objects.due()) == [
+            SlackMessage.objects.get(text="second")
+        ]
+
+        # The rest is left for the next run
+        send_queued_messages()
+        assert client.chat_postMessage.call_count == 1
+        assert client.chat_postMessage.call_args.kwargs["text"] == "second"
+
+        with freeze_time(timezone.now() + timedelta(minutes=10)):
+            send_queued_messages()
+        assert client.chat_postMessage.call_count == 2
+        assert client.chat_postMessage.call_args.kwargs["text"] == "first"
+        assert not SlackMessage.objects.due().exists()
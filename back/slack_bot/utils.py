@@ -1,31 +1,65 @@
 import json
+from datetime import timedelta
+from threading import Lock
+from time import monotonic, sleep
 
 import slack_sdk
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Q
-from slack_bolt import App as SlackBoltApp
-from slack_bolt.adapter.socket_mode import SocketModeHandler
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from slack_sdk.errors import SlackApiError
 
 from admin.integrations.models import Integration
 from organization.models import Notification
 
 
 class Slack:
+    # One client is shared by the whole process. The token of the integration is
+    # looked up again when it changed in this process or after `TOKEN_TIMEOUT` seconds,
+    # to pick up changes made by other processes.
+    TOKEN_TIMEOUT = 60
+    DIRECTORY_TIMEOUT = 60 * 10
+
+    _client = None
+    _client_loaded_at = 0
+    _lock = Lock()
+
     def __init__(self):
         if not settings.FAKE_SLACK_API:
-            if not settings.SLACK_USE_SOCKET:
-                team = Integration.objects.get(integration=Integration.Type.SLACK_BOT)
-                self.client = slack_sdk.WebClient(token=team.token)
-            else:
-                if settings.SLACK_BOT_TOKEN != "":
-                    app = SlackBoltApp(token=settings.SLACK_BOT_TOKEN)
-                    handler = SocketModeHandler(app, settings.SLACK_APP_TOKEN)
-                    handler.connect()
-                    self.client = app.client
-                    return
-
-                raise Exception("Access token not available")
+            self.client = self.get_client()
+
+    @classmethod
+    def get_client(cls):
+        with cls._lock:
+            if (
+                cls._client is None
+                or monotonic() - cls._client_loaded_at > cls.TOKEN_TIMEOUT
+            ):
+                token = cls._get_token()
+                if cls._client is None or cls._client.token != token:
+                    cls._client = slack_sdk.WebClient(token=token)
+                cls._client_loaded_at = monotonic()
+            return cls._client
+
+    @staticmethod
+    def _get_token():
+        if not settings.SLACK_USE_SOCKET:
+            return Integration.objects.get(integration=Integration.Type.SLACK_BOT).token
+
+        # Sending messages only needs the bot token, the socket connection is
+        # handled by the app in `slack_bot.views`
+        if settings.SLACK_BOT_TOKEN != "":
+            return settings.SLACK_BOT_TOKEN
+
+        raise Exception("Access token not available")
+
+    @classmethod
+    def clear_client(cls):
+        with cls._lock:
+            cls._client = None
 
     def get_channels(self):
         try:
@@ -68,7 +102,36 @@ class Slack:
         except Exception:
             return []
 
-    def find_by_email(self, email):
+    def get_user_directory(self):
+        """
+        All Slack users by their (lowercased) email address, based on `users.list`.
+        Kept in the cache for `DIRECTORY_TIMEOUT` seconds, so linking many users only
+        costs a few paged calls.
+
+        :return dict: email with the Slack user id
+        """
+        directory = cache.get("slack_directory")
+        if directory is None:
+            directory = {
+                member["profile"]["email"].lower(): member["id"]
+                for member in self.get_all_users()
+                if not member.get("deleted", False)
+                and member.get("profile", {}).get("email", "") != ""
+            }
+            # Don't keep an empty directory around when Slack failed to respond
+            if len(directory):
+                cache.set("slack_directory", directory, self.DIRECTORY_TIMEOUT)
+        return directory
+
+    def find_by_email(self, email, directory=None):
+        # Look the user up in the directory (see `get_user_directory`) if given,
+        # otherwise ask Slack
+        if directory is not None:
+            slack_user_id = directory.get(email.lower())
+            if slack_user_id is None:
+                return False
+            return {"user": {"id": slack_user_id}}
+
         try:
             response = self.client.api_call(
                 "users.lookupByEmail", data={"email": email}
@@ -175,6 +238,90 @@ class Slack:
 
         return response
 
+    def queue_message(self, blocks=[], channel="", text=""):
+        """
+        Same as `send_message`, but the message is sent in the background by
+        `slack_bot.tasks.send_queued_messages`, which keeps Slack's rate limits in
+        mind. Use this for messages where the response of Slack is not needed.
+        """
+        from slack_bot.models import SlackMessage  # avoid circular import
+        from users.models import User
+
+        if channel == "" or channel is None or settings.FAKE_SLACK_API:
+            return self.send_message(blocks=blocks, channel=channel, text=text)
+
+        SlackMessage.objects.create(
+            channel=channel,
+            text=text,
+            blocks=blocks,
+            created_for=User.objects.filter(
+                Q(slack_user_id=channel) | Q(slack_channel_id=channel)
+            ).first(),
+        )
+
+    def send_queued_messages(self, messages):
+        """
+        Send queued messages for one channel to Slack as a single message.
+
+        :param messages list: messages as grouped by `SlackMessage.objects.coalesce`
+        :return int: seconds to wait before sending anything again when Slack is
+            rate limiting, otherwise None
+        """
+        from slack_bot.models import SlackMessage  # avoid circular import
+
+        text = messages[0].text
+        blocks = messages[0].blocks
+        if len(messages) > 1:
+            # Only text messages are combined
+            text = "\n".join(message.text for message in messages)
+
+        message_ids = [message.id for message in messages]
+        error = None
+        try:
+            self.client.chat_postMessage(
+                channel=messages[0].channel, text=text, blocks=blocks
+            )
+        except SlackApiError as e:
+            if e.response.status_code == 429:
+                headers = e.response.headers
+                retry_after = int(
+                    headers.get("Retry-After", headers.get("retry-after", 1))
+                )
+                SlackMessage.objects.filter(id__in=message_ids).update(
+                    send_after=timezone.now() + timedelta(seconds=retry_after),
+                    attempts=F("attempts") + 1,
+                )
+                return retry_after
+            error = str(e)
+        except Exception as e:
+            error = str(e)
+
+        if error is None:
+            SlackMessage.objects.filter(id__in=message_ids).update(
+                sent=timezone.now(), attempts=F("attempts") + 1
+            )
+        else:
+            SlackMessage.objects.filter(id__in=message_ids).update(
+                failed=True, attempts=F("attempts") + 1
+            )
+
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    notification_type=Notification.Type.SENT_SLACK_MESSAGE
+                    if error is None
+                    else Notification.Type.FAILED_SEND_SLACK_MESSAGE,
+                    extra_text=message.text,
+                    created_for_id=message.created_for_id,
+                    description=json.dumps(message.blocks) if error is None else error,
+                    blocks=message.blocks,
+                )
+                for message in messages
+                if message.created_for_id is not None
+            ]
+        )
+        return None
+
     def open_modal(self, trigger_id, view):
         if settings.FAKE_SLACK_API:
             cache.set("slack_trigger_id", trigger_id)
@@ -192,6 +339,32 @@ class Slack:
         return self.client.views_update(view_id=view_id, hash=hash, view=view)
 
 
+class RateLimiter:
+    # Minimum amount of seconds between two calls of the same API method to the same
+    # channel, and between two calls of the same API method in general. Slack allows
+    # about one message per second per channel.
+    CHANNEL_INTERVALS = {"chat.postMessage": 1}
+    METHOD_INTERVALS = {"chat.postMessage": 0.2}
+
+    def __init__(self):
+        self._last_calls = {}
+
+    def wait(self, method, channel=""):
+        for key, interval in [
+            ((method, channel), self.CHANNEL_INTERVALS.get(method, 0)),
+            ((method, ""), self.METHOD_INTERVALS.get(method, 0)),
+        ]:
+            last_call = self._last_calls.get(key)
+            if last_call is not None:
+                remaining = last_call + interval - monotonic()
+                if remaining > 0:
+                    sleep(remaining)
+
+        now = monotonic()
+        self._last_calls[(method, channel)] = now
+        self._last_calls[(method, "")] = now
+
+
 def paragraph(text):
     return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
 
@@ -208,3 +381,11 @@ def button(text, style, value, action_id):
         "value": value,
         "action_id": action_id,
     }
+
+
+@receiver(post_save, sender=Integration)
+@receiver(post_delete, sender=Integration)
+def clear_slack_client(sender, instance, **kwargs):
+    # The token might have changed, get it again on the next message
+    if instance.integration == Integration.Type.SLACK_BOT:
+        Slack.clear_client()
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculates the total and completed tasks of all users, to repair counts "
+        "that got out of sync"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Amount of users that are recalculated at once",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        user_ids = list(
+            get_user_model().objects.order_by("id").values_list("id", flat=True)
+        )
+        for start in range(0, len(user_ids), batch_size):
+            get_user_model().objects.refresh_progress(
+                user_ids[start : start + batch_size]
+            )
+
+        self.stdout.write(f"Recalculated the progress of {len(user_ids)} users")
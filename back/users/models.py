@@ -1,14 +1,16 @@
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
+from itertools import chain
 
 import pyotp
 import pytz
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-from django.db import models
-from django.db.models import CheckConstraint, Q
-from django.template import Context, Template
+from django.db import models, transaction
+from django.db.models import CheckConstraint, Count, F, Q
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
 from django.utils.crypto import get_random_string
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
@@ -18,14 +20,23 @@ from admin.badges.models import Badge
 from admin.introductions.models import Introduction
 from admin.preboarding.models import Preboarding
 from admin.resources.models import CourseAnswer, Resource
-from admin.sequences.models import Condition
+from admin.sequences.models import (
+    Condition,
+    ConditionSchedule,
+    ConditionTriggerCounter,
+)
 from admin.to_do.models import ToDo
 from misc.fernet_fields import EncryptedTextField
 from misc.models import File
 from organization.models import Notification
 from slack_bot.utils import Slack, paragraph
 
-from .utils import CompletedFormCheck
+from .utils import (
+    CompletedFormCheck,
+    render_template,
+    workday_of,
+    workday_to_date,
+)
 
 
 class Department(models.Model):
@@ -45,6 +56,77 @@ class CustomUserManager(BaseUserManager):
         # Make validation case sensitive
         return self.get(**{self.model.USERNAME_FIELD + "__iexact": email})
 
+    def refresh_progress(self, user_ids):
+        """
+        Recalculate the progress of the given users from scratch, with a fixed
+        amount of queries. Completed items are counted incrementally, this is used
+        when the assigned items changed and to repair drift.
+
+        :param user_ids list: ids of the users that need to be recalculated
+        :return dict: user id with a tuple of the total and completed tasks
+        """
+        user_ids = list(user_ids)
+        to_dos = {user_id: set() for user_id in user_ids}
+        courses = {user_id: set() for user_id in user_ids}
+
+        # Items that are scheduled through conditions and items that were assigned
+        for user_id, to_do_id in chain(
+            Condition.objects.filter(
+                user__id__in=user_ids, to_do__isnull=False
+            ).values_list("user__id", "to_do__id"),
+            self.filter(id__in=user_ids, to_do__isnull=False).values_list(
+                "id", "to_do__id"
+            ),
+        ):
+            to_dos[user_id].add(to_do_id)
+        for user_id, resource_id in chain(
+            Condition.objects.filter(
+                user__id__in=user_ids, resources__course=True
+            ).values_list("user__id", "resources__id"),
+            self.filter(id__in=user_ids, resources__course=True).values_list(
+                "id", "resources__id"
+            ),
+        ):
+            courses[user_id].add(resource_id)
+
+        completed = dict.fromkeys(user_ids, 0)
+        for user_id, amount in chain(
+            ToDoUser.objects.filter(user__id__in=user_ids, completed=True)
+            .values("user")
+            .annotate(amount=Count("id"))
+            .values_list("user", "amount"),
+            ResourceUser.objects.filter(
+                user__id__in=user_ids, resource__course=True, completed_course=True
+            )
+            .values("user")
+            .annotate(amount=Count("id"))
+            .values_list("user", "amount"),
+        ):
+            completed[user_id] += amount
+
+        progress = {
+            user_id: (len(to_dos[user_id]) + len(courses[user_id]), completed[user_id])
+            for user_id in user_ids
+        }
+        self.bulk_update(
+            [
+                self.model(id=user_id, total_tasks=total, completed_tasks=done)
+                for user_id, (total, done) in progress.items()
+            ],
+            ["total_tasks", "completed_tasks"],
+        )
+        return progress
+
+    def add_completed_tasks(self, item, amount):
+        # Completing (or reopening) an item only changes the completed count
+        self.filter(id=item.user_id).update(
+            completed_tasks=F("completed_tasks") + amount
+        )
+        # The user of the item might be saved later on, so it shouldn't hold on to
+        # the old count
+        if type(item).user.is_cached(item):
+            item.user.refresh_from_db(fields=["completed_tasks"])
+
 
 class ManagerSlackManager(models.Manager):
     def get_queryset(self):
@@ -83,6 +165,67 @@ class NewHireManager(models.Manager):
             is_introduced_to_colleagues=False, start_day__gte=datetime.now().date()
         )
 
+    def at_local_hour(self, hour, start_day_lookup=None, weekdays_only=False):
+        """
+        New hires for whom it's currently `hour` o'clock in their own timezone, in
+        one query. Timezones are grouped by their current local date, so the start
+        day can be compared with it as well.
+
+        :param hour int: the local hour
+        :param start_day_lookup str: optional lookup (i.e. "exact" or "lte") to
+            compare the start day with the local date
+        :param weekdays_only bool: skip new hires for whom it's weekend
+        """
+        from organization.models import Organization  # avoid circular import
+
+        now = pytz.utc.localize(datetime.now())
+        org = Organization.object.get()
+        # New hires without a timezone use the one of the organization
+        timezones = [(timezone, timezone) for timezone in pytz.all_timezones]
+        timezones.append(("", org.timezone))
+
+        local_dates = {}
+        for user_timezone, timezone in timezones:
+            local_datetime = now.astimezone(pytz.timezone(timezone))
+            if local_datetime.hour == hour:
+                local_dates.setdefault(local_datetime.date(), []).append(user_timezone)
+
+        query = Q(pk__in=[])
+        for local_date, user_timezones in local_dates.items():
+            if weekdays_only and local_date.weekday() >= 5:
+                continue
+            bucket = Q(timezone__in=user_timezones)
+            if start_day_lookup is not None:
+                bucket &= Q(**{f"start_day__{start_day_lookup}": local_date})
+            query |= bucket
+        return self.get_queryset().filter(query)
+
+    def with_workday(self, users=None, holidays=()):
+        """
+        Load the new hires with their `workday` already filled in. The local date is
+        only calculated once per timezone, instead of once per new hire.
+
+        :param users queryset: the new hires to load, defaults to all new hires
+        :param holidays list: optional dates that are not a workday
+        """
+        from organization.models import Organization  # avoid circular import
+
+        users = list(self.get_queryset() if users is None else users)
+        org = Organization.object.get()
+        now = pytz.utc.localize(datetime.now())
+        local_days = {}
+        for user in users:
+            user_timezone = user.timezone or org.timezone
+            if user_timezone not in local_days:
+                local_days[user_timezone] = now.astimezone(
+                    pytz.timezone(user_timezone)
+                ).date()
+            # Sets the cached property
+            user.workday = workday_of(
+                user.start_day, local_days[user_timezone], holidays
+            )
+        return users
+
     # def with_ldap(self):
     #     return self.get_queryset().exclude(ldap='False')
     
@@ -284,27 +427,9 @@ class User(AbstractBaseUser):
         ]
 
     def update_progress(self):
-        all_to_do_ids = list(
-            self.conditions.values_list("to_do__id", flat=True)
-        ) + list(self.to_do.values_list("id", flat=True))
-        all_course_ids = list(
-            self.conditions.filter(resources__course=True).values_list(
-                "resources__id", flat=True
-            )
-        ) + list(self.resources.filter(course=True).values_list("id", flat=True))
-
-        # remove duplicates
-        all_to_do_ids = list(dict.fromkeys(all_to_do_ids))
-        all_course_ids = list(dict.fromkeys(all_course_ids))
-
-        completed_to_dos = ToDoUser.objects.filter(user=self, completed=True).count()
-        completed_courses = ResourceUser.objects.filter(
-            resource__course=True, user=self, completed_course=True
-        ).count()
-
-        self.total_tasks = len(all_to_do_ids + all_course_ids)
-        self.completed_tasks = completed_to_dos + completed_courses
-        self.save()
+        self.total_tasks, self.completed_tasks = User.objects.refresh_progress(
+            [self.id]
+        )[self.id]
 
     def has_perm(self, perm, obj=None):
         return self.is_staff
@@ -312,9 +437,21 @@ class User(AbstractBaseUser):
     def has_module_perms(self, app_label):
         return self.is_superuser
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep track of the values the timed conditions were scheduled with
+        loaded_values = dict(zip(field_names, values))
+        instance._schedule_values = (
+            loaded_values.get("start_day"),
+            loaded_values.get("timezone"),
+        )
+        return instance
+
     def save(self, *args, **kwargs):
         self.email = self.email.lower()
-        if not self.pk:
+        is_new = self.pk is None
+        if is_new:
             self.totp_secret = pyotp.random_base32()
             while True:
                 unique_string = get_random_string(length=8)
@@ -323,6 +460,18 @@ class User(AbstractBaseUser):
             self.unique_url = unique_string
         super(User, self).save(*args, **kwargs)
 
+        # New users don't have conditions yet, those get scheduled when added
+        schedule_values = (self.start_day, self.timezone)
+        if not is_new and getattr(self, "_schedule_values", None) != schedule_values:
+            ConditionSchedule.objects.refresh_for_users([self.id])
+        self._schedule_values = schedule_values
+        # The saved values might differ from the ones used to personalize so far
+        self.__dict__.pop("personalization_context", None)
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.__dict__.pop("personalization_context", None)
+
     def add_sequences(self, sequences):
         for sequence in sequences:
             sequence.assign_to_user(self)
@@ -332,37 +481,20 @@ class User(AbstractBaseUser):
                 created_for=self,
                 extra_text=sequence.name,
             )
+        self.update_progress()
 
     def remove_sequence(self, sequence):
         sequence.remove_from_user(self)
+        self.update_progress()
 
     @cached_property
     def workday(self):
-        start_day = self.start_day
-        local_day = self.get_local_time().date()
-
-        if start_day > local_day:
-            return 0
-
-        amount_of_workdays = 1
-        while local_day != start_day:
-            start_day += timedelta(days=1)
-            if start_day.weekday() not in [5, 6]:
-                amount_of_workdays += 1
-
-        return amount_of_workdays
+        return workday_of(self.start_day, self.get_local_time().date())
 
     def workday_to_datetime(self, workdays):
-        start_day = self.start_day
         if workdays == 0:
             return None
-
-        start = 1
-        while start != workdays:
-            start_day += timedelta(days=1)
-            if start_day.weekday() not in [5, 6]:
-                start += 1
-        return start_day
+        return workday_to_date(self.start_day, workdays)
 
     @cached_property
     def days_before_starting(self):
@@ -391,8 +523,8 @@ class User(AbstractBaseUser):
         )
         return us_tz.normalize(local.astimezone(us_tz))
 
-    def personalize(self, text, extra_values={}):
-        t = Template(text)
+    @cached_property
+    def personalization_context(self):
         department = ""
         manager = ""
         manager_email = ""
@@ -406,7 +538,7 @@ class User(AbstractBaseUser):
         if self.buddy is not None:
             buddy = self.buddy.full_name
             buddy_email = self.buddy.email
-        new_hire_context = {
+        return {
             "manager": manager,
             "buddy": buddy,
             "position": self.position,
@@ -419,7 +551,9 @@ class User(AbstractBaseUser):
             "manager_email": manager_email,
             "department": department,
         }
-        text = t.render(Context(new_hire_context | extra_values))
+
+    def personalize(self, text, extra_values={}):
+        text = render_template(text, self.personalization_context | extra_values)
         # Remove non breakable space html code (if any). These could show up in the
         # Slack bot.
         text = text.replace("&nbsp;", " ")
@@ -454,6 +588,24 @@ class User(AbstractBaseUser):
         return "%s" % self.full_name
 
 
+@receiver(m2m_changed, sender=User.conditions.through)
+def refresh_user_conditions(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep the timed condition schedule and the trigger counters in sync with the
+    # conditions of a user
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+
+    if not reverse:
+        ConditionSchedule.objects.refresh_for_users([instance.id])
+        ConditionTriggerCounter.objects.refresh_for_users([instance.id])
+    elif action == "post_clear":
+        ConditionSchedule.objects.filter(condition=instance).delete()
+        ConditionTriggerCounter.objects.filter(condition=instance).delete()
+    else:
+        ConditionSchedule.objects.refresh_for_users(pk_set)
+        ConditionTriggerCounter.objects.refresh_for_users(pk_set)
+
+
 class ToDoUserManager(models.Manager):
     def all_to_do(self, user):
         return super().get_queryset().filter(user=user, completed=False)
@@ -492,12 +644,29 @@ class ToDoUser(CompletedFormCheck, models.Model):
     def mark_completed(self):
         from admin.sequences.tasks import process_condition
 
-        self.completed = True
-        self.save()
-
         # Get conditions with this to do item as (part of the) condition
         conditions = self.user.conditions.filter(condition_to_do=self.to_do)
 
+        with transaction.atomic():
+            # Lock the item, so two requests can't both complete it
+            was_completed = (
+                ToDoUser.objects.select_for_update()
+                .values_list("completed", flat=True)
+                .get(id=self.id)
+            )
+            self.completed = True
+            self.save()
+
+            # Conditions that have all their to do items completed now
+            triggered_condition_ids = []
+            if not was_completed:
+                triggered_condition_ids = (
+                    ConditionTriggerCounter.objects.complete_trigger(
+                        self.user, conditions
+                    )
+                )
+                User.objects.add_completed_tasks(self, 1)
+
         # Send answers back to slack channel?
         if self.to_do.send_back:
             blocks = [
@@ -521,21 +690,39 @@ class ToDoUser(CompletedFormCheck, models.Model):
                 channel=self.to_do.slack_channel.name,
             )
 
-        for condition in conditions:
-            condition_to_do_ids = condition.condition_to_do.values_list("id", flat=True)
+        for condition_id in triggered_condition_ids:
+            # Send notification only if user has a slack account
+            process_condition(condition_id, self.user.id, self.user.has_slack_account)
 
-            # Check if all to do items already have been added to new hire and are
-            # completed. If not, then we know it should not be triggered yet
-            to_do_user = ToDoUser.objects.filter(
-                to_do__in=condition_to_do_ids, user=self.user, completed=True
+    def reopen(self):
+        with transaction.atomic():
+            was_completed = (
+                ToDoUser.objects.select_for_update()
+                .values_list("completed", flat=True)
+                .get(id=self.id)
             )
+            self.completed = False
+            self.form = []
+            self.save()
 
-            # If the amount matches, then we should process it
-            if to_do_user.count() == len(condition_to_do_ids):
-                # Send notification only if user has a slack account
-                process_condition(
-                    condition.id, self.user.id, self.user.has_slack_account
+            if was_completed:
+                ConditionTriggerCounter.objects.reopen_trigger(
+                    self.user, self.user.conditions.filter(condition_to_do=self.to_do)
                 )
+                User.objects.add_completed_tasks(self, -1)
+
+
+@receiver(post_delete, sender=ToDoUser)
+def reopen_deleted_to_do_user(sender, instance, **kwargs):
+    # A completed to do item that got removed doesn't count anymore
+    if instance.completed:
+        ConditionTriggerCounter.objects.reopen_trigger(
+            instance.user_id,
+            Condition.objects.filter(
+                user__id=instance.user_id, condition_to_do__id=instance.to_do_id
+            ),
+        )
+        User.objects.add_completed_tasks(instance, -1)
 
 
 class PreboardingUser(CompletedFormCheck, models.Model):
@@ -587,8 +774,8 @@ class ResourceUser(models.Model):
             self.save()
 
             # Up one for completed stat in user
-            self.user.completed_tasks += 1
-            self.user.save()
+            if self.resource.course:
+                User.objects.add_completed_tasks(self, 1)
             return None
 
         # Skip over any folders
@@ -645,6 +832,28 @@ class ResourceUser(models.Model):
             return None
         return self.answers.get(chapter=chapter)
 
+    def reopen(self):
+        with transaction.atomic():
+            was_completed = (
+                ResourceUser.objects.select_for_update()
+                .values_list("completed_course", flat=True)
+                .get(id=self.id)
+            )
+            self.completed_course = False
+            self.step = 0
+            self.answers.clear()
+            self.save()
+
+            if was_completed and self.resource.course:
+                User.objects.add_completed_tasks(self, -1)
+
+
+@receiver(post_delete, sender=ResourceUser)
+def reopen_deleted_resource_user(sender, instance, **kwargs):
+    # A completed course that got removed doesn't count anymore
+    if instance.completed_course and instance.resource.course:
+        User.objects.add_completed_tasks(instance, -1)
+
 
 class NewHireWelcomeMessage(models.Model):
     # messages placed through the slack bot
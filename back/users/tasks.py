@@ -20,17 +20,15 @@ def hourly_check_for_new_hire_send_credentials():
     if org is None or not org.new_hire_email:
         return
 
-    for new_hire in get_user_model().new_hires.all():
-        new_hire_datetime = new_hire.get_local_time()
-        if (
-            new_hire_datetime.date() == new_hire.start_day
-            and new_hire_datetime.hour == 8
-        ):
-            # Trigger task above to schedule sending credentials
-            # In case an email address is incorrect (or not available), it will
-            # not block the rest of the emails
-            async_task(
-                "users.tasks.send_new_hire_creds",
-                new_hire.id,
-                task_name=f"Sending login credentials: {new_hire.full_name}",
-            )
+    # New hires that start today and for whom it's 8 am
+    for new_hire in get_user_model().new_hires.at_local_hour(
+        8, start_day_lookup="exact"
+    ):
+        # Trigger task above to schedule sending credentials
+        # In case an email address is incorrect (or not available), it will
+        # not block the rest of the emails
+        async_task(
+            "users.tasks.send_new_hire_creds",
+            new_hire.id,
+            task_name=f"Sending login credentials: {new_hire.full_name}",
+        )
@@ -2,12 +2,14 @@ import datetime
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from freezegun import freeze_time
 
 from organization.models import Organization
 from users.tasks import hourly_check_for_new_hire_send_credentials
 
-from .models import OTPRecoveryKey, User
+from .models import OTPRecoveryKey, ToDoUser, User
+from .utils import compile_template, workday_of, workday_to_date
 
 
 @pytest.mark.django_db
@@ -62,6 +64,79 @@ def test_workday(date, workday, new_hire_factory):
     freezer.stop()
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "workdays, date, holidays",
+    [
+        (1, "2021-01-12", []),
+        (4, "2021-01-15", []),
+        (5, "2021-01-18", []),
+        (25, "2021-02-15", []),
+        # Holidays are skipped, holidays in the weekend don't matter
+        (4, "2021-01-18", ["2021-01-14"]),
+        (4, "2021-01-15", ["2021-01-16"]),
+        (5, "2021-01-20", ["2021-01-18", "2021-01-19"]),
+    ],
+)
+def test_workday_to_date(workdays, date, holidays):
+    # Start day on Tuesday
+    start_day = datetime.date(2021, 1, 12)
+    holidays = [datetime.date.fromisoformat(day) for day in holidays]
+    date = datetime.date.fromisoformat(date)
+
+    assert workday_to_date(start_day, workdays, holidays) == date
+    assert workday_of(start_day, date, holidays) == workdays
+
+
+@pytest.mark.django_db
+def test_new_hires_with_workday(new_hire_factory, django_assert_max_num_queries):
+    new_hire1 = new_hire_factory(start_day=datetime.date(2021, 1, 12))
+    new_hire2 = new_hire_factory(start_day=datetime.date(2021, 1, 18))
+    new_hire3 = new_hire_factory(start_day=datetime.date(2021, 1, 20))
+
+    with freeze_time("2021-01-18"):
+        # Doesn't depend on the amount of new hires
+        with django_assert_max_num_queries(3):
+            new_hires = {
+                new_hire.id: new_hire.workday
+                for new_hire in User.new_hires.with_workday()
+            }
+
+        assert new_hires == {new_hire1.id: 5, new_hire2.id: 1, new_hire3.id: 0}
+        assert new_hires[new_hire1.id] == User.objects.get(id=new_hire1.id).workday
+
+
+@pytest.mark.django_db
+def test_new_hires_at_local_hour(new_hire_factory):
+    org = Organization.object.get()
+    org.timezone = "UTC"
+    org.save()
+
+    with freeze_time("2021-01-12 07:00:00"):
+        today = datetime.date(2021, 1, 12)
+        new_hire1 = new_hire_factory(timezone="Europe/Amsterdam", start_day=today)
+        new_hire2 = new_hire_factory(
+            timezone="Europe/Amsterdam", start_day=today + datetime.timedelta(days=1)
+        )
+        new_hire_factory(timezone="", start_day=today)
+        new_hire_factory(timezone="America/New_York", start_day=today)
+
+        assert set(User.new_hires.at_local_hour(8)) == {new_hire1, new_hire2}
+        assert list(User.new_hires.at_local_hour(8, start_day_lookup="exact")) == [
+            new_hire1
+        ]
+
+        # Organization timezone is used when the new hire doesn't have one
+        org.timezone = "Europe/Amsterdam"
+        org.save()
+        assert User.new_hires.at_local_hour(8).count() == 3
+
+    # No one on weekends
+    with freeze_time("2021-01-16 07:00:00"):
+        assert User.new_hires.at_local_hour(8).count() == 3
+        assert not User.new_hires.at_local_hour(8, weekdays_only=True).exists()
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "first_name, last_name, initials, full_name",
@@ -178,6 +253,97 @@ def test_personalize(manager_factory, new_hire_factory, department_factory):
     assert new_hire.personalize(text_without_spaces) == expected_output
 
 
+@pytest.mark.django_db
+def test_personalize_cache(
+    new_hire_factory, manager_factory, django_assert_num_queries
+):
+    compile_template.cache_clear()
+    manager = manager_factory(first_name="Jane", last_name="Doe")
+    new_hire = new_hire_factory(first_name="John", manager=manager)
+    new_hire = User.objects.get(id=new_hire.id)
+
+    # Manager is only loaded once
+    with django_assert_num_queries(1):
+        for _ in range(5):
+            assert new_hire.personalize("Hi {{ first_name }}") == "Hi John"
+            assert new_hire.personalize("{{ manager }}") == "Jane Doe"
+
+    # Templates are only compiled once
+    assert compile_template.cache_info().misses == 2
+
+    # Text without tags doesn't go through the template engine
+    assert new_hire.personalize("Hi&nbsp;there") == "Hi there"
+    assert compile_template.cache_info().misses == 2
+
+    # Extra values are used as well
+    assert new_hire.personalize("{{ first_name }} {{ x }}", {"x": 1}) == "John 1"
+
+    # Saving or reloading the new hire picks up the new values
+    new_hire.first_name = "Johnny"
+    new_hire.save()
+    assert new_hire.personalize("Hi {{ first_name }}") == "Hi Johnny"
+
+    User.objects.filter(id=new_hire.id).update(first_name="Jo")
+    new_hire.refresh_from_db()
+    assert new_hire.personalize("Hi {{ first_name }}") == "Hi Jo"
+
+
+@pytest.mark.django_db
+def test_progress_counters(
+    new_hire_factory, sequence_factory, condition_timed_factory, to_do_factory
+):
+    new_hire = new_hire_factory()
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+    sequence = sequence_factory()
+    condition_timed_factory(sequence=sequence, days=2).to_do.add(to_do1, to_do2)
+
+    new_hire.add_sequences([sequence])
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 2
+    assert new_hire.completed_tasks == 0
+
+    # Items that are both scheduled and assigned only count once
+    new_hire.to_do.add(to_do1)
+    new_hire.update_progress()
+    assert new_hire.total_tasks == 2
+
+    to_do_user = ToDoUser.objects.create(user=new_hire, to_do=to_do1)
+    to_do_user.mark_completed()
+    to_do_user.mark_completed()
+    new_hire.refresh_from_db()
+    assert new_hire.completed_tasks == 1
+
+    to_do_user.reopen()
+    new_hire.refresh_from_db()
+    assert new_hire.completed_tasks == 0
+
+    to_do_user.mark_completed()
+    to_do_user.delete()
+    new_hire.refresh_from_db()
+    assert new_hire.completed_tasks == 0
+
+    # Saving the (already loaded) new hire of the item doesn't undo the progress
+    to_do_user = ToDoUser.objects.get(
+        id=ToDoUser.objects.create(user=new_hire, to_do=to_do2).id
+    )
+    loaded_new_hire = to_do_user.user
+    to_do_user.mark_completed()
+    loaded_new_hire.first_name = "Changed"
+    loaded_new_hire.save()
+    new_hire.refresh_from_db()
+    assert new_hire.first_name == "Changed"
+    assert new_hire.completed_tasks == 1
+    to_do_user.delete()
+
+    # Repair counts that got out of sync
+    User.objects.filter(id=new_hire.id).update(total_tasks=0, completed_tasks=5)
+    call_command("reconcile_progress")
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 2
+    assert new_hire.completed_tasks == 0
+
+
 @pytest.mark.django_db
 def test_new_hire_manager(new_hire_factory):
     new_hire_factory(
@@ -1,3 +1,102 @@
+from bisect import bisect_right
+from datetime import date, timedelta
+from functools import lru_cache
+
+from django.template import Context, Template
+
+# date(1, 1, 1) is a Monday, every weekday is counted from there
+EPOCH = date(1, 1, 1)
+
+
+def _weekdays_before(day):
+    # Amount of weekdays from the epoch up to (not including) `day`
+    weeks, days = divmod((day - EPOCH).days, 7)
+    return weeks * 5 + min(days, 5)
+
+
+def _weekday_at(index):
+    # The weekday with number `index` (0 based) counted from the epoch
+    weeks, days = divmod(index, 5)
+    return EPOCH + timedelta(days=weeks * 7 + days)
+
+
+def _sorted_holidays(holidays):
+    # Holidays in the weekend don't change anything
+    return sorted({day for day in holidays if day.weekday() < 5})
+
+
+def _holidays_between(holidays, start_day, end_day):
+    # Amount of (sorted) holidays after `start_day` up to and including `end_day`
+    return bisect_right(holidays, end_day) - bisect_right(holidays, start_day)
+
+
+def count_workdays(start_day, end_day, holidays=()):
+    """
+    Amount of workdays after `start_day` up to and including `end_day`.
+
+    :param start_day date: day to start counting from (not included)
+    :param end_day date: last day that is counted
+    :param holidays list: optional dates that are not a workday
+    """
+    if end_day <= start_day:
+        return 0
+    holidays = _sorted_holidays(holidays)
+    return (
+        _weekdays_before(end_day + timedelta(days=1))
+        - _weekdays_before(start_day + timedelta(days=1))
+        - _holidays_between(holidays, start_day, end_day)
+    )
+
+
+def workday_to_date(start_day, workdays, holidays=()):
+    # The start day always counts as the first workday, every weekday after that adds
+    # one to the count
+    if workdays <= 1:
+        return start_day
+
+    holidays = _sorted_holidays(holidays)
+    first = _weekdays_before(start_day + timedelta(days=1))
+    day = _weekday_at(first + workdays - 2)
+    # Every holiday that was skipped pushes the day forward with another workday
+    skipped = _holidays_between(holidays, start_day, day)
+    while skipped:
+        previous_day = day
+        day = _weekday_at(_weekdays_before(day) + skipped)
+        skipped = _holidays_between(holidays, previous_day, day)
+    return day
+
+
+def workday_of(start_day, day, holidays=()):
+    """
+    Number of the workday `day` is for someone who started on `start_day`. The start
+    day is always workday 1 and days before that are workday 0.
+    """
+    if start_day > day:
+        return 0
+    return 1 + count_workdays(start_day, day, holidays)
+
+
+@lru_cache(maxsize=1024)
+def compile_template(text):
+    # The same texts (content blocks, titles, subjects) get rendered over and over
+    # again, only compile them once
+    return Template(text)
+
+
+def render_template(text, context):
+    """
+    Render `text` as a Django template. Text without any template tags is returned
+    as is, without going through the template engine.
+
+    :param text str: the text that might contain template tags
+    :param context dict: values that can be used in the text
+    """
+    text = str(text)
+    if "{{" not in text and "{%" not in text and "{#" not in text:
+        return text
+    return compile_template(text).render(Context(context))
+
+
 class CompletedFormCheck:
     @property
     def completed_form_items(self):